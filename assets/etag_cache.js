@@ -0,0 +1,57 @@
+// =================================================================================================
+// CALLBACK ETAG CACHE
+// Browsers never revalidate POST responses, and Dash sends every callback as
+// a POST, so this keeps the last few callback responses that came with an
+// ETag and sends the tag back as If-None-Match with the same request; when
+// the server answers 304 Not Modified, Dash gets the kept copy instead
+// (see compression.py)
+// =================================================================================================
+(function () {
+    var maxEntries = 16;
+    var entries = new Map();
+    var originalFetch = window.fetch.bind(window);
+
+    window.fetch = function (input, init) {
+        var url = typeof input === 'string' ? input : (input && input.url) || '';
+        if (!init || init.method !== 'POST' || typeof init.body !== 'string' || url.indexOf('_dash-update-component') === -1) {
+            return originalFetch(input, init);
+        }
+
+        // -----------------------------------------------------------------------------------------
+        // Same request as one we have the answer to: ask if it changed
+        // -----------------------------------------------------------------------------------------
+        var key = url + '\n' + init.body;
+        var entry = entries.get(key);
+        var headers = new Headers(init.headers || {});
+        if (entry) {
+            headers.set('If-None-Match', entry.etag);
+        }
+
+        return originalFetch(input, Object.assign({}, init, {headers: headers})).then(function (response) {
+            // -------------------------------------------------------------------------------------
+            // It didn't
+            // -------------------------------------------------------------------------------------
+            if (response.status === 304 && entry) {
+                entries.delete(key);
+                entries.set(key, entry);
+                return new Response(entry.body, {status: 200, headers: {'Content-Type': entry.type}});
+            }
+
+            // -------------------------------------------------------------------------------------
+            // New answer; keep it, dropping the oldest past the limit
+            // -------------------------------------------------------------------------------------
+            var etag = response.headers.get('ETag');
+            if (response.status !== 200 || !etag) {
+                return response;
+            }
+            return response.clone().text().then(function (body) {
+                entries.delete(key);
+                entries.set(key, {etag: etag, body: body, type: response.headers.get('Content-Type') || 'application/json'});
+                while (entries.size > maxEntries) {
+                    entries.delete(entries.keys().next().value);
+                }
+                return response;
+            });
+        });
+    };
+})();
@@ -0,0 +1,87 @@
+# ==================================================================================================
+# BENCHMARK: figure builders
+# Compares plotly.express with the fast builder (fast_charts.py) on the three
+# bar charts the pages mark as fast, using synthetic workbooks at 1x, 10x and
+# 100x today's size, and checks that both give the same figure
+#
+#     python bench_figures.py [repeats] [scales...]
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import sys
+import time
+import contextlib
+
+# ------------------------------------------------------------------------------
+# No reload or ingest threads while benchmarking
+# ------------------------------------------------------------------------------
+os.environ.setdefault("CHOLT_RELOAD_INTERVAL", "0")
+os.environ.setdefault("CHOLT_INGEST_INTERVAL", "0")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from initialize import init_dict
+    import page_splash
+    import page_shows
+    from lib import build_bar
+    from dataset import Dataset
+    from derived import get_derived
+    from layout_cache import to_json_plotly
+    from synthetic import make_synthetic_data, get_synthetic_sizes
+
+# ==================================================================================================
+# The charts: derived table, x, y and colour, as the pages draw them
+# ==================================================================================================
+bench_charts = {}
+bench_charts['songs_by_artist'] = ('num_songs_by_artist',   'Originating Artist',         ['Number of Songs Played'], "CH Original")
+bench_charts['songs_by_year']   = ('num_songs_by_year',     "Year of Song's Origination", ['Number of Songs Played'], "")
+bench_charts['songs_by_show']   = ('shows_by_series_index', 'Show Title',                 ['Count'],                  "")
+
+# ------------------------------------------------------------------------------
+# The style the pages pass in, so the charts get the same template
+# ------------------------------------------------------------------------------
+style = init_dict['style_default']
+
+# ==================================================================================================
+# Helpers
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Best of n wall-clock times; the builders are called directly, so the figure
+# cache never gets a look in
+# ------------------------------------------------------------------------------
+def time_it(func, repeats):
+    best = None
+    out = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        out = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    scales  = [float(scale) for scale in sys.argv[2:]] or [1, 10, 100]
+
+    print("{:<16} {:>6} {:>8} {:>10} {:>10} {:>9}".format("chart", "scale", "rows", "px (s)", "fast (s)", "speedup"))
+    for scale in scales:
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = Dataset(make_synthetic_data(**get_synthetic_sizes(scale)), "bench-figures-" + str(scale))
+
+        for chart, (name, x, y, color) in bench_charts.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                df = get_derived(name, data)
+
+            px_time,   px_figure   = time_it(lambda: build_bar(df, x, y, color, style, '', 'px'), repeats)
+            fast_time, fast_figure = time_it(lambda: build_bar(df, x, y, color, style, '', 'fast'), repeats)
+
+            if to_json_plotly(px_figure) != to_json_plotly(fast_figure):
+                print("MISMATCH for " + chart + " at scale " + str(scale))
+
+            print("{:<16} {:>6} {:>8} {:>10.4f} {:>10.4f} {:>8.1f}x".format(chart, "{:g}x".format(scale), len(df), px_time, fast_time, px_time / fast_time))
@@ -0,0 +1,59 @@
+# ==================================================================================================
+# BENCHMARK: workbook parsing
+# Compares parsing the workbook serially with parsing its sheets side by side
+# in worker processes (lib.read_workbook), checking that both give the same
+# sheets
+#
+#     python bench_load.py [repeats] [processes...]
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import sys
+import time
+import contextlib
+
+from lib import read_workbook
+
+# ==================================================================================================
+# Helpers
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Best of n wall-clock times, with the progress messages swallowed
+# ------------------------------------------------------------------------------
+def time_it(func, repeats):
+    best = None
+    out = None
+    for i in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            out = func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    counts  = [int(arg) for arg in sys.argv[2:]] or sorted(set([2, 4, os.cpu_count() or 1]))
+    data_fname = os.path.join("data","cholt_data.xlsx")
+
+    serial_time, serial_data = time_it(lambda: read_workbook(data_fname, processes=1), repeats)
+
+    print("cores: " + str(os.cpu_count()))
+    print("{:>10} {:>10} {:>9}".format("processes", "time (s)", "speedup"))
+    print("{:>10} {:>10.3f} {:>8.2f}x".format(1, serial_time, 1.0))
+    for processes in counts:
+        if processes <= 1:
+            continue
+        parallel_time, parallel_data = time_it(lambda: read_workbook(data_fname, processes=processes), repeats)
+
+        if list(parallel_data) != list(serial_data) or not all(parallel_data[sheet].equals(serial_data[sheet]) for sheet in serial_data):
+            print("MISMATCH with " + str(processes) + " processes")
+
+        print("{:>10} {:>10.3f} {:>8.2f}x".format(processes, parallel_time, serial_time / parallel_time))
@@ -0,0 +1,156 @@
+# ==================================================================================================
+# BENCHMARK: memory per worker
+# Starts several worker processes the way gunicorn would (each one importing
+# the app and loading the data for itself), renders every page in each, and
+# compares their memory with and without CHOLT_SHARED
+# - RSS counts every page a worker has touched, shared or not, so it looks
+#   the same either way; PSS splits shared pages between the processes using
+#   them, and private is what only that worker has, which is what adding a
+#   worker really costs
+# - Read from /proc/<pid>/smaps_rollup, so Linux only
+# - --scale runs on a synthetic workbook (see synthetic.py) that many times
+#   today's size, written to a temporary folder first
+#
+#     python bench_memory.py [--workers 4] [--scale 10] [--compact]
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import sys
+import shutil
+import argparse
+import warnings
+import tempfile
+import contextlib
+import subprocess
+
+# ==================================================================================================
+# Settings
+# - No reload or ingest threads, metrics or layout cache in the workers
+# ==================================================================================================
+worker_env = {}
+worker_env['CHOLT_RELOAD_INTERVAL'] = "0"
+worker_env['CHOLT_INGEST_INTERVAL'] = "0"
+worker_env['CHOLT_METRICS']         = "0"
+worker_env['CHOLT_LAYOUT_CACHE']    = "0"
+
+modes = {}
+modes['default'] = {'CHOLT_SHARED':"0"}
+modes['shared']  = {'CHOLT_SHARED':"1"}
+
+smaps_fields = {'Rss':'rss', 'Pss':'pss', 'Private_Clean':'private', 'Private_Dirty':'private'}
+
+# ==================================================================================================
+# The worker
+# - Loads the app, renders every page so the derived tables are built, says
+#   it's ready, and then waits until the parent closes its stdin
+# ==================================================================================================
+def run_worker():
+    with contextlib.redirect_stdout(io.StringIO()):
+        import index
+        for page in index.pages:
+            index.display_page(index.pages[page]['href'])
+    print("ready", flush=True)
+    sys.stdin.read()
+
+# ==================================================================================================
+# Helpers
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# A process's memory in MB
+# ------------------------------------------------------------------------------
+def get_memory(pid):
+    out = {'rss':0, 'pss':0, 'private':0}
+    with open("/proc/" + str(pid) + "/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0].rstrip(':') in smaps_fields:
+                out[smaps_fields[parts[0].rstrip(':')]] += int(parts[1]) / 1024.0
+    return out
+
+# ------------------------------------------------------------------------------
+# Start the workers for one mode one after the other, measure them all once
+# every one is ready, then stop them
+# - One worker is started and stopped first, so that the snapshot and the
+#   shared files are already written, as they would be on a server that has
+#   been up since the workbook last changed
+# ------------------------------------------------------------------------------
+def measure_mode(mode, workers, cwd, compact):
+    env = dict(os.environ)
+    env.update(worker_env)
+    env.update(modes[mode])
+    env['CHOLT_COMPACT'] = "1" if compact else "0"
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH', "")])
+
+    stop_worker(start_worker(mode, cwd, env))
+    procs = []
+    try:
+        for i in range(workers):
+            procs.append(start_worker(mode, cwd, env))
+        return [get_memory(proc.pid) for proc in procs]
+    finally:
+        for proc in procs:
+            stop_worker(proc)
+
+def start_worker(mode, cwd, env):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker"], cwd=cwd, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if proc.stdout.readline().strip() != "ready":
+        stop_worker(proc)
+        raise RuntimeError("A " + mode + " worker didn't start")
+    return proc
+
+def stop_worker(proc):
+    proc.stdin.close()
+    proc.wait()
+
+# ------------------------------------------------------------------------------
+# A folder with a synthetic workbook in data/, to run the workers in
+# ------------------------------------------------------------------------------
+def make_synthetic_folder(scale):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        from synthetic import make_synthetic_data, get_synthetic_sizes, write_synthetic_workbook
+    folder = tempfile.mkdtemp(prefix="cholt_bench_memory_")
+    os.makedirs(os.path.join(folder, "data"))
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        sheets = make_synthetic_data(**get_synthetic_sizes(scale))
+        write_synthetic_workbook({sheet:sheets[sheet].reset_index(drop=True) for sheet in sheets}, os.path.join(folder, "data", "cholt_data.xlsx"))
+    return folder
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    if sys.argv[1:] == ["--worker"]:
+        run_worker()
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Compare the memory of each worker with and without CHOLT_SHARED")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes per mode")
+    parser.add_argument("--scale", type=float, default=None, help="use a synthetic workbook this many times today's size")
+    parser.add_argument("--compact", action="store_true", help="run both modes with CHOLT_COMPACT=1")
+    args = parser.parse_args()
+
+    folder = make_synthetic_folder(args.scale) if args.scale else None
+    cwd = folder or os.path.dirname(os.path.abspath(__file__))
+    try:
+        results = {mode:measure_mode(mode, args.workers, cwd, args.compact) for mode in modes}
+    finally:
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    print("workbook: " + ("synthetic {:g}x".format(args.scale) if args.scale else "data/cholt_data.xlsx") + (", compact" if args.compact else ""))
+    print("{:>8} {:>7} {:>10} {:>10} {:>13}".format("mode", "worker", "RSS (MB)", "PSS (MB)", "private (MB)"))
+    for mode in results:
+        for i, memory in enumerate(results[mode]):
+            print("{:>8} {:>7} {:>10.1f} {:>10.1f} {:>13.1f}".format(mode, i + 1, memory['rss'], memory['pss'], memory['private']))
+        print("{:>8} {:>7} {:>10.1f} {:>10.1f} {:>13.1f}".format(mode, "total", *[sum(memory[key] for memory in results[mode]) for key in ['rss', 'pss', 'private']]))
+
+    default_pss = sum(memory['pss'] for memory in results['default'])
+    shared_pss  = sum(memory['pss'] for memory in results['shared'])
+    print("shared mode uses {:.1f} MB less in total ({:.1f}%), {:.1f} MB less per worker".format(default_pss - shared_pss, 100.0 * (default_pss - shared_pss) / default_pss, (default_pss - shared_pss) / args.workers))
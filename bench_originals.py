@@ -0,0 +1,60 @@
+# ==================================================================================================
+# BENCHMARK: CH-original flagging
+# Compares the old per-row band_is_original apply with the vectorized
+# get_original_flags, on the Songs band column at 1x, 10x and 100x its size
+#
+#     python bench_originals.py [repeats]
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import sys
+import time
+import contextlib
+
+import pandas as pd
+
+from lib import get_marked_data, band_is_original, get_original_flags
+
+# ==================================================================================================
+# Helpers
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Best of n wall-clock times, with stdout swallowed (the old path prints a
+# warning for every unmatched row)
+# ------------------------------------------------------------------------------
+def time_it(func, repeats):
+    best = None
+    out = None
+    for i in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            out = func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = get_marked_data(os.path.join("data","cholt_data.xlsx"))
+    bands = data['Songs']['Band'].reset_index(drop=True)
+
+    print("{:>6} {:>10} {:>12} {:>12} {:>9}".format("scale", "rows", "apply (s)", "vector (s)", "speedup"))
+    for scale in [1, 10, 100]:
+        column = pd.concat([bands] * scale, ignore_index=True)
+
+        old_time, old_flags = time_it(lambda: column.apply(band_is_original, args=([data['Bands']])), repeats)
+        new_time, new_flags = time_it(lambda: get_original_flags(column, data['Bands']), repeats)
+
+        if not old_flags.equals(new_flags):
+            print("MISMATCH at scale " + str(scale))
+
+        print("{:>6} {:>10} {:>12.4f} {:>12.4f} {:>8.1f}x".format(str(scale) + "x", len(column), old_time, new_time, old_time / new_time))
@@ -0,0 +1,254 @@
+# ==================================================================================================
+# BENCHMARK: scaling
+# Times the table builders, chart and table components and every page layout
+# on synthetic workbooks (see synthetic.py) from today's size upwards, with
+# the peak memory each one needs
+# - Each function gets fresh data every run, so nothing is served from the
+#   derived-table or lookup caches
+# - Time is the best of the repeats; peak memory is measured on one more run
+#   under tracemalloc, which is too slow to time with
+# - Results are saved as JSON under bench_results/ so that a later run can be
+#   compared against them with --baseline
+#
+#     python bench_scale.py                          scales 1, 10 and 100
+#     python bench_scale.py --scales 1,100,1000 --only get_data
+#     python bench_scale.py --shows 50000 --songs 40000 --bands 10000
+#     python bench_scale.py --baseline bench_results/before.json --label after
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import contextlib
+
+# ------------------------------------------------------------------------------
+# No reload thread, metrics or layout cache while benchmarking
+# ------------------------------------------------------------------------------
+os.environ.setdefault("CHOLT_RELOAD_INTERVAL", "0")
+os.environ.setdefault("CHOLT_METRICS", "0")
+os.environ.setdefault("CHOLT_LAYOUT_CACHE", "0")
+
+import pandas as pd
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import lib
+    import index
+    from dataset import Dataset
+    from derived import clear_derived
+    from table_query import query_cache
+    from layout_cache import to_json_plotly
+    from synthetic import make_synthetic_data, get_synthetic_sizes
+
+# ==================================================================================================
+# What gets measured
+# - Each entry takes the data and returns whatever the function built
+# ==================================================================================================
+bench_funcs = {}
+bench_funcs['get_data_performances'] = lambda data: lib.get_data_performances(data)
+bench_funcs['get_data_shows']        = lambda data: lib.get_data_shows(data)
+bench_funcs['get_data_songs']        = lambda data: lib.get_data_songs(data)
+bench_funcs['get_data_albums']       = lambda data: lib.get_data_albums(data)
+bench_funcs['get_data_artists']      = lambda data: lib.get_data_artists(data)
+bench_funcs['get_data_people']       = lambda data: lib.get_data_people(data)
+bench_funcs['get_data_originals']    = lambda data: lib.get_data_originals(data)
+
+# ------------------------------------------------------------------------------
+# The songs-per-show bar chart from the shows page, which grows with the shows
+# ------------------------------------------------------------------------------
+def bench_charts_with_controls(data):
+    shows = lib.get_data_shows(data).sort_values(by='Series Index')
+    charts = {}
+    charts['songs_by_show'] = {'chart_type':'bar', 'idx':'chart_songs_by_show',
+                               'details':{'data':shows, 'x':'Show Title', 'y':['Count'], 'style':index.init_dict['style_default']}}
+    layout = {'chart_shape':"1x1", 'style_default':index.init_dict['style_default'], 'controls_orient':"top"}
+    return lib.charts_with_controls(charts, {}, layout)
+
+bench_funcs['charts_with_controls'] = bench_charts_with_controls
+
+# ------------------------------------------------------------------------------
+# The performances table, sent whole to the browser and as one server-side page
+# ------------------------------------------------------------------------------
+bench_funcs['generate_data_table']        = lambda data: lib.generate_data_table(lib.get_data_performances(data), idx="bench_table")
+bench_funcs['generate_data_table_server'] = lambda data: lib.generate_data_table(lib.get_data_performances(data), idx="bench_table", source='performances')
+
+# ------------------------------------------------------------------------------
+# Every page in the routing table
+# ------------------------------------------------------------------------------
+def get_layout_bench(page):
+    def bench_layout(data):
+        page_dict = dict(index.init_dict)
+        page_dict['data'] = data
+        return index.get_page_func(page)(page_dict)
+    return bench_layout
+
+for page in index.pages:
+    bench_funcs[index.pages[page]['func']] = get_layout_bench(page)
+
+# ==================================================================================================
+# Measuring
+# ==================================================================================================
+bench_runs = {'count':0}
+
+# ------------------------------------------------------------------------------
+# The same sheets under a version nothing has seen yet, with the caches that
+# key on data identity emptied
+# ------------------------------------------------------------------------------
+def get_fresh_data(sheets):
+    bench_runs['count'] += 1
+    clear_derived()
+    query_cache.clear()
+    lib.original_lookups.clear()
+    return Dataset(sheets, "bench-" + str(bench_runs['count']))
+
+def time_func(func, sheets, repeats):
+    best = None
+    out = None
+    for i in range(repeats):
+        data = get_fresh_data(sheets)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            out = func(data)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+def measure_peak(func, sheets):
+    data = get_fresh_data(sheets)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        out = func(data)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+    del out
+    return peak
+
+# ------------------------------------------------------------------------------
+# Size of what a page or component sends to the browser
+# ------------------------------------------------------------------------------
+def get_payload_bytes(out):
+    if isinstance(out, pd.DataFrame):
+        return None
+    return len(to_json_plotly(out))
+
+# ------------------------------------------------------------------------------
+# Run everything for every size
+# ------------------------------------------------------------------------------
+def run_benchmarks(sizes, names, repeats, memory=True):
+    results = []
+    for size_name, size in sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sheets = make_synthetic_data(**size)
+        performances = len(sheets['Performances'])
+        print("--- " + size_name + ": " + str(size['shows']) + " shows, " + str(size['songs']) + " songs, " + str(size['bands']) + " bands, " + str(performances) + " performances")
+
+        for name in names:
+            seconds, out = time_func(bench_funcs[name], sheets, repeats)
+            result = {}
+            result['function']      = name
+            result['size']          = size_name
+            result['sizes']         = size
+            result['performances']  = performances
+            result['seconds']       = seconds
+            result['peak_bytes']    = measure_peak(bench_funcs[name], sheets) if memory else None
+            result['rows']          = len(out) if isinstance(out, pd.DataFrame) else None
+            result['payload_bytes'] = get_payload_bytes(out)
+            results.append(result)
+            print_result(result)
+    return results
+
+# ==================================================================================================
+# Reporting
+# ==================================================================================================
+def format_bytes(nbytes):
+    if nbytes is None:
+        return "-"
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024 or unit == 'GB':
+            return "{:.1f}{}".format(nbytes, unit) if unit != 'B' else str(int(nbytes)) + unit
+        nbytes /= 1024.0
+
+def print_result(result):
+    print("{:<28} {:>10.4f}s {:>10} {:>10} {:>10}".format(result['function'], result['seconds'], format_bytes(result['peak_bytes']),
+                                                            format_bytes(result['payload_bytes']), "-" if result['rows'] is None else result['rows']))
+
+# ------------------------------------------------------------------------------
+# Old and new side by side, for whatever both runs measured
+# ------------------------------------------------------------------------------
+def print_comparison(baseline, results):
+    old = {(r['function'], r['size']):r for r in baseline['results']}
+    print()
+    print("compared with " + baseline['label'])
+    print("{:<28} {:>8} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}".format("function", "size", "old (s)", "new (s)", "ratio", "old peak", "new peak", "ratio"))
+    for result in results:
+        key = (result['function'], result['size'])
+        if key not in old:
+            continue
+        a, b = old[key], result
+        mem_ratio = "{:.2f}x".format(b['peak_bytes'] / a['peak_bytes']) if a['peak_bytes'] and b['peak_bytes'] else "-"
+        print("{:<28} {:>8} {:>10.4f} {:>10.4f} {:>7.2f}x {:>10} {:>10} {:>8}".format(result['function'], result['size'], a['seconds'], b['seconds'], b['seconds'] / a['seconds'],
+                                                                                     format_bytes(a['peak_bytes']), format_bytes(b['peak_bytes']), mem_ratio))
+
+def save_results(results, label, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    report = {}
+    report['label']   = label
+    report['created'] = time.time()
+    report['python']  = platform.python_version()
+    report['pandas']  = pd.__version__
+    report['machine'] = platform.platform()
+    report['results'] = results
+    fname = os.path.join(out_dir, label + ".json")
+    with open(fname, 'w') as f:
+        json.dump(report, f, indent=1)
+    return fname
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the table, chart and page builders on synthetic data of growing size")
+    parser.add_argument('--scales', default="1,10,100", help="comma-separated multiples of today's workbook")
+    parser.add_argument('--shows', type=int, help="benchmark one size given by counts instead of scales")
+    parser.add_argument('--songs', type=int)
+    parser.add_argument('--bands', type=int)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--only', default="", help="comma-separated parts of function names to run")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc runs")
+    parser.add_argument('--label', default=time.strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument('--out-dir', default="bench_results")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    # --------------------------------------------------------------------------
+    # Sizes and functions
+    # --------------------------------------------------------------------------
+    if args.shows:
+        base = get_synthetic_sizes(args.shows / 88.0)
+        base['songs'] = args.songs or base['songs']
+        base['bands'] = args.bands or base['bands']
+        sizes = [("custom", base)]
+    else:
+        sizes = [(scale + "x", get_synthetic_sizes(float(scale))) for scale in args.scales.split(",")]
+
+    only = [part for part in args.only.split(",") if part]
+    names = [name for name in bench_funcs if not only or any(part in name for part in only)]
+
+    # --------------------------------------------------------------------------
+    # Go
+    # --------------------------------------------------------------------------
+    print("{:<28} {:>11} {:>10} {:>10} {:>10}".format("function", "time", "peak mem", "payload", "rows"))
+    results = run_benchmarks(sizes, names, args.repeats, memory=not args.no_memory)
+    print("...saved " + save_results(results, args.label, args.out_dir) + "...")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(json.load(f), results)
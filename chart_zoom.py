@@ -0,0 +1,184 @@
+# ==================================================================================================
+# CHART ZOOM
+# Full-resolution redraws for charts that were sent reduced (see downsample.py)
+# - When the x axis of a reduced chart is zoomed, the rows inside the new range
+#   are taken from the full data and drawn again, reduced only if that part is
+#   still too big; double-clicking back out brings the overview back
+# - Numbers and dates zoom by value; text categories zoom by position, so the
+#   categories on screen are read from the figure and the span between the
+#   first and last of them is taken from the full data
+# - The full data is the derived table named in the chart's Store, got from
+#   the data being served, so any worker can redraw it; if that table belongs
+#   to a page this worker hasn't loaded yet, the pages are imported first so
+#   it gets registered; charts without a Store only zoom in the worker that
+#   drew them
+# - Series keep the colour and legend order they have in the overview, which
+#   has every series in it (the "Other" bar keeps its colours), however few of
+#   them are in the zoomed part
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import math
+import importlib
+
+import numpy as np
+import pandas as pd
+
+from dash.dependencies import Input, Output, State, MATCH
+from dash.exceptions import PreventUpdate
+
+from app import app
+from lib import get_chart_figure
+from derived import get_derived, derived_funcs
+from downsample import reduce_chart_data, get_reduced_chart, is_categorical_x, reduced_chart_type, reduced_source_type, other_label
+
+# ==================================================================================================
+# The full data
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Chart type and details, full data included, from the chart's Store, or
+# from this worker if it drew the chart and it has no Store; None if neither
+# ------------------------------------------------------------------------------
+def get_zoom_chart(idx, source):
+    if not source:
+        return get_reduced_chart(idx)
+
+    from initialize import init_dict
+    table = source.get('table')
+    if table not in derived_funcs:
+        for page in init_dict['pages'].values():
+            importlib.import_module(page['module'])
+    if table not in derived_funcs:
+        return None
+    details = dict(source['details'], data=get_derived(table, init_dict['data']))
+    return {'chart_type':source['chart_type'], 'details':details}
+
+# ==================================================================================================
+# Reading the zoom
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# 'reset', (start, end) or None from a relayoutData event
+# ------------------------------------------------------------------------------
+def get_zoom_range(relayout):
+    if not relayout:
+        return None
+    if relayout.get('xaxis.autorange'):
+        return 'reset'
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        return relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    if isinstance(relayout.get('xaxis.range'), list) and len(relayout['xaxis.range']) == 2:
+        return tuple(relayout['xaxis.range'])
+    return None
+
+# ------------------------------------------------------------------------------
+# Rows of the full data inside the range, for numeric or date x
+# ------------------------------------------------------------------------------
+def get_value_rows(data, x, start, end):
+    series = data[x]
+    if pd.api.types.is_datetime64_any_dtype(series):
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+    else:
+        start, end = float(start), float(end)
+    return data[((series >= start) & (series <= end)).to_numpy()]
+
+# ------------------------------------------------------------------------------
+# Rows of the full data between the first and last category on screen
+# ------------------------------------------------------------------------------
+def get_category_rows(data, x, figure, start, end):
+    shown = []
+    for trace in (figure or {}).get('data', []):
+        if isinstance(trace.get('x'), (list, tuple, np.ndarray)):
+            shown.extend(trace['x'])
+    shown = list(dict.fromkeys(shown))
+
+    visible = [cat for cat in shown[max(0, math.ceil(start)):math.floor(end) + 1] if cat != other_label]
+    if not visible:
+        return None
+
+    categories = data[x].astype(object)
+    order = list(dict.fromkeys(categories))
+    positions = {cat:i for i, cat in enumerate(order)}
+    span = [positions[cat] for cat in visible if cat in positions]
+    if not span:
+        return None
+    return data[categories.isin(order[min(span):max(span) + 1]).to_numpy()]
+
+# ------------------------------------------------------------------------------
+# The figure with its traces in the overview's order and in the overview's
+# colours, matched by series name; the figure itself may be a cached one, so
+# the traces are copied rather than changed
+# ------------------------------------------------------------------------------
+def match_series_colours(figure, overview):
+    colours = {}
+    order = {}
+    for i, trace in enumerate(overview.get('data', [])):
+        key = get_colour_key(trace)
+        if trace.get('name') in order or key not in trace or 'color' not in trace[key]:
+            continue
+        colours[trace.get('name')] = trace[key]['color']
+        order[trace.get('name')] = i
+
+    traces = []
+    for trace in sorted(figure.get('data', []), key=lambda trace: order.get(trace.get('name'), len(order))):
+        key = get_colour_key(trace)
+        if trace.get('name') in colours:
+            trace = dict(trace)
+            trace[key] = dict(trace.get(key, {}), color=colours[trace.get('name')])
+        traces.append(trace)
+    return dict(figure, data=traces)
+
+def get_colour_key(trace):
+    return 'marker' if trace.get('type') == 'bar' else 'line'
+
+# ==================================================================================================
+# Callback shared by every reduced chart
+# ==================================================================================================
+@app.callback(Output({'type':reduced_chart_type, 'index':MATCH}, 'figure'),
+              Input({'type':reduced_chart_type, 'index':MATCH}, 'relayoutData'),
+              State({'type':reduced_chart_type, 'index':MATCH}, 'figure'),
+              State({'type':reduced_chart_type, 'index':MATCH}, 'id'),
+              State({'type':reduced_source_type, 'index':MATCH}, 'data'),
+              prevent_initial_call=True)
+def zoom_reduced_chart(relayout, figure, idx, source):
+    chart = get_zoom_chart(idx['index'], source)
+    zoom  = get_zoom_range(relayout)
+    if chart is None or zoom is None:
+        raise PreventUpdate
+
+    chart_type = chart['chart_type']
+    details    = chart['details']
+    full, x    = details['data'], details['x']
+
+    # --------------------------------------------------------------------------
+    # Back to the overview
+    # --------------------------------------------------------------------------
+    overview = get_chart_figure(chart_type, details, reduce_chart_data(chart_type, full, x, details['y'], details.get('color',"")))
+    if zoom == 'reset':
+        return overview
+
+    # --------------------------------------------------------------------------
+    # The part being looked at, in full if it's small enough
+    # --------------------------------------------------------------------------
+    start, end = zoom
+    if is_categorical_x(full[x]):
+        rows = get_category_rows(full, x, figure, start, end)
+    else:
+        rows = get_value_rows(full, x, start, end)
+    if rows is None or len(rows) == 0:
+        raise PreventUpdate
+
+    data = reduce_chart_data(chart_type, rows, x, details['y'], details.get('color',""))
+    figure = match_series_colours(get_chart_figure(chart_type, details, data), overview)
+
+    # --------------------------------------------------------------------------
+    # Keep the axis where it was zoomed to; categories are redrawn as a new
+    # axis, so that one starts from the full width again
+    # --------------------------------------------------------------------------
+    layout = dict(figure['layout'])
+    if is_categorical_x(full[x]):
+        layout['xaxis'] = dict(layout.get('xaxis', {}), autorange=True)
+    else:
+        layout['xaxis'] = dict(layout.get('xaxis', {}), range=[start, end], autorange=False)
+    return dict(figure, layout=layout)
@@ -0,0 +1,198 @@
+# ==================================================================================================
+# COMPACT MODE
+# Smaller in-memory types for the loaded workbook, plus a memory report
+# - Repeated strings (Artist, Song, Genre, Location...) and the key columns
+#   become categoricals that all share one sorted dictionary, so each distinct
+#   string is held once for the whole workbook and every column is just codes
+# - Because the key columns are categorical, the set_index(..., drop=False)
+#   indexes are built from the same codes and dictionary instead of holding a
+#   second copy of every name
+# - Year, position and other whole-number columns are downcast to the smallest
+#   integer type that fits, or float32 where there are blanks
+# - Sorting is unchanged (the dictionary is sorted), and joins between compact
+#   columns stay categorical since they share the same categories
+#
+#     python compact.py        prints the memory report for both modes
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# A string column is worth a categorical if it repeats this much
+# ------------------------------------------------------------------------------
+compact_max_unique_ratio = 0.5
+
+# ------------------------------------------------------------------------------
+# Largest whole number float32 holds exactly
+# ------------------------------------------------------------------------------
+float32_exact = 2 ** 24
+
+# ==================================================================================================
+# Converting
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Compact every sheet; index_cols is sheet -> index column(s), as in
+# lib.sheet_index, and those columns are always made categorical
+# ------------------------------------------------------------------------------
+def compact_data(sheets, index_cols=None):
+    index_cols = index_cols or {}
+
+    # --------------------------------------------------------------------------
+    # Pick the string columns to share a dictionary
+    # --------------------------------------------------------------------------
+    chosen = {}
+    values = set()
+    for sheet in sheets:
+        keys = index_cols.get(sheet, [])
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        chosen[sheet] = []
+        for col in sheets[sheet].columns:
+            series = sheets[sheet][col]
+            if not is_string_column(series):
+                continue
+            present = series.dropna()
+            if col in keys or (len(present) > 0 and present.nunique() <= compact_max_unique_ratio * len(present)):
+                chosen[sheet].append(col)
+                values.update(present.unique())
+
+    shared = pd.CategoricalDtype(sorted(values))
+
+    # --------------------------------------------------------------------------
+    # Convert
+    # --------------------------------------------------------------------------
+    out = {}
+    for sheet in sheets:
+        df = sheets[sheet].copy()
+        for col in df.columns:
+            if col in chosen[sheet]:
+                df[col] = df[col].astype(shared)
+            else:
+                df[col] = downcast_column(df[col])
+        out[sheet] = df
+    return out
+
+# ------------------------------------------------------------------------------
+# Object column holding nothing but strings (and blanks)
+# ------------------------------------------------------------------------------
+def is_string_column(series):
+    if series.dtype != object:
+        return False
+    present = series.dropna()
+    return len(present) > 0 and present.map(type).eq(str).all()
+
+# ------------------------------------------------------------------------------
+# Smallest numeric type that holds the column exactly
+# ------------------------------------------------------------------------------
+def downcast_column(series):
+    if series.dtype.kind == 'i':
+        return pd.to_numeric(series, downcast='integer')
+
+    if series.dtype.kind != 'f':
+        return series
+
+    present = series.dropna()
+    if len(present) == 0 or not np.all(np.mod(present.to_numpy(), 1) == 0):
+        return series
+    if present.abs().max() >= float32_exact:
+        return series
+
+    if len(present) == len(series):
+        return pd.to_numeric(series.astype(np.int64), downcast='integer')
+    return series.astype(np.float32)
+
+# ==================================================================================================
+# Memory report
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Bytes per sheet and column, including each sheet's index; a shared
+# dictionary is reported once on its own line rather than in every column
+# ------------------------------------------------------------------------------
+def get_memory_report(data):
+    rows = []
+    dictionaries = {}
+    for sheet in data:
+        df = data[sheet]
+
+        # ----------------------------------------------------------------------
+        # Columns
+        # ----------------------------------------------------------------------
+        for col in df.columns:
+            series = df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                nbytes = series.cat.codes.nbytes
+                dictionaries[id(series.cat.categories)] = series.cat.categories
+            else:
+                nbytes = series.memory_usage(index=False, deep=True)
+            rows.append({'Sheet':sheet, 'Column':col, 'Dtype':str(series.dtype), 'Bytes':int(nbytes)})
+
+        # ----------------------------------------------------------------------
+        # Index
+        # ----------------------------------------------------------------------
+        rows.append({'Sheet':sheet, 'Column':'(index)', 'Dtype':type(df.index).__name__, 'Bytes':int(get_index_bytes(df.index, dictionaries))})
+
+    # --------------------------------------------------------------------------
+    # Dictionaries
+    # --------------------------------------------------------------------------
+    for categories in dictionaries.values():
+        rows.append({'Sheet':'(shared)', 'Column':'(dictionary of ' + str(len(categories)) + ')', 'Dtype':'category', 'Bytes':int(categories.memory_usage(deep=True))})
+
+    return pd.DataFrame(rows, columns=['Sheet','Column','Dtype','Bytes'])
+
+# ------------------------------------------------------------------------------
+# Size of an index, leaving out levels that are a shared dictionary
+# ------------------------------------------------------------------------------
+def get_index_bytes(index, dictionaries):
+    if isinstance(index, pd.MultiIndex):
+        nbytes = sum(codes.nbytes for codes in index.codes)
+        for level in index.levels:
+            if not is_shared_dictionary(level, dictionaries):
+                nbytes += level.memory_usage(deep=True)
+        return nbytes
+    if isinstance(index, pd.CategoricalIndex):
+        dictionaries[id(index.categories)] = index.categories
+        return index.codes.nbytes
+    return index.memory_usage(deep=True)
+
+def is_shared_dictionary(level, dictionaries):
+    if isinstance(level, pd.CategoricalIndex):
+        level = level.categories
+    for categories in dictionaries.values():
+        if len(level) == len(categories) and level.equals(categories):
+            return True
+    return False
+
+# ------------------------------------------------------------------------------
+# Totals per sheet
+# ------------------------------------------------------------------------------
+def get_memory_summary(report):
+    return report.groupby('Sheet', sort=False)['Bytes'].sum()
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    from lib import get_marked_data
+
+    data_fname = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data","cholt_data.xlsx")
+    normal  = get_memory_report(get_marked_data(data_fname))
+    compact = get_memory_report(get_marked_data(data_fname, compact=True))
+
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_rows', 500)
+    print(compact.to_string(index=False))
+    print()
+
+    summary = pd.DataFrame({'Default':get_memory_summary(normal), 'Compact':get_memory_summary(compact)}).fillna(0).astype(int)
+    summary.loc['TOTAL'] = summary.sum()
+    summary['Saved'] = [("{:.0%}".format(1 - c / d) if d else "") for c, d in zip(summary['Compact'], summary['Default'])]
+    print(summary.to_string())
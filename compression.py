@@ -0,0 +1,265 @@
+# ==================================================================================================
+# COMPRESSION
+# gzip/brotli for the responses from app.server, and ETags so that a client
+# that already has the current copy gets 304 Not Modified instead
+# - Every compressible response (JSON, HTML, scripts...) over a minimum size
+#   is compressed with the best encoding the client accepts: brotli if the
+#   brotli package is installed, gzip otherwise
+# - Compressed bodies are cached by a hash of the original, so the same page
+#   or table going out again is a lookup rather than another compression
+# - Responses get a strong ETag made of the data version, the code, and a
+#   hash of the request (method, path, query and body), plus the encoding;
+#   pages and callbacks are worked out from those alone, so the tag is known
+#   before anything is rendered, and a request with a matching If-None-Match
+#   gets a 304 straight away without rendering it again
+# - Browsers never revalidate POSTs, which is how Dash callbacks are sent, so
+#   the 304s for callbacks only happen with assets/etag_cache.js, which keeps
+#   the last few callback responses, sends their ETags back, and hands Dash
+#   the copy it kept; without it (or if it's changed to skip callbacks) only
+#   GETs and HEADs are ever revalidated
+# - Responses marked Cache-Control: no-store (/metrics) get no ETag
+#
+# CHOLT_COMPRESS=0 turns this off; CHOLT_COMPRESS_MIN_BYTES (default 1024) is
+# the smallest body worth compressing, and CHOLT_COMPRESS_CACHE_MB (default
+# 32) caps the cache of compressed bodies
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import gzip
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from app import server
+from dataset import get_data_version
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+compression_config = {}
+compression_config['enabled']   = os.environ.get("CHOLT_COMPRESS", "1") != "0"
+compression_config['min_bytes'] = int(os.environ.get("CHOLT_COMPRESS_MIN_BYTES", "1024"))
+compression_config['max_bytes'] = int(float(os.environ.get("CHOLT_COMPRESS_CACHE_MB", "32")) * 1024 * 1024)
+
+# ------------------------------------------------------------------------------
+# What's worth compressing, and how hard; these levels are the usual trade-off
+# for bodies made on the fly
+# ------------------------------------------------------------------------------
+compressible_types = ['application/json', 'application/javascript', 'text/html', 'text/css',
+                      'text/javascript', 'text/plain', 'image/svg+xml']
+gzip_level    = 6
+brotli_quality = 5
+
+# ------------------------------------------------------------------------------
+# (body hash, encoding) -> compressed body, most recently used last
+# ------------------------------------------------------------------------------
+compressed_cache       = OrderedDict()
+compressed_cache_lock  = threading.Lock()
+compressed_cache_stats = {'hits':0, 'misses':0, 'not_modified':0, 'bytes':0}
+
+# ==================================================================================================
+# Encoding
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The encoding to use for an Accept-Encoding header, or None
+# ------------------------------------------------------------------------------
+def choose_encoding(accept_encoding):
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        fields = part.strip().split(';')
+        name = fields[0].strip().lower()
+        quality = 1.0
+        for field in fields[1:]:
+            field = field.strip()
+            if field.startswith('q='):
+                try:
+                    quality = float(field[2:])
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name] = quality
+
+    for name in (['br', 'gzip'] if brotli is not None else ['gzip']):
+        if accepted.get(name, accepted.get('*', 0)) > 0:
+            return name
+    return None
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+# ------------------------------------------------------------------------------
+# Compressed body from the cache, compressing and storing it if it isn't there
+# ------------------------------------------------------------------------------
+def get_compressed(digest, body, encoding):
+    key = (digest, encoding)
+    with compressed_cache_lock:
+        if key in compressed_cache:
+            compressed_cache.move_to_end(key)
+            compressed_cache_stats['hits'] += 1
+            return compressed_cache[key]
+
+    compressed = compress_body(body, encoding)
+
+    with compressed_cache_lock:
+        compressed_cache_stats['misses'] += 1
+        if len(compressed) <= compression_config['max_bytes'] and key not in compressed_cache:
+            compressed_cache[key] = compressed
+            compressed_cache_stats['bytes'] += len(compressed)
+            while compressed_cache_stats['bytes'] > compression_config['max_bytes']:
+                old_key, old = compressed_cache.popitem(last=False)
+                compressed_cache_stats['bytes'] -= len(old)
+    return compressed
+
+# ==================================================================================================
+# ETags
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# A hash of the code and assets, so that a new release with the same data
+# doesn't match the tags the old one gave out; the same in every worker
+# ------------------------------------------------------------------------------
+def get_build_tag():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for fname in sorted(glob.glob(os.path.join(folder, "*.py")) + glob.glob(os.path.join(folder, "assets", "*"))):
+        if os.path.isfile(fname):
+            with open(fname, 'rb') as f:
+                digest.update(os.path.basename(fname).encode('utf-8') + b"\0" + f.read())
+    return digest.hexdigest()[:8]
+
+build_tag = get_build_tag()
+
+# ------------------------------------------------------------------------------
+# Strong ETag for a request, without the encoding, from what the response is
+# worked out from: the data version, the code, and the request itself
+# ------------------------------------------------------------------------------
+def get_request_etag(request):
+    from initialize import init_dict
+    method = 'GET' if request.method == 'HEAD' else request.method
+    digest = hashlib.sha1(method.encode('utf-8') + b"\0" + request.path.encode('utf-8') + b"\0" +
+                          request.query_string + b"\0" + request.get_data())
+    return str(get_data_version(init_dict['data'])) + "-" + build_tag + "-" + digest.hexdigest()[:20]
+
+def add_encoding(etag, encoding):
+    return etag + "-" + encoding if encoding else etag
+
+# ------------------------------------------------------------------------------
+# Keep a tag the response already has (Dash sets them on some files), but
+# the encoded copy is a different body, so it gets a different tag
+# ------------------------------------------------------------------------------
+def get_response_etag(response, encoding):
+    etag = response.headers.get('ETag')
+    if not etag:
+        tag = getattr(flask.g, 'cholt_etag', None)
+        if tag is None or 'no-store' in (response.headers.get('Cache-Control') or ''):
+            return None
+        return '"' + add_encoding(tag, encoding) + '"'
+    if encoding and etag.endswith('"'):
+        return etag[:-1] + "-" + encoding + '"'
+    return etag
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+# ------------------------------------------------------------------------------
+# Only GETs and the callback requests from etag_cache.js are answered with a
+# 304; for any other POST, If-None-Match means something else
+# ------------------------------------------------------------------------------
+def can_revalidate(request):
+    if request.method in ('GET', 'HEAD'):
+        return True
+    return request.method == 'POST' and request.path.endswith('_dash-update-component')
+
+# ==================================================================================================
+# Hooks on the Flask server
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Before anything is rendered: the tag this request's response will have,
+# and if the client already has it, under any encoding, a 304 right away
+# ------------------------------------------------------------------------------
+def check_not_modified():
+    request = flask.request
+    if not can_revalidate(request):
+        return None
+    tag = flask.g.cholt_etag = get_request_etag(request)
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return None
+    if not any(etag_matches(if_none_match, '"' + add_encoding(tag, encoding) + '"') for encoding in [None, 'gzip', 'br']):
+        return None
+
+    compressed_cache_stats['not_modified'] += 1
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    response = flask.Response(status=304)
+    response.headers['ETag'] = '"' + add_encoding(tag, encoding) + '"'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def compress_response(response):
+    request = flask.request
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return response
+    if response.headers.get('Content-Encoding') or response.mimetype not in compressible_types:
+        return response
+
+    body = response.get_data()
+    digest = hashlib.sha1(request.path.encode('utf-8') + b"\0" + body).hexdigest()
+
+    # --------------------------------------------------------------------------
+    # Pick the encoding; small bodies go as they are
+    # --------------------------------------------------------------------------
+    encoding = None
+    if len(body) >= compression_config['min_bytes']:
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    response.vary.add('Accept-Encoding')
+
+    # --------------------------------------------------------------------------
+    # The client already has it (for tags of our own, check_not_modified has
+    # already seen to that)
+    # --------------------------------------------------------------------------
+    etag = get_response_etag(response, encoding)
+    if etag and can_revalidate(request) and etag_matches(request.headers.get('If-None-Match'), etag):
+        compressed_cache_stats['not_modified'] += 1
+        response.status_code = 304
+        response.set_data(b"")
+        response.headers.pop('Content-Length', None)
+        response.headers['ETag'] = etag
+        return response
+
+    # --------------------------------------------------------------------------
+    # Send it, compressed if it's worth it
+    # --------------------------------------------------------------------------
+    if etag:
+        response.headers['ETag'] = etag
+    if encoding is None:
+        return response
+    response.set_data(get_compressed(digest, body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# ------------------------------------------------------------------------------
+# Counters, for logging or the metrics page
+# ------------------------------------------------------------------------------
+def get_compression_stats():
+    stats = dict(compressed_cache_stats)
+    stats['entries'] = len(compressed_cache)
+    return stats
+
+if compression_config['enabled']:
+    server.before_request(check_not_modified)
+    server.after_request(compress_response)
@@ -0,0 +1,298 @@
+# ==================================================================================================
+# DATASET
+# The loaded workbook as an immutable, versioned snapshot, plus the watcher that
+# swaps in a new one when the curators update the file
+# - Pages only ever see a Dataset through init_dict['data']; the watcher
+#   replaces that one reference, so a page sees either the old version or the
+#   new one, never a mix
+# - Nothing should modify the frames in a Dataset in place; derive new ones
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import time
+import functools
+import threading
+from collections.abc import Mapping
+
+from lib import get_marked_data, get_marked_sheet, get_sheet_names, get_file_hash, is_helper_fork
+
+# ==================================================================================================
+# The snapshot itself
+# ==================================================================================================
+class Dataset(Mapping):
+    """
+    Read-only mapping of sheet name -> DataFrame, tagged with a version
+
+    Sheets can be given either as frames or as loaders, functions that build
+    the frame; a loader is only called the first time its sheet is asked for,
+    and how long it took is kept in load_times
+    """
+    def __init__(self, sheets, version, source=None, loaded_at=None, load_seconds=None, loaders=None):
+        self._sheets      = dict(sheets)
+        self._loaders     = dict(loaders or {})
+        self._names       = list(self._sheets) + [sheet for sheet in self._loaders if sheet not in self._sheets]
+        self._lock        = threading.Lock()
+        self.version      = version
+        self.source       = source
+        self.loaded_at    = time.time() if loaded_at is None else loaded_at
+        self.load_seconds = load_seconds
+        self.load_times   = {}
+
+    def __getitem__(self, sheet):
+        # ----------------------------------------------------------------------
+        # Fast path, once the sheet is in
+        # ----------------------------------------------------------------------
+        df = self._sheets.get(sheet)
+        if df is not None:
+            return df
+        if sheet not in self._loaders:
+            raise KeyError(sheet)
+
+        # ----------------------------------------------------------------------
+        # First use; one thread loads it while any others wait
+        # ----------------------------------------------------------------------
+        with self._lock:
+            df = self._sheets.get(sheet)
+            if df is None:
+                start = time.perf_counter()
+                df = self._loaders[sheet]()
+                self.load_times[sheet] = time.perf_counter() - start
+                self._sheets[sheet] = df
+        return df
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return "Dataset(version=" + repr(self.version) + ", sheets=" + repr(self._names) + ")"
+
+    def is_loaded(self, sheet):
+        return sheet in self._sheets
+
+    def loaded_sheets(self):
+        return [sheet for sheet in self._names if sheet in self._sheets]
+
+    def with_sheets(self, sheets, version):
+        """
+        New Dataset with the given sheets replaced and every other one shared
+        with this one, loaded or not; nothing is copied
+        """
+        with self._lock:
+            current = dict(self._sheets)
+        current.update(sheets)
+        loaders = {sheet:self._loaders[sheet] for sheet in self._loaders if sheet not in current}
+        out = Dataset(current, version, source=self.source, loaded_at=time.time(), load_seconds=self.load_seconds, loaders=loaders)
+        out._names = self._names + [sheet for sheet in sheets if sheet not in self._names]
+        out.load_times = dict(self.load_times)
+        return out
+
+# ------------------------------------------------------------------------------
+# Version of a Dataset, or something stable enough for a plain dict
+# ------------------------------------------------------------------------------
+def get_data_version(data):
+    return getattr(data, 'version', None) or "id-" + str(id(data))
+
+# ------------------------------------------------------------------------------
+# The workbook part of a version; data with rows added on top of the workbook
+# (see ingest.py) has the workbook's version followed by "+" and the rest
+# ------------------------------------------------------------------------------
+def get_workbook_version(data):
+    return (getattr(data, 'version', None) or "").split("+")[0]
+
+# ------------------------------------------------------------------------------
+# Load the workbook into a new Dataset; the version is the content hash
+# - A load source (see below) that already has that version's sheets gets
+#   the first go, so the workbook isn't read at all
+# - If lazy is on, only the sheet names are read now, and each sheet is read
+#   and indexed the first time something asks for it
+# - Then the load hooks get a go at it (see below)
+# ------------------------------------------------------------------------------
+def load_dataset(data_fname, use_snapshot=True, compact=False, lazy=False, processes=None):
+    start   = time.perf_counter()
+    sha256  = get_file_hash(data_fname)
+    version = sha256[:12]
+
+    for func in load_sources:
+        data = func(data_fname, version, compact)
+        if data is not None:
+            data.load_seconds = time.perf_counter() - start
+            return apply_load_hooks(data)
+
+    if lazy:
+        loaders = {}
+        for sheet in get_sheet_names(data_fname, use_snapshot=use_snapshot):
+            loaders[sheet] = functools.partial(get_marked_sheet, data_fname, sheet, sha256=sha256, use_snapshot=use_snapshot, compact=compact)
+        return apply_load_hooks(Dataset({}, version, source=data_fname, load_seconds=time.perf_counter() - start, loaders=loaders))
+
+    sheets  = get_marked_data(data_fname, use_snapshot=use_snapshot, compact=compact, processes=processes)
+    return apply_load_hooks(Dataset(sheets, version, source=data_fname, load_seconds=time.perf_counter() - start))
+
+# ------------------------------------------------------------------------------
+# Anything that can give a version's sheets without reading the workbook
+# registers here; each is called as func(data_fname, version, compact) and
+# returns a Dataset, or None if it doesn't have that version
+# ------------------------------------------------------------------------------
+load_sources = []
+
+def add_load_source(func):
+    load_sources.append(func)
+    return func
+
+# ------------------------------------------------------------------------------
+# Anything that adds to the data on top of the workbook registers here, so
+# that it is applied again to every fresh load; each is called as
+# func(data) and returns the data, or a new Dataset built from it
+# - first puts it ahead of the ones already registered
+# ------------------------------------------------------------------------------
+load_hooks = []
+
+def add_load_hook(func, first=False):
+    if first:
+        load_hooks.insert(0, func)
+    else:
+        load_hooks.append(func)
+    return func
+
+def apply_load_hooks(data):
+    for func in load_hooks:
+        try:
+            data = func(data)
+        except Exception as e:
+            print("WARNING! Load hook failed, skipping it: " + str(e))
+    return data
+
+# ==================================================================================================
+# Hot reload
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Anything that wants to know about a swap (caches etc.) registers here; each
+# is called as func(old_data, new_data) after the new data is in place
+# ------------------------------------------------------------------------------
+data_listeners = []
+
+def add_data_listener(func):
+    data_listeners.append(func)
+    return func
+
+# ------------------------------------------------------------------------------
+# Swap in new data and tell the listeners
+# - The dict item assignment is the atomic part; readers that grabbed the old
+#   reference finish with it undisturbed
+# - Anything that builds the new data from the current one does it through
+#   update_data, so that two updaters (the workbook watcher and ingest.py)
+#   can't both start from the same data and have one undo the other's swap
+# ------------------------------------------------------------------------------
+swap_lock = threading.RLock()
+
+def update_data(init_dict, func):
+    with swap_lock:
+        data = init_dict.get('data')
+        new_data = func(data)
+        if new_data is not None and new_data is not data:
+            swap_data(init_dict, new_data)
+            print("...now serving data version " + new_data.version + "...")
+        return new_data
+
+def swap_data(init_dict, new_data):
+    old_data = init_dict.get('data')
+    init_dict['data'] = new_data
+    for func in data_listeners:
+        try:
+            func(old_data, new_data)
+        except Exception as e:
+            print("WARNING! Data listener failed: " + str(e))
+    return old_data
+
+# ------------------------------------------------------------------------------
+# State for the watcher thread in this process
+# ------------------------------------------------------------------------------
+watch_state = {'thread':None, 'args':None, 'stop':None}
+
+# ------------------------------------------------------------------------------
+# Start watching the workbook; polling the mtime is cheap and works the same
+# everywhere, including network drives
+# - load_args are passed on to load_dataset for each reload
+# ------------------------------------------------------------------------------
+def watch_data(init_dict, data_fname, interval=5.0, **load_args):
+    if interval <= 0:
+        return None
+    if watch_state['thread'] is not None and watch_state['thread'].is_alive():
+        return watch_state['thread']
+
+    watch_state['args'] = (init_dict, data_fname, interval, load_args)
+    watch_state['stop'] = threading.Event()
+    thread = threading.Thread(target=watch_loop, args=watch_state['args'] + (watch_state['stop'],), name="cholt-data-watcher", daemon=True)
+    thread.start()
+    watch_state['thread'] = thread
+    return thread
+
+def stop_watching():
+    if watch_state['stop'] is not None:
+        watch_state['stop'].set()
+    watch_state['thread'] = None
+
+# ------------------------------------------------------------------------------
+# Threads don't survive a fork, so if the server forks its workers after
+# loading (gunicorn --preload) start a fresh watcher in each child
+# - Not in the processes that parse the workbook or render the static export
+#   (see lib.forking_helpers), which are forked too but only live for the one
+#   job
+# ------------------------------------------------------------------------------
+def restart_after_fork():
+    if is_helper_fork():
+        watch_state['thread'] = None
+        return
+    if watch_state['args'] is not None:
+        init_dict, data_fname, interval, load_args = watch_state['args']
+        watch_state['thread'] = None
+        watch_data(init_dict, data_fname, interval, **load_args)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_after_fork)
+
+# ------------------------------------------------------------------------------
+# The loop itself
+# ------------------------------------------------------------------------------
+def watch_loop(init_dict, data_fname, interval, load_args, stop):
+    last_stat = get_stat(data_fname)
+    while not stop.wait(interval):
+        # ----------------------------------------------------------------------
+        # Nothing to do until the file changes
+        # ----------------------------------------------------------------------
+        stat = get_stat(data_fname)
+        if stat is None or stat == last_stat:
+            continue
+
+        # ----------------------------------------------------------------------
+        # Wait for it to settle, in case it is still being copied in
+        # ----------------------------------------------------------------------
+        if stop.wait(min(interval, 1.0)) or get_stat(data_fname) != stat:
+            continue
+        last_stat = stat
+
+        # ----------------------------------------------------------------------
+        # A touched-but-identical file keeps the same version
+        # ----------------------------------------------------------------------
+        try:
+            update_data(init_dict, lambda data: reload_data(data, data_fname, load_args))
+        except Exception as e:
+            print("WARNING! Reload failed, keeping the current data: " + str(e))
+
+def reload_data(data, data_fname, load_args):
+    if get_file_hash(data_fname)[:12] == get_workbook_version(data):
+        return data
+    print("...workbook changed, reloading " + data_fname + "...")
+    return load_dataset(data_fname, **load_args)
+
+def get_stat(data_fname):
+    try:
+        stat = os.stat(data_fname)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,189 @@
+# ==================================================================================================
+# DERIVED TABLES
+# Memoized versions of the get_data_* tables, keyed by data version
+# - Each table is computed once per version of the data and then shared by
+#   every page view until the data changes
+# - The tables handed out are shared, so callers must not modify them in place
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import time
+import threading
+
+from lib import *
+from profiling import profile_section
+from dataset import get_data_version, add_data_listener
+from entity_index import build_entity_index
+
+# ==================================================================================================
+# The store
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# name -> function(data) that builds the table
+# ------------------------------------------------------------------------------
+derived_funcs = {}
+
+# ------------------------------------------------------------------------------
+# (version, name) -> table, plus the order the versions showed up in; the
+# previous version is kept so requests still finishing on it don't recompute
+# ------------------------------------------------------------------------------
+derived_tables   = {}
+derived_versions = []
+derived_keep     = 2
+
+# ------------------------------------------------------------------------------
+# name -> {'hits', 'recomputes', 'seconds'}
+# ------------------------------------------------------------------------------
+derived_stats = {}
+
+derived_lock  = threading.Lock()
+derived_locks = {}
+
+# ------------------------------------------------------------------------------
+# Add a table to the store
+# ------------------------------------------------------------------------------
+def register_derived(name, func):
+    derived_funcs[name] = func
+    derived_stats.setdefault(name, {'hits':0, 'recomputes':0, 'seconds':0.0})
+    return func
+
+# ------------------------------------------------------------------------------
+# Get a table for this data, computing it if this version hasn't been seen
+# ------------------------------------------------------------------------------
+def get_derived(name, data):
+    version = get_data_version(data)
+    key = (version, name)
+
+    # --------------------------------------------------------------------------
+    # Fast path
+    # --------------------------------------------------------------------------
+    table = derived_tables.get(key)
+    if table is not None:
+        derived_stats[name]['hits'] += 1
+        return table
+
+    # --------------------------------------------------------------------------
+    # One thread computes, any others asking for the same table wait for it
+    # --------------------------------------------------------------------------
+    with derived_lock:
+        lock = derived_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        table = derived_tables.get(key)
+        if table is not None:
+            derived_stats[name]['hits'] += 1
+            return table
+
+        start = time.perf_counter()
+        with profile_section("derive " + name, "derive"):
+            table = derived_funcs[name](data)
+        derived_stats[name]['recomputes'] += 1
+        derived_stats[name]['seconds']    += time.perf_counter() - start
+
+        with derived_lock:
+            if version not in derived_versions:
+                derived_versions.append(version)
+            derived_tables[key] = table
+            forget_old_versions()
+
+    return table
+
+# ------------------------------------------------------------------------------
+# A table only if it has already been computed for this data
+# ------------------------------------------------------------------------------
+def peek_derived(name, data):
+    return derived_tables.get((get_data_version(data), name))
+
+# ------------------------------------------------------------------------------
+# Put in a table worked out some other way, typically by updating the one
+# from the previous version instead of computing it from scratch
+# ------------------------------------------------------------------------------
+def seed_derived(name, data, table):
+    version = get_data_version(data)
+    with derived_lock:
+        if version not in derived_versions:
+            derived_versions.append(version)
+        derived_tables[(version, name)] = table
+        forget_old_versions()
+
+# ------------------------------------------------------------------------------
+# Drop whatever belongs to versions we no longer need
+# ------------------------------------------------------------------------------
+def forget_old_versions():
+    while len(derived_versions) > derived_keep:
+        old = derived_versions.pop(0)
+        for key in [key for key in derived_tables if key[0] == old]:
+            del derived_tables[key]
+        for key in [key for key in derived_locks if key[0] == old]:
+            del derived_locks[key]
+
+# ------------------------------------------------------------------------------
+# Throw everything away
+# ------------------------------------------------------------------------------
+def clear_derived():
+    with derived_lock:
+        derived_tables.clear()
+        derived_locks.clear()
+        del derived_versions[:]
+
+# ------------------------------------------------------------------------------
+# Counters, for logging or the metrics page
+# ------------------------------------------------------------------------------
+def get_derived_stats():
+    return {name:dict(derived_stats[name]) for name in derived_stats}
+
+# ------------------------------------------------------------------------------
+# When new data is swapped in, build its tables right away on the watcher
+# thread so the first page view after a reload doesn't pay for them
+# ------------------------------------------------------------------------------
+def warm_derived(old_data, new_data):
+    for name in list(derived_funcs):
+        get_derived(name, new_data)
+
+add_data_listener(warm_derived)
+
+# ==================================================================================================
+# Tables shared by the pages
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The play-count index goes first; the tables with play counts join against it
+# ------------------------------------------------------------------------------
+register_derived('play_counts', get_play_counts)
+
+def with_play_counts(func):
+    return lambda data: func(data, counts=get_derived('play_counts', data))
+
+register_derived('performances', with_play_counts(get_data_performances))
+register_derived('shows',        with_play_counts(get_data_shows))
+register_derived('songs',        with_play_counts(get_data_songs))
+register_derived('albums',       get_data_albums)
+register_derived('artists',      get_data_artists)
+register_derived('people',       get_data_people)
+register_derived('originals',    get_data_originals)
+
+# ------------------------------------------------------------------------------
+# Shows in series order, for the songs-per-show chart
+# ------------------------------------------------------------------------------
+def get_data_shows_by_series_index(data):
+    return get_derived('shows', data).sort_values(by='Series Index')
+
+register_derived('shows_by_series_index', get_data_shows_by_series_index)
+
+# ------------------------------------------------------------------------------
+# Setlist from the latest show
+# ------------------------------------------------------------------------------
+def get_data_latest_setlist(data):
+    data_performances = get_derived('performances', data)
+    return data_performances.loc[data_performances['Show']==max(data_performances['Show'])]
+
+register_derived('latest_setlist', get_data_latest_setlist)
+
+# ------------------------------------------------------------------------------
+# Performance rows for each song, artist, album and show, for the detail pages
+# ------------------------------------------------------------------------------
+def get_entity_index(data):
+    return build_entity_index(data['Performances'], data['Songs'])
+
+register_derived('entity_index', get_entity_index)
@@ -0,0 +1,195 @@
+# ==================================================================================================
+# DOWNSAMPLING
+# Keeps big chart series small enough for the browser to draw, while the full
+# data stays on the server for when someone zooms in
+# - Line charts with more points than CHOLT_CHART_MAX_POINTS are cut down with
+#   largest-triangle-three-buckets (LTTB), which keeps the peaks, dips and
+#   overall shape of the line
+# - Bar charts with more categories than CHOLT_CHART_MAX_BARS keep the biggest
+#   ones, in their original order, and add the rest up into one "Other" bar
+# - Line charts whose full series is over CHOLT_CHART_WEBGL_POINTS are drawn
+#   with WebGL (scattergl); there is no WebGL bar trace, so bars never switch
+# - A reduced chart gets the id {'type':'reduced-chart', 'index':<idx>}, so
+#   the zoom callback in chart_zoom.py can redraw the part being looked at in
+#   full; next to it goes a Store {'type':'reduced-chart-source', 'index':<idx>}
+#   which, if the chart's details name the derived table it shows
+#   ('source'), holds that name and its other details, so any worker can get
+#   the full data back with get_derived, whether or not it drew the page (or
+#   the page came from the layout cache); a chart without one has its full
+#   data kept here under <idx>, which only the worker that drew it has
+# - CHOLT_CHART_REDUCE=0 turns it all off; a chart can also opt out with
+#   'reduce':False in its details
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+downsample_config = {}
+downsample_config['enabled']      = os.environ.get("CHOLT_CHART_REDUCE", "1") != "0"
+downsample_config['max_points']   = int(os.environ.get("CHOLT_CHART_MAX_POINTS", "2000"))
+downsample_config['max_bars']     = int(os.environ.get("CHOLT_CHART_MAX_BARS", "200"))
+downsample_config['webgl_points'] = int(os.environ.get("CHOLT_CHART_WEBGL_POINTS", "5000"))
+
+reduced_chart_type  = 'reduced-chart'
+reduced_source_type = 'reduced-chart-source'
+other_label = "Other"
+
+# ------------------------------------------------------------------------------
+# Chart idx -> chart type and details (with the full data) of each reduced chart
+# ------------------------------------------------------------------------------
+reduced_charts = {}
+reduced_charts_lock = threading.Lock()
+
+# ==================================================================================================
+# Reducing the data
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The frame to draw for a chart: the data itself if it's small enough (or
+# reducing is off), otherwise a smaller frame with the same columns
+# ------------------------------------------------------------------------------
+def reduce_chart_data(chart_type, data, x, y, color="", reduce=None):
+    if not downsample_config['enabled'] or reduce is False:
+        return data
+    if chart_type == 'line' and len(data) > downsample_config['max_points']:
+        return reduce_line_data(data, x, y, downsample_config['max_points'])
+    if chart_type == 'bar' and len(data) > downsample_config['max_bars'] and is_categorical_x(data[x]):
+        return reduce_bar_data(data, x, y, color, downsample_config['max_bars'])
+    return data
+
+# ------------------------------------------------------------------------------
+# Lines: LTTB on each y column, keeping every row any of them picked
+# ------------------------------------------------------------------------------
+def reduce_line_data(data, x, y, max_points):
+    xs = get_lttb_x(data[x])
+    keep = np.zeros(len(data), dtype=bool)
+    for col in get_y_list(y):
+        keep[get_lttb_positions(xs, pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float), max_points)] = True
+    return data.iloc[np.flatnonzero(keep)]
+
+# ------------------------------------------------------------------------------
+# Bars: the biggest categories by total height, plus one "Other" bar (per
+# colour) holding the rest
+# ------------------------------------------------------------------------------
+def reduce_bar_data(data, x, y, color, max_bars):
+    ys = get_y_list(y)
+    categories = data[x].astype(object)
+    totals = data[ys].apply(pd.to_numeric, errors='coerce').sum(axis=1).groupby(categories.to_numpy(), sort=False).sum()
+    if len(totals) <= max_bars:
+        return data
+
+    keep = set(totals.nlargest(max_bars - 1, keep='first').index)
+    kept = categories.isin(keep).to_numpy()
+
+    columns = list(dict.fromkeys([x] + ys + ([color] if color else [])))
+    top = data.loc[kept, columns].copy()
+    top[x] = top[x].astype(object)
+
+    rest = data.loc[~kept, columns]
+    if color:
+        other = rest.groupby(rest[color].astype(object), sort=False)[ys].sum().reset_index()
+    else:
+        other = rest[ys].sum().to_frame().T
+    other[x] = other_label
+
+    return pd.concat([top, other[columns]], ignore_index=True)
+
+# ==================================================================================================
+# Largest-triangle-three-buckets
+# - The first and last points are kept; the rest are split into equal buckets
+#   and from each the point making the biggest triangle with the point kept
+#   before it and the average of the next bucket is picked
+# ==================================================================================================
+def get_lttb_positions(xs, ys, threshold):
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    ys = np.nan_to_num(ys)
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    positions = np.empty(threshold, dtype=np.int64)
+    positions[0] = 0
+    positions[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xs[stop:next_stop].mean()
+        avg_y = ys[stop:next_stop].mean()
+
+        area = np.abs((xs[a] - avg_x) * (ys[start:stop] - ys[a]) - (xs[a] - xs[start:stop]) * (avg_y - ys[a]))
+        a = start + int(np.argmax(area))
+        positions[i + 1] = a
+    return positions
+
+# ------------------------------------------------------------------------------
+# LTTB needs x as numbers in order; dates are used as such, anything else
+# (text, or x that goes back and forth) by its position in the series
+# ------------------------------------------------------------------------------
+def get_lttb_x(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.to_numpy().astype('datetime64[ns]').astype(np.int64).astype(float)
+    elif pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        values = series.to_numpy(dtype=float)
+    else:
+        return np.arange(len(series), dtype=float)
+    if np.isnan(values).any() or np.any(np.diff(values) < 0):
+        return np.arange(len(series), dtype=float)
+    return values
+
+# ==================================================================================================
+# WebGL
+# ==================================================================================================
+def needs_webgl(chart_type, data):
+    return downsample_config['enabled'] and chart_type == 'line' and len(data) > downsample_config['webgl_points']
+
+# ------------------------------------------------------------------------------
+# The same figure with its line traces drawn by WebGL; figures from the cache
+# are shared, so this makes a new one
+# ------------------------------------------------------------------------------
+def use_webgl(figure):
+    traces = []
+    for trace in figure['data']:
+        if trace.get('type') == 'scatter':
+            trace = {key:value for key, value in trace.items() if key != 'orientation'}
+            trace['type'] = 'scattergl'
+        traces.append(trace)
+    return dict(figure, data=traces)
+
+# ==================================================================================================
+# Keeping the full data for zooming
+# ==================================================================================================
+def add_reduced_chart(idx, chart_type, details):
+    with reduced_charts_lock:
+        reduced_charts[idx] = {'chart_type':chart_type, 'details':details}
+
+def get_reduced_chart(idx):
+    with reduced_charts_lock:
+        return reduced_charts.get(idx)
+
+# ------------------------------------------------------------------------------
+# What goes in the Store of a chart with a source: everything but the data
+# ------------------------------------------------------------------------------
+def get_chart_source(chart_type, details):
+    return {'chart_type':chart_type, 'table':details['source'],
+            'details':{key:value for key, value in details.items() if key != 'data'}}
+
+# ==================================================================================================
+# Helpers
+# ==================================================================================================
+def get_y_list(y):
+    return list(y) if isinstance(y, (list, tuple)) else [y]
+
+def is_categorical_x(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return True
+    return not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series))
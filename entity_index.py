@@ -0,0 +1,78 @@
+# ==================================================================================================
+# ENTITY INDEX
+# Where each song, artist, album and show turns up in the Performances sheet,
+# built in one pass and kept per data version (see derived.py), so that a
+# detail page is a dict lookup and a slice of a few rows instead of a filter
+# over the whole sheet
+# - index['song']   : (Song, Artist)          -> row positions
+# - index['artist'] : Artist                  -> row positions
+# - index['album']  : (Album, Artist)         -> row positions
+# - index['show']   : (Series, Series Index)  -> row positions
+# - Positions are into data['Performances'] as it is, in sheet order
+# - index['album_of'] holds the album for every row, in the same order
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import numpy as np
+import pandas as pd
+
+# ==================================================================================================
+# Building the index
+# ==================================================================================================
+def build_entity_index(performances, songs):
+    # --------------------------------------------------------------------------
+    # The keys for every row, left as the sheet holds them (text may be
+    # Arrow-backed, see shared_data.py); the album comes from the song, first
+    # one listed
+    # --------------------------------------------------------------------------
+    song   = performances['Song'].array
+    artist = performances['Artist'].array
+    album  = get_song_albums(songs).reindex(pd.MultiIndex.from_arrays([song, artist])).to_numpy()
+
+    index = {}
+    index['song']   = get_key_positions([song, artist])
+    index['artist'] = get_key_positions([artist])
+    index['album']  = get_key_positions([album, artist])
+    index['show']   = get_key_positions([performances['Series'].array, performances['Series Index'].array])
+    index['album_of'] = album
+    return index
+
+# ------------------------------------------------------------------------------
+# Key -> row positions, grouped on integer codes so that each distinct value
+# becomes a Python object once rather than once per row; rows missing part of
+# a key are left out
+# ------------------------------------------------------------------------------
+def get_key_positions(columns):
+    factorized = [pd.factorize(column) for column in columns]
+    valid = np.logical_and.reduce([codes >= 0 for codes, values in factorized])
+    rows  = np.flatnonzero(valid)
+
+    codes  = pd.DataFrame({i:codes[valid] for i, (codes, values) in enumerate(factorized)})
+    groups = codes.groupby(list(codes.columns), sort=False).indices
+    if len(columns) == 1:
+        values = factorized[0][1]
+        return {values[key]:rows[positions] for key, positions in groups.items()}
+    return {tuple(values[code] for (codes, values), code in zip(factorized, key)):rows[positions] for key, positions in groups.items()}
+
+# ------------------------------------------------------------------------------
+# (Song, Artist) -> Album, keeping the first of any repeated songs as the play
+# counts do
+# ------------------------------------------------------------------------------
+def get_song_albums(songs):
+    albums = songs['Album'].astype(object)
+    return albums[~albums.index.duplicated(keep='first')]
+
+# ==================================================================================================
+# Looking things up
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The Performances rows for one entity in sheet order, with the Album of each
+# added on; empty if it was never played
+# ------------------------------------------------------------------------------
+def get_entity_rows(index, kind, key, performances):
+    positions = index[kind].get(key, np.empty(0, dtype=np.intp))
+    rows = performances.iloc[positions].copy()
+    rows['Album'] = index['album_of'][positions]
+    return rows
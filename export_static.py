@@ -0,0 +1,361 @@
+# ==================================================================================================
+# STATIC EXPORT
+# Renders every route in index.pages with the current data and writes the
+# result out as plain files, so a CDN or nginx can serve the site with no
+# Python at all
+# - Pages that need a server callback to do anything (marked 'static':False,
+#   like search) are left out, along with their navbar links
+# - Each page's layout goes in _pages/<page>.<hash>/_dash-layout, named by the
+#   hash of its content so it can be cached forever; <route>/index.html is the
+#   usual Dash page pointed at that folder, plus the Dash and component
+#   scripts, plotly.js and the assets folder, all at the paths the app uses
+# - There are no callbacks in the export: the navigation links do full page
+#   loads, server-side tables carry all their rows and page, sort and filter
+#   in the browser, and reduced charts (see downsample.py) stay reduced
+# - Pages are rendered in parallel, one per process; a page is only rendered
+#   again if its code, the settings or the sheets it read last time changed
+#   (see export_manifest.json in the output)
+# - Serve it with the route folders' index.html as the directory index, e.g.
+#   for nginx: try_files $uri $uri/index.html =404;
+#
+#     python export_static.py [out_dir] [--processes N] [--force]
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import re
+import sys
+import json
+import glob
+import time
+import shutil
+import hashlib
+import argparse
+import functools
+import importlib
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# ------------------------------------------------------------------------------
+# No reload or ingest threads, metrics or layout cache while exporting
+# ------------------------------------------------------------------------------
+os.environ.setdefault("CHOLT_RELOAD_INTERVAL", "0")
+os.environ.setdefault("CHOLT_INGEST_INTERVAL", "0")
+os.environ.setdefault("CHOLT_METRICS", "0")
+os.environ.setdefault("CHOLT_LAYOUT_CACHE", "0")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import index
+    import dash_core_components as dcc
+    import dash_html_components as html
+    import dash_bootstrap_components as dbc
+    from dash.fingerprint import build_fingerprint, check_fingerprint
+    from plotly.offline import get_plotlyjs_version
+
+    from app import app
+    from dataset import Dataset, get_data_version
+    from derived import get_derived
+    from figure_cache import get_frame_fingerprint
+    from layout_cache import to_json_plotly
+    from lib import forking_helpers
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+export_manifest_name = "export_manifest.json"
+export_pages_dir     = "_pages"
+
+# ------------------------------------------------------------------------------
+# The data being exported, set before the worker processes are forked
+# ------------------------------------------------------------------------------
+export_state = {'data':None, 'out_dir':None}
+
+# ------------------------------------------------------------------------------
+# The pages that can work without the server
+# ------------------------------------------------------------------------------
+def get_static_pages():
+    return {page:index.pages[page] for page in index.pages if index.pages[page].get('static', True)}
+
+# ==================================================================================================
+# What goes into a page
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The page's own module and every other module of the app it runs on
+# ------------------------------------------------------------------------------
+def get_code_fingerprint(page):
+    module = importlib.import_module(index.pages[page]['module'])
+    here = os.path.dirname(os.path.abspath(index.__file__))
+    fnames = [module.__file__]
+    for name, other in sorted(sys.modules.items()):
+        fname = getattr(other, '__file__', None) or ''
+        if os.path.dirname(os.path.abspath(fname)) == here and not name.startswith('page_') and name != '__main__':
+            fnames.append(fname)
+
+    sha = hashlib.sha256()
+    for fname in fnames:
+        with open(fname, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+# ------------------------------------------------------------------------------
+# Everything in the init apart from the data, and the CHOLT_ options
+# ------------------------------------------------------------------------------
+def get_settings_fingerprint():
+    settings = {key:value for key, value in index.init_dict.items() if key != 'data'}
+    settings['pages'] = get_static_pages()
+    settings['environ'] = {key:value for key, value in os.environ.items() if key.startswith("CHOLT_")}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def get_sheet_fingerprint(df):
+    return get_frame_fingerprint(df, list(df.columns))
+
+# ------------------------------------------------------------------------------
+# One hash for all of a page's inputs; sheets is sheet -> fingerprint
+# ------------------------------------------------------------------------------
+def get_input_fingerprint(code, settings, sheets):
+    return hashlib.sha256(json.dumps([code, settings, sorted(sheets.items())]).encode('utf-8')).hexdigest()
+
+# ==================================================================================================
+# Rendering
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Render one page and write its layout; runs in a worker process
+# - The page gets a Dataset of its own that loads each sheet from the real one
+#   on first use, so afterwards it knows which sheets the page read; its own
+#   version keeps the derived tables from being shared with other pages
+# ------------------------------------------------------------------------------
+def render_static_page(page):
+    start = time.perf_counter()
+    data, out_dir = export_state['data'], export_state['out_dir']
+    loaders = {sheet:functools.partial(data.__getitem__, sheet) for sheet in data}
+    tracked = Dataset({}, get_data_version(data) + "/" + page, source=data.source, loaders=loaders)
+
+    page_dict = dict(index.init_dict)
+    page_dict['data'] = tracked
+    page_dict['pages'] = get_static_pages()
+    with contextlib.redirect_stdout(io.StringIO()):
+        content = index.get_page_func(page)(page_dict)
+        make_static(content, tracked)
+        layout = dbc.Container([dcc.Location(id='url', refresh=False), html.Div(content, id='page-content')], fluid=True)
+        body = to_json_plotly(layout).encode('utf-8')
+
+    folder = export_pages_dir + "/" + page + "." + hashlib.sha256(body).hexdigest()[:12]
+    write_file(out_dir, folder + "/_dash-layout", body)
+    write_file(out_dir, folder + "/_dash-dependencies", b"[]")
+
+    return {'folder':folder, 'sheets':tracked.loaded_sheets(), 'seconds':time.perf_counter() - start}
+
+# ------------------------------------------------------------------------------
+# Turn the parts of a layout that would need the server into ones that don't
+# ------------------------------------------------------------------------------
+def make_static(content, data):
+    components = [content] if not isinstance(content, (list, tuple)) else list(content)
+    for top in components:
+        if not hasattr(top, '_traverse'):
+            continue
+        for component in [top] + list(top._traverse()):
+            if isinstance(component, dbc.NavLink):
+                component.external_link = True
+            elif isinstance(component, dbc.NavbarSimple):
+                component.brand_external_link = True
+            elif isinstance(getattr(component, 'id', None), dict) and component.id.get('type') == 'server-table':
+                component.data = get_derived(component.id['index'], data).to_dict('records')
+                component.page_action   = 'native'
+                component.filter_action = 'native'
+                component.sort_action   = 'native'
+
+# ------------------------------------------------------------------------------
+# Render the pages, in parallel where processes can be forked
+# ------------------------------------------------------------------------------
+def render_pages(pages, data, out_dir, processes=None):
+    export_state['data'] = data
+    export_state['out_dir'] = out_dir
+    if processes is None or processes <= 0:
+        processes = os.cpu_count() or 1
+
+    if processes <= 1 or len(pages) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return {page:render_static_page(page) for page in pages}
+
+    results = {}
+    with forking_helpers(), ProcessPoolExecutor(max_workers=min(processes, len(pages)), mp_context=multiprocessing.get_context('fork')) as pool:
+        futures = [pool.submit(render_static_page, page) for page in pages]
+        for page, future in zip(pages, futures):
+            results[page] = future.result()
+    return results
+
+# ==================================================================================================
+# The HTML and static files
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Dash's own index page, plus where plotly.js will be; the renderer only
+# loads plotly.js itself from under the layout's folder, so the export
+# includes it up front instead
+# ------------------------------------------------------------------------------
+def get_index_html(client):
+    page = client.get('/').get_data(as_text=True)
+    plotly_path = "/_dash-component-suites/plotly/" + build_fingerprint("package_data/plotly.min.js", get_plotlyjs_version(), int(os.path.getmtime(get_plotlyjs_fname())))
+    renderer = '<script id="_dash-renderer"'
+    page = page.replace(renderer, '<script src="' + plotly_path + '"></script>\n' + renderer, 1)
+    return page, plotly_path
+
+def get_plotlyjs_fname():
+    import plotly
+    return os.path.join(os.path.dirname(plotly.__file__), "package_data", "plotly.min.js")
+
+# ------------------------------------------------------------------------------
+# The index page for one route, with the layout coming from its folder
+# ------------------------------------------------------------------------------
+def get_route_html(page_html, folder):
+    def set_prefix(match):
+        config = json.loads(match.group(2))
+        config['requests_pathname_prefix'] = "/" + folder + "/"
+        return match.group(1) + json.dumps(config) + match.group(3)
+    return re.sub(r'(<script id="_dash-config" type="application/json">)(.*?)(</script>)', set_prefix, page_html, count=1, flags=re.S)
+
+# ------------------------------------------------------------------------------
+# Scripts, favicon and assets: fetched through the app where it serves them,
+# so the files and their fingerprinted names are exactly what it would send
+# ------------------------------------------------------------------------------
+def write_static_files(client, page_html, plotly_path, out_dir):
+    paths = re.findall(r'(?:src|href)="(/(?:_dash-component-suites|_favicon)[^"?]*)', page_html)
+    for path in paths:
+        if path == plotly_path:
+            continue
+        response = client.get(path)
+        if response.status_code != 200:
+            print("WARNING! Could not export " + path)
+            continue
+        write_file(out_dir, path.lstrip("/"), response.get_data())
+
+        # ----------------------------------------------------------------------
+        # The component bundles load their async parts from next to themselves
+        # ----------------------------------------------------------------------
+        if path.startswith("/_dash-component-suites/"):
+            package, fingerprinted = path[len("/_dash-component-suites/"):].split("/", 1)
+            folder = os.path.dirname(check_fingerprint(fingerprinted)[0])
+            source = os.path.join(os.path.dirname(importlib.import_module(package).__file__), folder)
+            for fname in glob.glob(os.path.join(source, "async-*.js")):
+                with open(fname, 'rb') as f:
+                    write_file(out_dir, path.lstrip("/").rsplit("/", 1)[0] + "/" + os.path.basename(fname), f.read())
+
+    with open(get_plotlyjs_fname(), 'rb') as f:
+        write_file(out_dir, plotly_path.lstrip("/"), f.read())
+
+    for fname in glob.glob(os.path.join(app.config.assets_folder, "**", "*"), recursive=True):
+        if os.path.isfile(fname):
+            with open(fname, 'rb') as f:
+                write_file(out_dir, "assets/" + os.path.relpath(fname, app.config.assets_folder).replace(os.sep, "/"), f.read())
+
+# ------------------------------------------------------------------------------
+# Write a file under the output folder, leaving it alone if it's unchanged
+# so that rsync and the like only see what really changed
+# ------------------------------------------------------------------------------
+def write_file(out_dir, path, content):
+    fname = os.path.join(out_dir, *path.split("/"))
+    if os.path.exists(fname):
+        with open(fname, 'rb') as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp = fname + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, fname)
+    return True
+
+# ==================================================================================================
+# The whole export
+# ==================================================================================================
+def export_site(out_dir, processes=None, force=False):
+    start = time.perf_counter()
+    data = index.init_dict['data']
+    manifest_fname = os.path.join(out_dir, export_manifest_name)
+    previous = {}
+    if os.path.exists(manifest_fname) and not force:
+        with open(manifest_fname) as f:
+            previous = json.load(f).get('pages', {})
+
+    # --------------------------------------------------------------------------
+    # Which pages need rendering: new ones, and ones whose inputs changed
+    # --------------------------------------------------------------------------
+    settings = get_settings_fingerprint()
+    static_pages = get_static_pages()
+    codes = {page:get_code_fingerprint(page) for page in static_pages}
+    sheet_fingerprints = {}
+    todo = []
+    for page in static_pages:
+        old = previous.get(page)
+        if not old or not os.path.exists(os.path.join(out_dir, *old['folder'].split("/"), "_dash-layout")):
+            todo.append(page)
+            continue
+        for sheet in old['sheets']:
+            if sheet not in sheet_fingerprints and sheet in data:
+                sheet_fingerprints[sheet] = get_sheet_fingerprint(data[sheet])
+        sheets = {sheet:sheet_fingerprints.get(sheet) for sheet in old['sheets']}
+        if get_input_fingerprint(codes[page], settings, sheets) != old['inputs']:
+            todo.append(page)
+
+    # --------------------------------------------------------------------------
+    # Render them
+    # --------------------------------------------------------------------------
+    results = render_pages(todo, data, out_dir, processes)
+    pages = {}
+    for page in static_pages:
+        if page not in results:
+            pages[page] = dict(previous[page], href=index.pages[page]['href'])
+            print("...unchanged " + index.pages[page]['href'] + "...")
+            continue
+        result = results[page]
+        for sheet in result['sheets']:
+            if sheet not in sheet_fingerprints:
+                sheet_fingerprints[sheet] = get_sheet_fingerprint(data[sheet])
+        sheets = {sheet:sheet_fingerprints[sheet] for sheet in result['sheets']}
+        pages[page] = {'href':index.pages[page]['href'], 'folder':result['folder'], 'sheets':result['sheets'],
+                       'inputs':get_input_fingerprint(codes[page], settings, sheets)}
+        print("...rendered " + index.pages[page]['href'] + " in {:.2f}s...".format(result['seconds']))
+
+    # --------------------------------------------------------------------------
+    # Route pages and the files they load
+    # --------------------------------------------------------------------------
+    client = app.server.test_client()
+    page_html, plotly_path = get_index_html(client)
+    for page in pages:
+        route = pages[page]['href'].strip("/")
+        write_file(out_dir, (route + "/" if route else "") + "index.html", get_route_html(page_html, pages[page]['folder']).encode('utf-8'))
+    for page in previous:
+        route = previous[page]['href'].strip("/")
+        if page not in pages and route and os.path.exists(os.path.join(out_dir, *route.split("/"), "index.html")):
+            os.remove(os.path.join(out_dir, *route.split("/"), "index.html"))
+            if not os.listdir(os.path.join(out_dir, *route.split("/"))):
+                os.rmdir(os.path.join(out_dir, *route.split("/")))
+    write_static_files(client, page_html, plotly_path, out_dir)
+
+    # --------------------------------------------------------------------------
+    # Keep this export's page folders and the last one's (for anyone still on
+    # an old index.html), then record what was done
+    # --------------------------------------------------------------------------
+    keep = {pages[page]['folder'] for page in pages} | {previous[page]['folder'] for page in previous}
+    for folder in glob.glob(os.path.join(out_dir, export_pages_dir, "*")):
+        if export_pages_dir + "/" + os.path.basename(folder) not in keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    manifest = {'version':get_data_version(data), 'exported_at':time.time(), 'pages':pages}
+    write_file(out_dir, export_manifest_name, json.dumps(manifest, indent=1).encode('utf-8'))
+    print("...exported " + str(len(pages)) + " pages (" + str(len(results)) + " rendered) to " + out_dir + " in {:.2f}s...".format(time.perf_counter() - start))
+    return manifest
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render every page to static files")
+    parser.add_argument('out_dir', nargs='?', default="static_site")
+    parser.add_argument('--processes', type=int, default=0, help="pages rendered at once (default one per core)")
+    parser.add_argument('--force', action='store_true', help="render every page, changed or not")
+    args = parser.parse_args()
+
+    export_site(args.out_dir, processes=args.processes, force=args.force)
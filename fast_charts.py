@@ -0,0 +1,191 @@
+# ==================================================================================================
+# FAST CHARTS
+# Bar and line figures built straight from the columns as plain figure dicts,
+# for the simple charts where Plotly Express's grouping and validation cost
+# far more than the chart itself
+# - The output matches what px.bar/px.line give for the same arguments:
+#   same traces, names, hover text, colours, axis titles and template
+# - Only the simple cases are handled (x against one or more y columns, or
+#   one y split by a colour column); for anything else the builders return
+#   None and the caller falls back to px
+# - Numeric arrays are sent the way Plotly sends them, as typed binary
+#   arrays, where this version of Plotly supports it
+# - Charts pick an engine with 'engine' in their details ('px' or 'fast');
+#   CHOLT_CHART_ENGINE sets it for the charts that don't say
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    from _plotly_utils.utils import to_typed_array_spec
+except ImportError:
+    def to_typed_array_spec(values):
+        return values
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+chart_engine = os.environ.get("CHOLT_CHART_ENGINE", "px")
+
+# ------------------------------------------------------------------------------
+# Bar modes done here; px fades overlaid bars, so those are left to it
+# ------------------------------------------------------------------------------
+fast_barmodes = ['', 'relative', 'stack', 'group']
+
+# ------------------------------------------------------------------------------
+# Template name -> template as a plain dict, so each is only converted once
+# ------------------------------------------------------------------------------
+template_dicts = {}
+
+# ==================================================================================================
+# Builders
+# ==================================================================================================
+def build_fast_bar(data, x, y, color, template, barmode):
+    if barmode not in fast_barmodes:
+        return None
+    traces = get_fast_traces(data, x, y, color, template, 'bar', barmode == 'group')
+    if traces is None:
+        return None
+    layout = get_fast_layout(x, y, color, template)
+    layout['barmode'] = barmode or 'relative'
+    return {'data':traces, 'layout':layout}
+
+def build_fast_line(data, x, y, template, legend_title=None):
+    traces = get_fast_traces(data, x, y, "", template, 'line')
+    if traces is None:
+        return None
+    layout = get_fast_layout(x, y, "", template)
+    if legend_title is not None:
+        layout['legend']['title'] = {'text':legend_title}
+    return {'data':traces, 'layout':layout}
+
+# ==================================================================================================
+# Pieces
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# One trace per y column, or per colour value, as px would make them
+# ------------------------------------------------------------------------------
+def get_fast_traces(data, x, y, color, template, kind, grouped=False):
+    ys = list(y) if isinstance(y, (list, tuple)) else [y]
+    wide = isinstance(y, (list, tuple))
+    if not ys or any(col not in data.columns for col in [x] + ys + ([color] if color else [])):
+        return None
+    if color and len(ys) > 1:
+        return None
+
+    colorway = get_template_dict(template)['layout'].get('colorway') or get_default_colorway()
+    x_values = get_column_values(data[x])
+
+    # --------------------------------------------------------------------------
+    # px stacks several y columns into one before splitting them up again, so
+    # they all come out as the one type that holds every column
+    # --------------------------------------------------------------------------
+    columns = {col:get_column_values(data[col]) for col in ys}
+    if wide:
+        common = np.result_type(*[values.dtype for values in columns.values()])
+        columns = {col:values.astype(common, copy=False) for col, values in columns.items()}
+
+    # --------------------------------------------------------------------------
+    # Split by colour: one trace per value, in the order they first appear
+    # --------------------------------------------------------------------------
+    traces = []
+    if color:
+        groups = data[color]
+        if groups.isna().any():
+            return None
+        codes, names = pd.factorize(get_column_values(groups))
+        y_values = columns[ys[0]]
+        y_label = "value" if wide else ys[0]
+        for i, name in enumerate(names):
+            mask = codes == i
+            hover = str(color) + "=" + str(name) + "<br>" + str(x) + "=%{x}<br>" + y_label + "=%{y}<extra></extra>"
+            traces.append(get_trace(kind, hover, str(name), colorway[i % len(colorway)], True, grouped, x_values[mask], y_values[mask]))
+        return traces
+
+    # --------------------------------------------------------------------------
+    # One per y column; a single y given as a string gets no legend
+    # --------------------------------------------------------------------------
+    for i, col in enumerate(ys):
+        if wide:
+            hover = "variable=" + str(col) + "<br>" + str(x) + "=%{x}<br>value=%{y}<extra></extra>"
+            traces.append(get_trace(kind, hover, str(col), colorway[i % len(colorway)], True, grouped, x_values, columns[col]))
+        else:
+            hover = str(x) + "=%{x}<br>" + str(col) + "=%{y}<extra></extra>"
+            traces.append(get_trace(kind, hover, "", colorway[0], False, grouped, x_values, columns[col]))
+    return traces
+
+def get_trace(kind, hover, name, color, showlegend, grouped, x_values, y_values):
+    trace = {}
+    if grouped:
+        trace['alignmentgroup'] = 'True'
+    trace['hovertemplate'] = hover
+    trace['legendgroup']   = name
+    if kind == 'bar':
+        trace['marker']        = {'color':color, 'pattern':{'shape':''}}
+        trace['name']          = name
+        if grouped:
+            trace['offsetgroup'] = name
+        trace['orientation']   = 'v'
+        trace['showlegend']    = showlegend
+        trace['textposition']  = 'auto'
+    else:
+        trace['line']          = {'color':color, 'dash':'solid'}
+        trace['marker']        = {'symbol':'circle'}
+        trace['mode']          = 'lines'
+        trace['name']          = name
+        trace['orientation']   = 'v'
+        trace['showlegend']    = showlegend
+    trace['x']     = to_typed_array_spec(x_values)
+    trace['xaxis'] = 'x'
+    trace['y']     = to_typed_array_spec(y_values)
+    trace['yaxis'] = 'y'
+    trace['type']  = 'bar' if kind == 'bar' else 'scatter'
+    return trace
+
+# ------------------------------------------------------------------------------
+# Axes, legend and template
+# ------------------------------------------------------------------------------
+def get_fast_layout(x, y, color, template):
+    wide = isinstance(y, (list, tuple))
+    layout = {}
+    layout['template'] = get_template_dict(template)
+    layout['xaxis']    = {'anchor':'y', 'domain':[0.0, 1.0], 'title':{'text':str(x)}}
+    layout['yaxis']    = {'anchor':'x', 'domain':[0.0, 1.0], 'title':{'text':"value" if wide else str(y)}}
+    if color:
+        layout['legend'] = {'title':{'text':str(color)}, 'tracegroupgap':0}
+    elif wide:
+        layout['legend'] = {'title':{'text':"variable"}, 'tracegroupgap':0}
+    else:
+        layout['legend'] = {'tracegroupgap':0}
+    layout['margin']   = {'t':60}
+    return layout
+
+# ------------------------------------------------------------------------------
+# Column values as a plain numpy array; categoricals come back as their values
+# ------------------------------------------------------------------------------
+def get_column_values(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return np.asarray(series.astype(object))
+    return series.to_numpy()
+
+# ------------------------------------------------------------------------------
+# The template as it appears in a figure's layout (made once, then shared by
+# every figure, so it mustn't be changed)
+# ------------------------------------------------------------------------------
+def get_template_dict(template):
+    if template not in template_dicts:
+        import plotly.io as pio
+        import plotly.graph_objects as go
+        figure = go.Figure().update_layout(template=pio.templates[template], overwrite=True)
+        template_dicts[template] = figure.to_dict()['layout']['template']
+    return template_dicts[template]
+
+def get_default_colorway():
+    import plotly.colors
+    return plotly.colors.qualitative.Plotly
@@ -0,0 +1,130 @@
+# ==================================================================================================
+# FIGURE CACHE
+# Finished Plotly figures, keyed by a fingerprint of what went into them
+# - generate_bar/generate_line hand over the chart settings and the frame;
+#   if the same columns with the same values have been drawn the same way
+#   before, the stored figure dict comes straight back and Plotly Express
+#   isn't touched
+# - The fingerprint hashes only the columns the chart uses, so it survives
+#   a data reload that didn't change them
+# - Page styling goes in through a registered template (one per style), so a
+#   figure is built in one go rather than restyled with update_layout after
+# - The figures handed out are shared, so callers must not modify them
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# key -> figure dict, most recently used last
+# ------------------------------------------------------------------------------
+figure_cache       = OrderedDict()
+figure_cache_size  = 128
+figure_cache_lock  = threading.Lock()
+figure_cache_stats = {'hits':0, 'misses':0}
+
+# ------------------------------------------------------------------------------
+# Style settings that go into the template, as style key -> layout property
+# ------------------------------------------------------------------------------
+style_template_props = {}
+style_template_props['backgroundColor'] = ['plot_bgcolor', 'paper_bgcolor']
+style_template_props['color']           = ['font_color']
+
+style_templates = {}
+
+# ==================================================================================================
+# Lookup
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Get the figure for these settings and columns of data, calling build() to
+# make it if it isn't cached; settings must be hashable
+# ------------------------------------------------------------------------------
+def get_figure(settings, data, columns, build):
+    key = (settings, get_frame_fingerprint(data, columns))
+
+    with figure_cache_lock:
+        if key in figure_cache:
+            figure_cache.move_to_end(key)
+            figure_cache_stats['hits'] += 1
+            return figure_cache[key]
+
+    figure = build()
+
+    with figure_cache_lock:
+        figure_cache_stats['misses'] += 1
+        figure_cache[key] = figure
+        while len(figure_cache) > figure_cache_size:
+            figure_cache.popitem(last=False)
+    return figure
+
+# ------------------------------------------------------------------------------
+# Hash of the given columns: names, types and every value, in order
+# ------------------------------------------------------------------------------
+def get_frame_fingerprint(data, columns):
+    columns = [col for col in get_column_list(columns) if col in data.columns]
+    subset = data[columns]
+    sha = hashlib.sha1()
+    sha.update(json.dumps([[str(col), str(subset[col].dtype)] for col in columns]).encode('utf-8'))
+    sha.update(pd.util.hash_pandas_object(subset, index=False).to_numpy().tobytes())
+    return sha.hexdigest()
+
+# ------------------------------------------------------------------------------
+# Flatten x, y (a column or a list of them) and color into one list of names
+# ------------------------------------------------------------------------------
+def get_column_list(columns):
+    out = []
+    for col in columns:
+        if isinstance(col, (list, tuple)):
+            out.extend(col)
+        elif col:
+            out.append(col)
+    return list(dict.fromkeys(out))
+
+def get_settings_key(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, str(v)) for k, v in value.items()))
+    return value
+
+def get_figure_cache_stats():
+    stats = dict(figure_cache_stats)
+    stats['entries'] = len(figure_cache)
+    return stats
+
+def clear_figures():
+    with figure_cache_lock:
+        figure_cache.clear()
+
+# ==================================================================================================
+# Styling
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Name of the template for a page style, on top of the default one, e.g.
+# "plotly+cholt_3f2a9c1b"; registered with Plotly the first time it's seen
+# ------------------------------------------------------------------------------
+def get_style_template(style):
+    import plotly.io as pio
+    import plotly.graph_objects as go
+
+    layout = {}
+    for key in style_template_props:
+        if key in style:
+            for prop in style_template_props[key]:
+                layout[prop] = style[key]
+
+    name = "cholt_" + hashlib.sha1(json.dumps(layout, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    if name not in style_templates:
+        pio.templates[name] = go.layout.Template(layout=layout)
+        style_templates[name] = layout
+    return pio.templates.default + "+" + name
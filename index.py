@@ -8,40 +8,151 @@
 
 # ==================================================================================================
 # Imports from Dash and the other assets in this group
+# - Profiling goes first so that it can time everything after it
 # ==================================================================================================
+from profiling import profile_section, profiling_enabled, finish_startup, write_profile
+
+import os
+import time
+import importlib
+import urllib.parse
+
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
 
 from app import app
 
-from page_splash import *
-from page_performances import *
-from page_shows import *
-from page_songs import *
-from page_albums import *
-from page_artists import *
-from page_people import *
-from page_originals import *
 from initialize import init_dict
+from layout_cache import get_layout
+import table_query
+import chart_zoom
+import search
+from metrics import observe_page, add_known_paths, add_route_matcher
+# after metrics, so the response sizes it records are what actually went out
+import compression
 
 # ==================================================================================================
 # Info about the navigable pages
+# - Each page names the module and layout function that build it; the module
+#   is only imported the first time its route is asked for (see get_page_func)
+# - Pages must not define callbacks, since the browser only learns about the
+#   callbacks that exist when it first loads the app; those go in a module
+#   that is imported above, like table_query
+# - A page that is no use without its callback has 'static':False, which
+#   leaves it out of the static export (see export_static.py)
 # ==================================================================================================
 pages = {}
-pages['splash']        = {'href':"/"             , 'name':"Home"            , 'func':layout_splash          }
-pages['performances']  = {'href':"/performances" , 'name':"Performances"    , 'func':layout_performances    }
-pages['shows']         = {'href':"/shows"        , 'name':"Shows"           , 'func':layout_shows           }
-pages['songs']         = {'href':"/songs"        , 'name':"Songs"           , 'func':layout_songs           }
-pages['albums']        = {'href':"/albums"       , 'name':"Albums"          , 'func':layout_albums          }
-pages['artists']       = {'href':"/artists"      , 'name':"Artists"         , 'func':layout_artists         }
-pages['people']        = {'href':"/people"       , 'name':"People"          , 'func':layout_people          }
-pages['originals']     = {'href':"/originals"    , 'name':"Originals"       , 'func':layout_originals       }
+pages['splash']        = {'href':"/"             , 'name':"Home"            , 'module':"page_splash"        , 'func':"layout_splash"          }
+pages['performances']  = {'href':"/performances" , 'name':"Performances"    , 'module':"page_performances"  , 'func':"layout_performances"    }
+pages['shows']         = {'href':"/shows"        , 'name':"Shows"           , 'module':"page_shows"         , 'func':"layout_shows"           }
+pages['songs']         = {'href':"/songs"        , 'name':"Songs"           , 'module':"page_songs"         , 'func':"layout_songs"           }
+pages['albums']        = {'href':"/albums"       , 'name':"Albums"          , 'module':"page_albums"        , 'func':"layout_albums"          }
+pages['artists']       = {'href':"/artists"      , 'name':"Artists"         , 'module':"page_artists"       , 'func':"layout_artists"         }
+pages['people']        = {'href':"/people"       , 'name':"People"          , 'module':"page_people"        , 'func':"layout_people"          }
+pages['originals']     = {'href':"/originals"    , 'name':"Originals"       , 'module':"page_originals"     , 'func':"layout_originals"       }
+pages['search']        = {'href':"/search"       , 'name':"Search"          , 'module':"page_search"        , 'func':"layout_search"          , 'static':False}
+
+# ------------------------------------------------------------------------------
+# Detail pages for one song, artist, album or show; these aren't in the
+# navbar, and the <parts> of the route come to the layout as init['params']
+# ------------------------------------------------------------------------------
+detail_pages = {}
+detail_pages['song']   = {'route':"/songs/<artist>/<song>"   , 'module':"page_details" , 'func':"layout_song"   }
+detail_pages['artist'] = {'route':"/artists/<artist>"        , 'module':"page_details" , 'func':"layout_artist" }
+detail_pages['album']  = {'route':"/albums/<artist>/<album>" , 'module':"page_details" , 'func':"layout_album"  }
+detail_pages['show']   = {'route':"/shows/<series>/<index>"  , 'module':"page_details" , 'func':"layout_show"   }
 
 # ------------------------------------------------------------------------------
 # Store into the dict to be pushed into the layout
 # ------------------------------------------------------------------------------
 init_dict['pages'] = pages
+add_known_paths(pages[page]['href'] for page in pages)
+add_known_paths(detail_pages[page]['route'] for page in detail_pages)
+
+# ------------------------------------------------------------------------------
+# Get a page's info, route and layout function, importing its module if this
+# is the first time
+# ------------------------------------------------------------------------------
+def get_page_info(page):
+    return pages[page] if page in pages else detail_pages[page]
+
+def get_page_route(page):
+    return pages[page]['href'] if page in pages else detail_pages[page]['route']
+
+def get_page_func(page):
+    module = importlib.import_module(get_page_info(page)['module'])
+    return getattr(module, get_page_info(page)['func'])
+
+# ==================================================================================================
+# Route matching
+# - A trie over the path segments: plain segments are keys, and a <part>
+#   matches any one segment; the node at the end holds the page and the names
+#   of its parts
+# - So matching a path is one dict lookup per segment, however many pages
+#   there are
+# ==================================================================================================
+route_trie = {}
+
+def add_route(route, page):
+    node = route_trie
+    names = []
+    for segment in route.split('/')[1:]:
+        if segment.startswith('<') and segment.endswith('>'):
+            names.append(segment[1:-1])
+            segment = '<>'
+        node = node.setdefault(segment, {})
+    node[None] = (page, names)
+
+for page in pages:
+    add_route(pages[page]['href'], page)
+for page in detail_pages:
+    add_route(detail_pages[page]['route'], page)
+
+# ------------------------------------------------------------------------------
+# The page for a path, and the unquoted values of its parts; None if no page
+# has that route
+# ------------------------------------------------------------------------------
+def match_route(pathname):
+    node = route_trie
+    values = []
+    for segment in (pathname or "").split('/')[1:]:
+        if segment in node:
+            node = node[segment]
+        elif '<>' in node and segment:
+            node = node['<>']
+            values.append(urllib.parse.unquote(segment))
+        else:
+            return None, None
+    if None not in node:
+        return None, None
+    page, names = node[None]
+    return page, dict(zip(names, values))
+
+# ------------------------------------------------------------------------------
+# The route a path falls under, for labelling metrics
+# ------------------------------------------------------------------------------
+def get_route_label(pathname):
+    page, params = match_route(pathname)
+    return get_page_route(page) if page is not None else None
+
+add_route_matcher(get_route_label)
+
+# ------------------------------------------------------------------------------
+# Pages to import at startup anyway, from CHOLT_WARM_PAGES: a comma-separated
+# list of page names, or "all"; with gunicorn --preload these are then shared
+# by every worker
+# ------------------------------------------------------------------------------
+warm_pages = [page.strip() for page in os.environ.get("CHOLT_WARM_PAGES", "").split(",") if page.strip()]
+if 'all' in warm_pages:
+    warm_pages = list(pages)
+
+for page in warm_pages:
+    if page not in pages:
+        print("WARNING! No page called " + page + " to warm up")
+        continue
+    get_page_func(page)
 
 # ==================================================================================================
 # Put together the multi-page index and routing
@@ -58,16 +169,38 @@ app.layout = dbc.Container([
 # Path routing via a special callback
 # - The output is the Div that we made just above
 # - The input is the url typed into the browser
-# - Each formal path ending will have a corresponding function in layouts
+# - Each formal path ending will have a corresponding function in layouts,
+#   found through the route trie above
+# - The layout gets its own copy of the init so the data can't be swapped out
+#   from under it halfway through; detail pages find their route's parts in
+#   it as 'params'
+# - Renders are cached per route and data version, so they are only built
+#   again when the data changes
 # ------------------------------------------------------------------------------
 @app.callback(Output('page-content', 'children'),
               Input('url', 'pathname'))
 def display_page(pathname):
-    for page in pages:
-        if pathname == pages[page]['href']:
-            out = pages[page]['func'](init_dict)
-            return out
-    return '404'
+    start = time.perf_counter()
+    page_dict = dict(init_dict)
+    page, params = match_route(pathname)
+    if page is None:
+        observe_page(pathname, time.perf_counter() - start)
+        return '404'
+    page_dict['params'] = params
+    out = get_layout(pathname, page_dict['data'], lambda: render_page(page, page_dict))
+    observe_page(pathname, time.perf_counter() - start)
+    return out
+
+# ------------------------------------------------------------------------------
+# Build a page's layout; only happens when it isn't cached, so in profiling
+# mode this is the first render of each page
+# ------------------------------------------------------------------------------
+def render_page(page, page_dict):
+    with profile_section("render " + get_page_route(page), "render"):
+        out = get_page_func(page)(page_dict)
+    if profiling_enabled():
+        write_profile()
+    return out
 
 # ==================================================================================================
 # Run the server
@@ -77,6 +210,11 @@ def display_page(pathname):
 # ------------------------------------------------------------------------------
 server = app.server
 
+# ------------------------------------------------------------------------------
+# Ready to serve
+# ------------------------------------------------------------------------------
+finish_startup()
+
 # ------------------------------------------------------------------------------
 # If we are running it in test mode
 # ------------------------------------------------------------------------------
@@ -0,0 +1,464 @@
+# ==================================================================================================
+# INGEST
+# Adds a new show's setlist to the data without re-reading the workbook
+# - Each Thursday's show goes in as one small file, CSV or JSON, dropped into
+#   the incoming folder (CHOLT_INGEST_DIR, default data/incoming)
+# - The file is checked against the Songs and Bands sheets, and its rows are
+#   put in front of the Gigs and Performances sheets in a new Dataset that
+#   shares every other sheet with the current one
+# - The play counts are brought up to date from just the new rows (see
+#   play_counts.append_play_counts), and so are the performances, shows and
+#   latest setlist tables: the new rows go in front of the old tables and only
+#   the play counts of the songs just played are looked up again; the other
+#   tables are built from the updated counts when the new data is swapped in
+# - Files are never moved or deleted: they are applied again on top of every
+#   fresh load of the workbook (so they survive restarts and workbook
+#   reloads), and skipped once the workbook has the show itself
+#
+#     python ingest.py show_64.csv            check it, then copy it into the folder
+#     python ingest.py show_64.json --check   only check it
+#
+# CSV: one row per song, with the columns Series, Series Index, Set, Set
+# Position, Song and Artist, plus optionally Location, Date/Time Start, Show
+# Title and Notes (for the show, taken from the first row) and any other
+# Performances columns
+#
+# JSON: {"Series":..., "Series Index":..., "Location":..., "Date/Time Start":...,
+#        "Show Title":..., "Performances":[{"Set":..., "Set Position":...,
+#        "Song":..., "Artist":...}, ...]}
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+
+import pandas as pd
+
+from lib import sheet_index, is_helper_fork, get_data_performances, get_data_shows
+from play_counts import append_play_counts
+from dataset import add_load_hook, update_data
+from derived import peek_derived, seed_derived
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+ingest_config = {}
+ingest_config['dir']      = os.environ.get("CHOLT_INGEST_DIR", os.path.join("data", "incoming"))
+ingest_config['interval'] = float(os.environ.get("CHOLT_INGEST_INTERVAL", "5"))
+
+ingest_extensions = ['.csv', '.json']
+
+# ------------------------------------------------------------------------------
+# Which columns of a setlist file belong to the show rather than the songs
+# ------------------------------------------------------------------------------
+show_columns      = ['Series', 'Series Index', 'Location', 'Date/Time Start', 'Date/Time End', 'Show Title', 'Notes']
+required_columns  = ['Series', 'Series Index', 'Set', 'Set Position', 'Song', 'Artist']
+
+# ------------------------------------------------------------------------------
+# fname -> mtime of files already found wanting, so each is only reported once
+# ------------------------------------------------------------------------------
+rejected_files = {}
+
+# ==================================================================================================
+# Reading a setlist file
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The show as a dict and its songs as a frame; ValueError if the file can't be
+# made sense of at all
+# ------------------------------------------------------------------------------
+def read_setlist(fname):
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.csv':
+        rows = pd.read_csv(fname, dtype=str, keep_default_na=False)
+        rows.columns = [str(col).strip() for col in rows.columns]
+        if len(rows) == 0:
+            raise ValueError("no songs in " + fname)
+        show = {col:rows[col].iloc[0] for col in show_columns if col in rows.columns}
+        rows = rows[[col for col in rows.columns if col not in show_columns or col in ('Series', 'Series Index')]]
+    elif ext == '.json':
+        with open(fname) as f:
+            doc = json.load(f)
+        if not isinstance(doc, dict) or not isinstance(doc.get('Performances'), list):
+            raise ValueError(fname + " needs a Performances list")
+        show = {col:doc[col] for col in show_columns if col in doc}
+        rows = pd.DataFrame(doc['Performances'], dtype=object)
+        rows['Series'] = show.get('Series')
+        rows['Series Index'] = show.get('Series Index')
+    else:
+        raise ValueError(fname + " is not a .csv or .json file")
+
+    # --------------------------------------------------------------------------
+    # Blank cells are missing, and the numbers are numbers
+    # --------------------------------------------------------------------------
+    rows = rows.replace({"":None}).infer_objects()
+    show = {col:show[col] for col in show if show[col] not in ("", None)}
+    for col in ['Series Index', 'Set Position']:
+        if col in rows.columns:
+            rows[col] = pd.to_numeric(rows[col], errors='coerce')
+    if 'Series Index' in show:
+        show['Series Index'] = pd.to_numeric(show['Series Index'], errors='coerce')
+    return show, rows.reset_index(drop=True)
+
+# ==================================================================================================
+# Checking it
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Everything wrong with a setlist, as a list of messages; empty if it can go in
+# ------------------------------------------------------------------------------
+def validate_setlist(data, show, rows):
+    problems = []
+
+    # --------------------------------------------------------------------------
+    # The shape of it
+    # --------------------------------------------------------------------------
+    missing = [col for col in required_columns if col not in rows.columns]
+    if missing:
+        return ["missing columns: " + ", ".join(missing)]
+    if len(rows) == 0:
+        return ["no songs"]
+
+    for col in required_columns:
+        blank = rows.index[rows[col].isna()]
+        if len(blank) > 0:
+            problems.append(col + " is blank on rows " + ", ".join(str(i + 1) for i in blank[:10]))
+
+    shows = rows[['Series', 'Series Index']].drop_duplicates()
+    if len(shows) != 1:
+        problems.append("the file should be one show, it has " + str(len(shows)))
+    if problems:
+        return problems
+
+    series, series_index = show.get('Series'), show.get('Series Index')
+    if pd.isna(series_index) or series_index != int(series_index):
+        return ["Series Index should be a whole number, not " + str(series_index)]
+
+    # --------------------------------------------------------------------------
+    # Against what we already have
+    # --------------------------------------------------------------------------
+    if 'Series' in data and series not in data['Series'].index:
+        problems.append("no series called " + str(series))
+    if (series, int(series_index)) in data['Gigs'].index:
+        problems.append("show " + str(series) + " " + str(int(series_index)) + " is already in the data")
+
+    positions = rows[['Set', 'Set Position']]
+    repeated = positions[positions.duplicated()]
+    for i in range(len(repeated)):
+        problems.append("set " + str(repeated.iloc[i]['Set']) + " position " + str(repeated.iloc[i]['Set Position']) + " is used more than once")
+
+    # --------------------------------------------------------------------------
+    # Every song and artist has to be known already; for a song that isn't,
+    # see whether it is only the capitals that are different
+    # --------------------------------------------------------------------------
+    known_band = rows['Artist'].isin(data['Bands'].index).to_numpy()
+    known_song = pd.MultiIndex.from_arrays([rows['Song'], rows['Artist']]).isin(data['Songs'].index)
+    for i in range(len(rows)):
+        song, artist = rows['Song'].iloc[i], rows['Artist'].iloc[i]
+        if not known_band[i]:
+            problems.append("row " + str(i + 1) + ": no artist called " + str(artist) + " in Bands")
+        elif not known_song[i]:
+            hint = get_song_hint(data['Songs'], song, artist)
+            problems.append("row " + str(i + 1) + ": no song " + str(song) + " by " + str(artist) + " in Songs" + (" (did you mean " + hint + "?)" if hint else ""))
+    return problems
+
+def get_song_hint(songs, song, artist):
+    names = songs.loc[songs['Band'] == artist, 'Name']
+    same = names[names.astype(str).str.upper() == str(song).upper()]
+    return str(same.iloc[0]) if len(same) > 0 else None
+
+# ==================================================================================================
+# Adding it in
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# New Gigs and Performances rows shaped like the sheets they go into: same
+# columns, same types where the values fit, and the same index
+# ------------------------------------------------------------------------------
+def get_sheet_rows(sheet, old, new):
+    new = new.reindex(columns=old.columns)
+    for col in old.columns:
+        dtype = old[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            continue
+        try:
+            cast = new[col].astype(dtype)
+        except (ValueError, TypeError):
+            continue
+        # ----------------------------------------------------------------------
+        # Small integers (CHOLT_COMPACT) would wrap round rather than fail
+        # ----------------------------------------------------------------------
+        if pd.api.types.is_integer_dtype(dtype) and not (cast == new[col]).all():
+            continue
+        new[col] = cast
+    return new.set_index(sheet_index[sheet], drop=False)
+
+# ------------------------------------------------------------------------------
+# Categorical columns (CHOLT_COMPACT) take the new values as extra categories,
+# which keeps the codes already there as they are
+# ------------------------------------------------------------------------------
+def match_categories(old, new):
+    old = old.copy()
+    for col in old.columns:
+        dtype = old[col].dtype
+        if not isinstance(dtype, pd.CategoricalDtype):
+            continue
+        extra = pd.Index(new[col].dropna().unique()).difference(dtype.categories)
+        if len(extra) > 0:
+            old[col] = old[col].cat.add_categories(extra)
+        new[col] = pd.Categorical(new[col], dtype=old[col].dtype)
+    return old, new
+
+def prepend_rows(sheet, old, new):
+    new = get_sheet_rows(sheet, old, new)
+    old, new = match_categories(old, new)
+    return pd.concat([new, old])
+
+# ------------------------------------------------------------------------------
+# A new Dataset with the shows added, newest first as the sheets have them
+# - setlists is a list of (show, rows) that have already been validated
+# - tag goes into the version after the workbook's
+# ------------------------------------------------------------------------------
+def append_setlists(data, setlists, tag):
+    setlists = sorted(setlists, key=lambda setlist: setlist[0]['Series Index'], reverse=True)
+
+    gigs = pd.DataFrame([dict(show, **{'Series Index':int(show['Series Index'])}) for show, rows in setlists])
+    performances = pd.concat([rows.assign(**{'Series Index':int(show['Series Index'])}) for show, rows in setlists], ignore_index=True)
+
+    sheets = {}
+    sheets['Gigs']         = prepend_rows('Gigs', data['Gigs'], gigs)
+    sheets['Performances'] = prepend_rows('Performances', data['Performances'], performances)
+    new_data = data.with_sheets(sheets, data.version + "+" + tag)
+
+    # --------------------------------------------------------------------------
+    # Bring the play counts and the tables on them forward if the old ones are
+    # there to build on; otherwise they are worked out in full the first time
+    # they're needed
+    # --------------------------------------------------------------------------
+    counts = peek_derived('play_counts', data)
+    if counts is not None:
+        counts = append_play_counts(counts, sheets['Performances'].iloc[:len(performances)], data['Songs'])
+        seed_derived('play_counts', new_data, counts)
+        append_tables(data, new_data, sheets['Gigs'].iloc[:len(gigs)], sheets['Performances'].iloc[:len(performances)], counts)
+    return new_data
+
+# ------------------------------------------------------------------------------
+# The performances, shows and latest setlist tables for the new data, from
+# the old data's and the new rows
+# - Each table is built for the new rows alone, the same way as for the whole
+#   sheet, and put in front of the old one, since the new rows are in front in
+#   the sheets too; the result has the same rows and values building it in
+#   full would give
+# ------------------------------------------------------------------------------
+def append_tables(data, new_data, gigs, performances, counts):
+    rows = new_data.with_sheets({'Gigs':gigs, 'Performances':performances}, new_data.version + "/new rows")
+
+    old = peek_derived('shows', data)
+    if old is not None:
+        seed_derived('shows', new_data, prepend_table(get_data_shows(rows, counts), old))
+
+    old = peek_derived('performances', data)
+    if old is None:
+        return
+    part = get_data_performances(rows, counts)
+    table = prepend_table(part, old)
+
+    # --------------------------------------------------------------------------
+    # Songs in the new shows have been played more times, wherever they are
+    # --------------------------------------------------------------------------
+    keys = pd.MultiIndex.from_arrays([table['Song'], table['Artist']])
+    played = keys.isin(pd.MultiIndex.from_arrays([part['Song'], part['Artist']]))
+    times = counts['song']['Times Played'].reindex(keys[played]).to_numpy()
+    table.loc[played, 'Times Played'] = times
+    seed_derived('performances', new_data, table)
+
+    # --------------------------------------------------------------------------
+    # The latest setlist is the newest show in the new rows, or the old
+    # latest one (moved down by the new rows) if that is as new
+    # --------------------------------------------------------------------------
+    old = peek_derived('latest_setlist', data)
+    if old is not None and len(table) > 0:
+        latest = max(part['Show'].max(), old['Show'].max()) if len(old) > 0 else part['Show'].max()
+        pieces = [table.iloc[:len(part)].loc[part['Show'].to_numpy() == latest]]
+        if len(old) > 0 and old['Show'].max() == latest:
+            pieces.append(table.loc[old.index + len(part)])
+        seed_derived('latest_setlist', new_data, pd.concat(pieces))
+
+# ------------------------------------------------------------------------------
+# New rows in front of an old table, with the old table's types where the new
+# rows' values fit them; categoricals (CHOLT_COMPACT) get the new rows' extra
+# categories added after the old ones, as the sheets do
+# ------------------------------------------------------------------------------
+def prepend_table(part, old):
+    for col in old.columns:
+        if col not in part.columns or part[col].dtype == old[col].dtype:
+            continue
+        if isinstance(old[col].dtype, pd.CategoricalDtype) and isinstance(part[col].dtype, pd.CategoricalDtype):
+            categories = old[col].cat.categories
+            categories = categories.append(part[col].cat.categories.difference(categories, sort=False))
+            old = old.assign(**{col:old[col].cat.set_categories(categories)})
+            part[col] = part[col].cat.set_categories(categories)
+        else:
+            try:
+                part[col] = part[col].astype(old[col].dtype)
+            except (ValueError, TypeError):
+                pass
+    return pd.concat([part, old], ignore_index=isinstance(old.index, pd.RangeIndex))
+
+# ==================================================================================================
+# The incoming folder
+# ==================================================================================================
+def list_setlist_files(folder=None):
+    folder = folder or ingest_config['dir']
+    if not os.path.isdir(folder):
+        return []
+    names = sorted(name for name in os.listdir(folder) if os.path.splitext(name)[1].lower() in ingest_extensions)
+    return [os.path.join(folder, name) for name in names]
+
+# ------------------------------------------------------------------------------
+# Add every file in the folder whose show isn't in the data yet; the data is
+# handed back as it was if there are none
+# - Also a load hook, so the files go back on top of every fresh workbook load
+# ------------------------------------------------------------------------------
+def apply_setlist_files(data, folder=None):
+    start = time.perf_counter()
+    setlists = []
+    shows = set()
+    digest = hashlib.sha1()
+    for fname in list_setlist_files(folder):
+        try:
+            show, rows = read_setlist(fname)
+        except Exception as e:
+            report_rejected(fname, [str(e)])
+            continue
+
+        key = (show.get('Series'), show.get('Series Index'))
+        if not pd.isna(key[1]) and key[1] == int(key[1]):
+            key = (key[0], int(key[1]))
+        if key in data['Gigs'].index or key in shows:
+            continue
+
+        problems = validate_setlist(data, show, rows)
+        if problems:
+            report_rejected(fname, problems)
+            continue
+
+        setlists.append((show, rows))
+        shows.add(key)
+        with open(fname, 'rb') as f:
+            digest.update(f.read())
+
+    if not setlists:
+        return data
+
+    new_data = append_setlists(data, setlists, digest.hexdigest()[:8])
+    names = ", ".join(str(show['Series']) + " " + str(int(show['Series Index'])) for show, rows in setlists)
+    print("...added show(s) " + names + " from " + (folder or ingest_config['dir']) + " in {:.3f}s...".format(time.perf_counter() - start))
+    return new_data
+
+add_load_hook(apply_setlist_files)
+
+def report_rejected(fname, problems):
+    mtime = os.path.getmtime(fname)
+    if rejected_files.get(fname) == mtime:
+        return
+    rejected_files[fname] = mtime
+    print("WARNING! Not adding " + fname + ":")
+    for problem in problems:
+        print("    " + problem)
+
+# ------------------------------------------------------------------------------
+# Pick up new files and swap in the data with them added, building on
+# whatever data is current once no reload is under way
+# ------------------------------------------------------------------------------
+def ingest_new_files(init_dict):
+    return update_data(init_dict, apply_setlist_files)
+
+# ==================================================================================================
+# Watching the folder
+# - Polled like the workbook is (see dataset.watch_data); each worker process
+#   watches for itself and adds the files to its own data
+# ==================================================================================================
+ingest_state = {'thread':None, 'args':None, 'stop':None}
+
+def watch_incoming(init_dict, interval=None):
+    interval = ingest_config['interval'] if interval is None else interval
+    if interval <= 0:
+        return None
+    if ingest_state['thread'] is not None and ingest_state['thread'].is_alive():
+        return ingest_state['thread']
+
+    ingest_state['args'] = (init_dict, interval)
+    ingest_state['stop'] = threading.Event()
+    thread = threading.Thread(target=ingest_loop, args=ingest_state['args'] + (ingest_state['stop'],), name="cholt-ingest-watcher", daemon=True)
+    thread.start()
+    ingest_state['thread'] = thread
+    return thread
+
+def stop_watching_incoming():
+    if ingest_state['stop'] is not None:
+        ingest_state['stop'].set()
+    ingest_state['thread'] = None
+
+def restart_after_fork():
+    ingest_state['thread'] = None
+    if not is_helper_fork() and ingest_state['args'] is not None:
+        watch_incoming(*ingest_state['args'])
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_after_fork)
+
+def ingest_loop(init_dict, interval, stop):
+    last_listing = get_listing()
+    while not stop.wait(interval):
+        listing = get_listing()
+        if listing == last_listing:
+            continue
+        last_listing = listing
+        try:
+            ingest_new_files(init_dict)
+        except Exception as e:
+            print("WARNING! Adding new shows failed, keeping the current data: " + str(e))
+
+def get_listing():
+    listing = []
+    for fname in list_setlist_files():
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            continue
+        listing.append((fname, stat.st_mtime_ns, stat.st_size))
+    return listing
+
+# ==================================================================================================
+# Command line: check a file, and copy it into the folder if it passes
+# ==================================================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check a show's setlist file and add it to the incoming folder")
+    parser.add_argument('fname')
+    parser.add_argument('--check', action='store_true', help="only check the file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("CHOLT_RELOAD_INTERVAL", "0")
+    os.environ.setdefault("CHOLT_INGEST_INTERVAL", "0")
+    from initialize import init_dict
+    data = init_dict['data']
+
+    show, rows = read_setlist(args.fname)
+    problems = validate_setlist(data, show, rows)
+    if problems:
+        print("WARNING! " + args.fname + " can't go in as it is:")
+        for problem in problems:
+            print("    " + problem)
+        sys.exit(1)
+    print("...show " + str(show['Series']) + " " + str(int(show['Series Index'])) + " checks out: " + str(len(rows)) + " songs...")
+
+    if not args.check:
+        os.makedirs(ingest_config['dir'], exist_ok=True)
+        shutil.copy(args.fname, ingest_config['dir'])
+        print("...copied to " + ingest_config['dir'] + "; running servers will pick it up within " + str(ingest_config['interval']) + "s...")
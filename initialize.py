@@ -5,7 +5,12 @@
 import sys
 import os
 import json
-from lib import get_marked_data
+from profiling import profile_section
+from dataset import load_dataset, watch_data
+from derived import get_derived
+from ingest import watch_incoming
+# after ingest, so that shows added from setlist files are shared along with the rest
+import shared_data
 
 # ==================================================================================================
 # Initialize
@@ -45,7 +50,19 @@ style_default['textAlign']        = 'center'
 # ------------------------------------------------------------------------------
 print("...reading data...")
 data_fname = os.path.join("data","cholt_data.xlsx")
-data = get_marked_data(data_fname)
+use_snapshot = os.environ.get("CHOLT_SNAPSHOT", "1") != "0"
+use_compact  = os.environ.get("CHOLT_COMPACT", "0") == "1"
+use_lazy     = os.environ.get("CHOLT_LAZY", "0") == "1"
+processes    = int(os.environ.get("CHOLT_LOAD_PROCESSES", "0"))
+with profile_section("load data", "read"):
+    data = load_dataset(data_fname, use_snapshot=use_snapshot, compact=use_compact, lazy=use_lazy, processes=processes)
+print("...data version " + data.version + "...")
+
+# ------------------------------------------------------------------------------
+# Build the play-count index while we're loading anyway; every table uses it
+# ------------------------------------------------------------------------------
+with profile_section("play counts", "index"):
+    get_derived('play_counts', data)
 
 # ------------------------------------------------------------------------------
 # Get universal metrics
@@ -60,6 +77,19 @@ init_dict['footnote']          = footnote
 init_dict['style_default']     = style_default
 init_dict['data']              = data
 
+# ------------------------------------------------------------------------------
+# Watch the workbook and swap in new data when it changes; the reload happens
+# on a background thread, so requests keep being served from the old data
+# ------------------------------------------------------------------------------
+reload_interval = float(os.environ.get("CHOLT_RELOAD_INTERVAL", "5"))
+watch_data(init_dict, data_fname, interval=reload_interval, use_snapshot=use_snapshot, compact=use_compact, lazy=use_lazy, processes=processes)
+
+# ------------------------------------------------------------------------------
+# Same for new shows' setlists dropped into the incoming folder (see ingest.py);
+# any already there were added by load_dataset above
+# ------------------------------------------------------------------------------
+watch_incoming(init_dict)
+
 # ------------------------------------------------------------------------------
 # User info
 # ------------------------------------------------------------------------------
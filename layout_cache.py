@@ -0,0 +1,215 @@
+# ==================================================================================================
+# LAYOUT CACHE
+# Rendered page layouts, keyed by (route, data version)
+# - A page's layout only changes when the data does, so the first render of a
+#   route is serialized and kept; later navigation gets the stored copy
+#   instead of rebuilding the component tree
+# - The memory cache is capped by total serialized size and evicts the least
+#   recently used layout first
+# - If a cache folder is given, renders are also written there so that every
+#   worker on the box can reuse them
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    from plotly.io.json import to_json_plotly
+except ImportError:
+    import plotly
+    def to_json_plotly(obj):
+        return json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder)
+
+from dataset import get_data_version, add_data_listener
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+layout_cache_config = {}
+layout_cache_config['enabled']   = os.environ.get("CHOLT_LAYOUT_CACHE", "1") != "0"
+layout_cache_config['max_bytes'] = int(float(os.environ.get("CHOLT_LAYOUT_CACHE_MB", "64")) * 1024 * 1024)
+layout_cache_config['dir']       = os.environ.get("CHOLT_LAYOUT_CACHE_DIR", "")
+
+# ------------------------------------------------------------------------------
+# (route, version) -> (layout, size in bytes), most recently used last
+# ------------------------------------------------------------------------------
+layout_cache       = OrderedDict()
+layout_cache_lock  = threading.Lock()
+layout_cache_stats = {'hits':0, 'disk_hits':0, 'misses':0, 'evictions':0, 'bytes':0}
+
+# ==================================================================================================
+# Lookup
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Get the layout for a route, calling render() to build it if it isn't cached
+# ------------------------------------------------------------------------------
+def get_layout(route, data, render):
+    if not layout_cache_config['enabled']:
+        return render()
+
+    key = (route, get_data_version(data))
+
+    # --------------------------------------------------------------------------
+    # Memory
+    # --------------------------------------------------------------------------
+    with layout_cache_lock:
+        if key in layout_cache:
+            layout_cache.move_to_end(key)
+            layout_cache_stats['hits'] += 1
+            return layout_cache[key][0]
+
+    # --------------------------------------------------------------------------
+    # Disk, if another worker got there first
+    # --------------------------------------------------------------------------
+    serialized = read_layout_file(key)
+    if serialized is not None:
+        layout_cache_stats['disk_hits'] += 1
+    else:
+        layout_cache_stats['misses'] += 1
+        serialized = to_json_plotly(render())
+        write_layout_file(key, serialized)
+
+    # --------------------------------------------------------------------------
+    # Keep the plain decoded form; it is far cheaper for Dash to send than the
+    # component tree, and is what a render would have turned into anyway
+    # --------------------------------------------------------------------------
+    layout = json.loads(serialized)
+    store_layout(key, layout, len(serialized))
+    return layout
+
+# ------------------------------------------------------------------------------
+# Put a layout in memory, evicting old ones to stay under the cap
+# ------------------------------------------------------------------------------
+def store_layout(key, layout, size):
+    if size > layout_cache_config['max_bytes']:
+        return
+    with layout_cache_lock:
+        if key in layout_cache:
+            layout_cache_stats['bytes'] -= layout_cache.pop(key)[1]
+        layout_cache[key] = (layout, size)
+        layout_cache_stats['bytes'] += size
+        while layout_cache_stats['bytes'] > layout_cache_config['max_bytes']:
+            old_key, (old_layout, old_size) = layout_cache.popitem(last=False)
+            layout_cache_stats['bytes'] -= old_size
+            layout_cache_stats['evictions'] += 1
+
+# ==================================================================================================
+# Invalidation
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Drop cached layouts; with no arguments everything goes, otherwise only the
+# given route and/or version
+# ------------------------------------------------------------------------------
+def invalidate_layouts(route=None, version=None):
+    with layout_cache_lock:
+        for key in list(layout_cache):
+            if (route is None or key[0] == route) and (version is None or key[1] == version):
+                layout_cache_stats['bytes'] -= layout_cache.pop(key)[1]
+
+    for fname, key in list_layout_files():
+        if (route is None or key[0] == get_route_slug(route)) and (version is None or key[1] == version):
+            remove_file(fname)
+
+# ------------------------------------------------------------------------------
+# When new data comes in, everything rendered from older data is dead weight
+# ------------------------------------------------------------------------------
+def drop_stale_layouts(old_data, new_data):
+    version = get_data_version(new_data)
+    with layout_cache_lock:
+        for key in list(layout_cache):
+            if key[1] != version:
+                layout_cache_stats['bytes'] -= layout_cache.pop(key)[1]
+
+    for fname, key in list_layout_files():
+        if key[1] != version:
+            remove_file(fname)
+
+add_data_listener(drop_stale_layouts)
+
+# ------------------------------------------------------------------------------
+# Counters, for logging or the metrics page
+# ------------------------------------------------------------------------------
+def get_layout_cache_stats():
+    stats = dict(layout_cache_stats)
+    stats['entries'] = len(layout_cache)
+    return stats
+
+# ==================================================================================================
+# Shared disk cache
+# - One file per (route, version), named <version>__<route slug>.json, and
+#   written to a temp name then renamed so a reader never sees a partial file
+# - The slug is a readable prefix of the route plus a hash of the whole
+#   pathname, since different detail paths (AC%2FDC and AC_DC) can tidy up
+#   to the same prefix
+# - The folder is trimmed to the same size cap, oldest files first
+# ==================================================================================================
+def get_route_slug(route):
+    prefix = re.sub(r'[^A-Za-z0-9-]+', '_', route.strip('/'))[:40] or "_root"
+    return prefix + "-" + hashlib.sha1(route.encode('utf-8')).hexdigest()[:16]
+
+def get_layout_fname(key):
+    route, version = key
+    return os.path.join(layout_cache_config['dir'], str(version) + "__" + get_route_slug(route) + ".json")
+
+def read_layout_file(key):
+    if not layout_cache_config['dir']:
+        return None
+    try:
+        with open(get_layout_fname(key), encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def write_layout_file(key, serialized):
+    if not layout_cache_config['dir'] or len(serialized) > layout_cache_config['max_bytes']:
+        return
+    fname = get_layout_fname(key)
+    tmp_fname = fname + "." + str(os.getpid()) + ".tmp"
+    try:
+        os.makedirs(layout_cache_config['dir'], exist_ok=True)
+        with open(tmp_fname, 'w', encoding='utf-8') as f:
+            f.write(serialized)
+        os.replace(tmp_fname, fname)
+    except OSError as e:
+        print("WARNING! Could not write layout cache file: " + str(e))
+        return
+    trim_layout_files()
+
+def list_layout_files():
+    if not layout_cache_config['dir'] or not os.path.isdir(layout_cache_config['dir']):
+        return []
+    out = []
+    for fname in os.listdir(layout_cache_config['dir']):
+        if fname.endswith(".json") and "__" in fname:
+            version, slug = fname[:-len(".json")].split("__", 1)
+            out.append((os.path.join(layout_cache_config['dir'], fname), (slug, version)))
+    return out
+
+def trim_layout_files():
+    files = []
+    for fname, key in list_layout_files():
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, fname))
+
+    total = sum(size for mtime, size, fname in files)
+    for mtime, size, fname in sorted(files):
+        if total <= layout_cache_config['max_bytes']:
+            break
+        remove_file(fname)
+        total -= size
+
+def remove_file(fname):
+    try:
+        os.remove(fname)
+    except OSError:
+        pass
@@ -7,8 +7,24 @@
 # Imports
 # ==================================================================================================
 import sys
+import os
+import json
+import time
+import hashlib
+import urllib.parse
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import plotly.express as px
+# plotly.express is slow to import; build_line/build_bar import it the first
+# time a chart is drawn
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 import dash
 import dash_table
@@ -19,6 +35,13 @@ from dash.dependencies import Output, Input
 
 from datetime import datetime, timedelta
 
+from profiling import profile_section
+from play_counts import build_play_counts
+from compact import compact_data
+from figure_cache import get_figure, get_settings_key, get_style_template
+import fast_charts
+from downsample import reduce_chart_data, needs_webgl, use_webgl, add_reduced_chart, get_chart_source, reduced_chart_type, reduced_source_type
+
 # ==================================================================================================
 # FUNCTIONS FOR GENERATING AND DISPLAYING TABLES
 # ==================================================================================================
@@ -26,13 +49,17 @@ from datetime import datetime, timedelta
 # ------------------------------------------------------------------------------
 # This is the generic code to generate a table from any dataframe; this is
 # the simple bootstrap table, only suitable for small outputs
+# - links maps a column to a function(row) giving the href its cells link to;
+#   the row has every column of the data, not just the ones shown
 # ------------------------------------------------------------------------------
-def generate_simple_table(data, idx, max_rows=50):
+def generate_simple_table(data, idx, max_rows=50, links={}, columns=None):
+    columns = list(data.columns) if columns is None else columns
+
     # --------------------------------------------------------------------------
     # The table object
     # --------------------------------------------------------------------------
-    head = html.Thead(html.Tr([html.Th(col) for col in data.columns]))
-    body = html.Tbody([ html.Tr([html.Td(data.iloc[i][col]) for col in data.columns]) for i in range(min(len(data), max_rows)) ])
+    head = html.Thead(html.Tr([html.Th(col) for col in columns]))
+    body = html.Tbody([ html.Tr([get_simple_cell(data.iloc[i], col, links) for col in columns]) for i in range(min(len(data), max_rows)) ])
     table = dbc.Table([head, body],id=idx,bordered=True,dark=True,hover=True,responsive=True,striped=True,size='sm',style={'overflowY':'scroll'})
 
     # --------------------------------------------------------------------------
@@ -48,39 +75,62 @@ def generate_simple_table(data, idx, max_rows=50):
     # --------------------------------------------------------------------------
     return html.Div(components, className = 'row')
 
+def get_simple_cell(row, col, links):
+    value = row[col]
+    if col in links and not pd.isna(value):
+        return html.Td(dcc.Link(str(value), href=links[col](row)))
+    return html.Td(value)
+
 # ------------------------------------------------------------------------------
 # Bundle the components used to display a simple table
 # ------------------------------------------------------------------------------
-def display_simple_table(df, idx="", title=""):
+def display_simple_table(df, idx="", title="", max_rows=50, links={}, columns=None):
     components = []
 
     components.append(get_empty_row())
     components.append(html.H3(title))
-    components.append(generate_simple_table(df, idx))
+    components.append(generate_simple_table(df, idx, max_rows, links, columns))
 
     return components
 
 # ------------------------------------------------------------------------------
 # This is for 'real' tables
+# - If a source is given (the name of a derived table, see derived.py) the
+#   paging, filtering and sorting happen on the server and only the first
+#   page goes out with the layout; see table_query.py
 # ------------------------------------------------------------------------------
-def generate_data_table(df, idx, height='500px'):
+def generate_data_table(df, idx, height='500px', source=None, page_size=50):
+    # --------------------------------------------------------------------------
+    # Work out what the browser does and what we do
+    # --------------------------------------------------------------------------
+    if source:
+        table_id = {'type':'server-table', 'index':source}
+        table_args = dict(data=df.iloc[:page_size].to_dict('records'),
+                          page_action='custom', page_current=0, page_size=page_size,
+                          page_count=max(1, -(-len(df) // page_size)),
+                          filter_action='custom', filter_query='',
+                          sort_action='custom', sort_by=[])
+    else:
+        table_id = idx
+        table_args = dict(data=df.to_dict('records'),
+                          page_action='none',
+                          filter_action='native',
+                          sort_action='native')
+
     # --------------------------------------------------------------------------
     # The table object
     # --------------------------------------------------------------------------
     table = dash_table.DataTable(
-            id=idx,
-            data = df.to_dict('records'),
+            id=table_id,
             columns = [{'id':c, 'name':c} for c in df.columns],
-            filter_action='native',
-            page_action='none',
             #fixed_rows={'headers':True},    <------TODO WHEN THIS IS ON, THE FILTERS SHOW NOTHING
             style_cell={'whiteSpace':'normal','height':'auto','textAlign':'left', 'minWidth':'50px', 'maxWidth':'180px'},
             style_table={'height':height, 'overflowY':'auto' },
             style_header={'backgroundColor':'Black', 'fontWeight':'bold', 'textAlign':'center' },
             style_data_conditional=[{'if': {'row_index':'odd'},'backgroundColor':'rgb(0,0,0)'},{'if': {'row_index':'even'},'backgroundColor':'rgb(25,25,25)'}],
             style_as_list_view=False,
-            sort_action='native',
-            sort_mode='multi'
+            sort_mode='multi',
+            **table_args
             )
 
     # --------------------------------------------------------------------------
@@ -88,7 +138,10 @@ def generate_data_table(df, idx, height='500px'):
     # --------------------------------------------------------------------------
     components = []
     components.append(get_empty_col())
-    components.append(html.Div(table, className = 'col-10'))
+    if source:
+        components.append(html.Div(table, id=idx, className = 'col-10'))
+    else:
+        components.append(html.Div(table, className = 'col-10'))
     components.append(get_empty_col())
 
     # --------------------------------------------------------------------------
@@ -99,12 +152,12 @@ def generate_data_table(df, idx, height='500px'):
 # ------------------------------------------------------------------------------
 # Bundle the components used to display a data table
 # ------------------------------------------------------------------------------
-def display_data_table(df, idx="", title="", height="500px"):
+def display_data_table(df, idx="", title="", height="500px", source=None):
     components = []
 
     components.append(get_empty_row())
     components.append(html.H3(title))
-    components.append(generate_data_table(df, idx, height))
+    components.append(generate_data_table(df, idx, height, source=source))
 
     return components
 
@@ -112,6 +165,22 @@ def display_data_table(df, idx="", title="", height="500px"):
 # Chart-related functions
 # ==================================================================================================
 
+# ------------------------------------------------------------------------------
+# The figure for one chart from charts_with_controls, drawn from the given data
+# ------------------------------------------------------------------------------
+def get_chart_figure(chart_type, details, data):
+    if chart_type == 'bar':
+        if 'color' in details:
+            figure = generate_bar(data=data,x=details['x'],y=details['y'],style=details['style'],color=details['color'],engine=details.get('engine'))
+        else:
+            figure = generate_bar(data=data,x=details['x'],y=details['y'],style=details['style'],engine=details.get('engine'))
+
+    if chart_type == 'line':
+        figure = generate_line(data,details['x'],details['y'],style=details['style'],engine=details.get('engine'))
+        if needs_webgl(chart_type, details['data']):
+            figure = use_webgl(figure)
+    return figure
+
 # ------------------------------------------------------------------------------
 # Complete chart system with controls
 # ------------------------------------------------------------------------------
@@ -127,15 +196,26 @@ def charts_with_controls(charts, controls, layout):
     for chart in charts:
         thischart = charts[chart]
         details   = charts[chart]['details']
-        if thischart['chart_type'] == 'bar':
-            if 'color' in details:
-                figure = generate_bar(data=details['data'],x=details['x'],y=details['y'],style=details['style'],color=details['color'])
-            else:
-                figure = generate_bar(data=details['data'],x=details['x'],y=details['y'],style=details['style'])
 
-        if thischart['chart_type'] == 'line':
-            figure = generate_line(details['data'],details['x'],details['y'],style=details['style'])
-        charts[chart]['figure'] = dcc.Graph(id=charts[chart]['idx'],figure=figure)
+        # ----------------------------------------------------------------------
+        # Big series are drawn from a smaller frame; those charts say where
+        # the full data comes from, or keep it here, for the zoom callback
+        # (see downsample.py)
+        # ----------------------------------------------------------------------
+        data = reduce_chart_data(thischart['chart_type'], details['data'], details['x'], details['y'], details.get('color',""), details.get('reduce'))
+        figure = get_chart_figure(thischart['chart_type'], details, data)
+
+        idx = charts[chart]['idx']
+        if data is details['data']:
+            charts[chart]['figure'] = dcc.Graph(id=idx,figure=figure)
+            continue
+        source = None
+        if details.get('source'):
+            source = get_chart_source(thischart['chart_type'], details)
+        else:
+            add_reduced_chart(idx, thischart['chart_type'], details)
+        charts[chart]['figure'] = html.Div([dcc.Graph(id={'type':reduced_chart_type, 'index':idx},figure=figure),
+                                            dcc.Store(id={'type':reduced_source_type, 'index':idx},data=source)])
     
     # --------------------------------------------------------------------------
     # Create the matrix for the chart based on the shape input
@@ -285,6 +365,17 @@ def get_navbar(pages, title):
     # --------------------------------------------------------------------------
     return navbar
 
+# ------------------------------------------------------------------------------
+# Link to the detail page for a song, artist, album or show (see the detail
+# routes in index.py); each part is quoted, so names with slashes still work
+# - get_detail_href('song', artist, song), ('artist', artist),
+#   ('album', artist, album), ('show', series, series_index)
+# ------------------------------------------------------------------------------
+detail_prefixes = {'song':"/songs", 'artist':"/artists", 'album':"/albums", 'show':"/shows"}
+
+def get_detail_href(kind, *parts):
+    return detail_prefixes[kind] + "".join("/" + urllib.parse.quote(str(part), safe='') for part in parts)
+
 # ==================================================================================================
 # Utility functions for doing data-related stuff
 # ==================================================================================================
@@ -330,93 +421,67 @@ def get_date_hierarchy(date):
 # ==================================================================================================
 # Creating figures
 # ==================================================================================================
-def generate_line(data, x, y, color="", legend_title=None, style={}, config={}):
-    # --------------------------------------------------------------------------
-    # Initialize the line object
-    # --------------------------------------------------------------------------
-    line = px.line(data,x=x,y=y)
-    # --------------------------------------------------------------------------
-    # Update styling
+def generate_line(data, x, y, color="", legend_title=None, style={}, config={}, engine=None):
     # --------------------------------------------------------------------------
-    if 'backgroundColor' in style:
-        line.update_layout(plot_bgcolor=style['backgroundColor'])
-        line.update_layout(paper_bgcolor=style['backgroundColor'])
-    if 'color' in style:
-        line.update_layout(font_color=style['color'])
+    # Same chart from the same data comes from the cache
     # --------------------------------------------------------------------------
-    # Update the legend title
-    # --------------------------------------------------------------------------
-    if legend_title is not None:
-        line.update_layout(legend_title_text  = legend_title)
-    return line
+    engine = engine or fast_charts.chart_engine
+    settings = ('line', x, get_settings_key(y), legend_title, get_settings_key(style), engine)
+    return get_figure(settings, data, [x, y], lambda: build_line(data, x, y, legend_title, style, engine))
 
-def generate_bar(data, x, y, color="", style={}, config={}, barmode='', facet=''):
+def build_line(data, x, y, legend_title, style, engine='px'):
     # --------------------------------------------------------------------------
-    # Make the bar chart figure
+    # The fast builder, if it can do this chart
     # --------------------------------------------------------------------------
-    if color:
-        bar = px.bar(data, x=x, y=y, color=color)
-    else:
-        bar = px.bar(data, x=x, y=y)
+    if engine == 'fast':
+        figure = fast_charts.build_fast_line(data, x, y, get_style_template(style), legend_title)
+        if figure is not None:
+            return figure
 
     # --------------------------------------------------------------------------
-    # Update mode if needed
+    # Initialize the line object, styled by the template
     # --------------------------------------------------------------------------
-    if barmode:
-        bar.update_layout(barmode=barmode)
+    import plotly.express as px
+    line = px.line(data, x=x, y=y, template=get_style_template(style))
 
     # --------------------------------------------------------------------------
-    # Update facet if needed
+    # Update the legend title
     # --------------------------------------------------------------------------
-    #if facet:
-    #    bar.update_layout(facet=facet)
+    if legend_title is not None:
+        line.update_layout(legend_title_text  = legend_title)
+    return line.to_dict()
 
+def generate_bar(data, x, y, color="", style={}, config={}, barmode='', facet='', engine=None):
     # --------------------------------------------------------------------------
-    # Update styling
+    # Same chart from the same data comes from the cache
     # --------------------------------------------------------------------------
-    if 'backgroundColor' in style:
-        bar.update_layout(plot_bgcolor=style['backgroundColor'])
-        bar.update_layout(paper_bgcolor=style['backgroundColor'])
-    if 'color' in style:
-        bar.update_layout(font_color=style['color'])
+    engine = engine or fast_charts.chart_engine
+    settings = ('bar', x, get_settings_key(y), color, barmode, get_settings_key(style), engine)
+    return get_figure(settings, data, [x, y, color], lambda: build_bar(data, x, y, color, style, barmode, engine))
 
+def build_bar(data, x, y, color, style, barmode, engine='px'):
     # --------------------------------------------------------------------------
-    # Kick out before making the whole chart object if we are refreshing
+    # The fast builder, if it can do this chart
     # --------------------------------------------------------------------------
-    return bar
+    if engine == 'fast':
+        figure = fast_charts.build_fast_bar(data, x, y, color, get_style_template(style), barmode)
+        if figure is not None:
+            return figure
 
-def generate_data_table(df, idx, height='500px'):
     # --------------------------------------------------------------------------
-    # The table object
+    # Make the bar chart figure, styled by the template; px defaults to
+    # relative bars if no mode is given
     # --------------------------------------------------------------------------
-    table = dash_table.DataTable(
-            id=idx,
-            data = df.to_dict('records'),
-            columns = [{'id':c, 'name':c} for c in df.columns],
-            filter_action='native',
-            page_action='none',
-            #fixed_rows={'headers':True},    <------TODO WHEN THIS IS ON, THE FILTERS SHOW NOTHING
-            style_cell={'whiteSpace':'normal','height':'auto','textAlign':'left', 'minWidth':'50px', 'maxWidth':'180px'},
-            style_table={'height':height, 'overflowY':'auto' },
-            style_header={'backgroundColor':'Black', 'fontWeight':'bold', 'textAlign':'center' },
-            style_data_conditional=[{'if': {'row_index':'odd'},'backgroundColor':'rgb(0,0,0)'},{'if': {'row_index':'even'},'backgroundColor':'rgb(25,25,25)'}],
-            style_as_list_view=False,
-            sort_action='native',
-            sort_mode='multi'
-            )
+    import plotly.express as px
+    bar = px.bar(data, x=x, y=y, color=color or None, barmode=barmode or 'relative', template=get_style_template(style))
 
     # --------------------------------------------------------------------------
-    # Consolidate
+    # Update facet if needed
     # --------------------------------------------------------------------------
-    components = []
-    components.append(get_empty_col())
-    components.append(html.Div(table, className = 'col-10'))
-    components.append(get_empty_col())
+    #if facet:
+    #    bar.update_layout(facet=facet)
 
-    # --------------------------------------------------------------------------
-    # Finish
-    # --------------------------------------------------------------------------
-    return html.Div(components, className = 'row')
+    return bar.to_dict()
 
 # ==================================================================================================
 # Helper Functions
@@ -440,48 +505,546 @@ def shape_matrixify(shape):
 # ==================================================================================================
 # General functions for this project
 # ==================================================================================================
+# ------------------------------------------------------------------------------
+# How each sheet gets indexed once it has been read
+# ------------------------------------------------------------------------------
+sheet_index = {}
+sheet_index['People']       = 'Name'
+sheet_index['Instruments']  = 'Name'
+sheet_index['Genres']       = 'Name'
+sheet_index['Bands']        = 'Name'
+sheet_index['Albums']       = ['Name','Band']
+sheet_index['Songs']        = ['Name','Band']
+sheet_index['Places']       = 'Name'
+sheet_index['Series']       = 'Name'
+sheet_index['Gigs']         = ['Series','Series Index']
+sheet_index['Performances'] = ['Series','Series Index','Set','Set Position']
+sheet_index['Image']        = 'File Name'
+sheet_index['Audio']        = 'File Name'
+sheet_index['Video']        = 'File Name'
+
 # ------------------------------------------------------------------------------
 # Get the existing marked-up data, no frills
+# - If use_snapshot is on, a binary copy of the sheets is kept next to the
+#   workbook and used instead of parsing the Excel file whenever it is current
+# - If compact is on, the sheets are converted to smaller types before being
+#   indexed; see compact.py
+# - processes is how many worker processes parse the workbook when it has to
+#   be parsed; see read_workbook
 # ------------------------------------------------------------------------------
-def get_marked_data(data_fname):
+def get_marked_data(data_fname, use_snapshot=True, compact=False, processes=None):
     # --------------------------------------------------------------------------
     # Start
     # --------------------------------------------------------------------------
     print("...reading data from file " + data_fname + "...")
 
     # --------------------------------------------------------------------------
-    # Get the whole mess at once
+    # Try the snapshot first; it already holds the cleaned-up sheets
+    # --------------------------------------------------------------------------
+    existing_data = None
+    if use_snapshot:
+        with profile_section("read snapshot", "read"):
+            existing_data = read_snapshot(data_fname)
+
+    # --------------------------------------------------------------------------
+    # Otherwise get the whole mess at once, and drop the empty rows
+    # --------------------------------------------------------------------------
+    if existing_data is None:
+        with profile_section("parse workbook", "read"):
+            existing_data = read_workbook(data_fname, processes=processes)
+
+        if use_snapshot:
+            with profile_section("write snapshot", "write"):
+                write_snapshot(data_fname, existing_data)
+
+    # --------------------------------------------------------------------------
+    # Shrink it down if asked
     # --------------------------------------------------------------------------
-    existing_data = pd.read_excel(data_fname, sheet_name=None, usecols = lambda x: 'Unnamed' not in x,)
+    if compact:
+        with profile_section("compact", "index"):
+            existing_data = compact_data(existing_data, sheet_index)
 
     # --------------------------------------------------------------------------
     # Set up the index for each
     # --------------------------------------------------------------------------
-    existing_data['People']       = existing_data['People'].set_index('Name', drop=False).dropna(how='all')
-    existing_data['Instruments']  = existing_data['Instruments'].set_index('Name', drop=False).dropna(how='all')
-    existing_data['Genres']       = existing_data['Genres'].set_index('Name', drop=False).dropna(how='all')
-    existing_data['Bands']        = existing_data['Bands'].set_index('Name', drop=False).dropna(how='all')
-    existing_data['Albums']       = existing_data['Albums'].set_index(['Name','Band'], drop=False).dropna(how='all')
-    existing_data['Songs']        = existing_data['Songs'].set_index(['Name','Band'], drop=False).dropna(how='all')
-    existing_data['Places']       = existing_data['Places'].set_index('Name', drop=False).dropna(how='all')
-    existing_data['Series']       = existing_data['Series'].set_index('Name', drop=False).dropna(how='all')
-    existing_data['Gigs']         = existing_data['Gigs'].set_index(['Series','Series Index'], drop=False).dropna(how='all')
-    existing_data['Performances'] = existing_data['Performances'].set_index(['Series','Series Index','Set','Set Position'], drop=False).dropna(how='all')
-    existing_data['Image']        = existing_data['Image'].set_index('File Name', drop=False).dropna(how='all')
-    existing_data['Audio']        = existing_data['Audio'].set_index('File Name', drop=False).dropna(how='all')
-    existing_data['Video']        = existing_data['Video'].set_index('File Name', drop=False).dropna(how='all')
+    with profile_section("set index", "index"):
+        for sheet in existing_data:
+            if sheet in sheet_index:
+                existing_data[sheet] = existing_data[sheet].set_index(sheet_index[sheet], drop=False)
 
     # --------------------------------------------------------------------------
     # Finish
     # --------------------------------------------------------------------------
     return existing_data
 
+# ==================================================================================================
+# Helper processes
+# - Processes forked just to share out a piece of work (parsing the workbook,
+#   the static export) run the same at-fork hooks as server workers, which
+#   restart the watcher threads; the thread doing the forking is noted here
+#   so that those hooks can leave the helpers alone
+# - A forked child's one thread is a copy of the thread that forked it, with
+#   the same ident, whichever thread that was
+# ==================================================================================================
+helper_fork_threads = set()
+
+@contextlib.contextmanager
+def forking_helpers():
+    ident = threading.get_ident()
+    helper_fork_threads.add(ident)
+    try:
+        yield
+    finally:
+        helper_fork_threads.discard(ident)
+
+def is_helper_fork():
+    return threading.get_ident() in helper_fork_threads
+
+# ==================================================================================================
+# Parsing the workbook
+# - Parsing is single-threaded per sheet, so on a box with cores to spare the
+#   sheets are parsed side by side in worker processes
+# - Each worker writes its sheet to a Feather file and hands back the file
+#   name, so the frame comes back as one Arrow read rather than through a
+#   pickle; without pyarrow the frame itself is sent back
+# - Workers are forked, so they start with everything already imported; where
+#   fork isn't available, or there's only the one core, it's done serially
+# ==================================================================================================
+def read_workbook(data_fname, processes=None):
+    start = time.perf_counter()
+    if processes is None or processes <= 0:
+        processes = os.cpu_count() or 1
 
+    # --------------------------------------------------------------------------
+    # Serial: the whole mess at once
+    # --------------------------------------------------------------------------
+    if processes <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        existing_data = pd.read_excel(data_fname, sheet_name=None, usecols = lambda x: 'Unnamed' not in x,)
+        for sheet in existing_data:
+            existing_data[sheet] = existing_data[sheet].dropna(how='all').reset_index(drop=True)
+        print("...parsed " + str(len(existing_data)) + " sheets in {:.2f}s...".format(time.perf_counter() - start))
+        return existing_data
+
+    # --------------------------------------------------------------------------
+    # Parallel: one sheet per task, collected back in workbook order
+    # --------------------------------------------------------------------------
+    sheets = get_sheet_names(data_fname, use_snapshot=False)
+    processes = min(processes, len(sheets))
+    existing_data = {}
+    with tempfile.TemporaryDirectory(prefix="cholt-parse-") as tmp_dir:
+        with forking_helpers(), ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = [pool.submit(parse_workbook_sheet, data_fname, sheet, tmp_dir) for sheet in sheets]
+            for sheet, future in zip(sheets, futures):
+                existing_data[sheet] = get_parsed_sheet(future.result())
+
+    print("...parsed " + str(len(existing_data)) + " sheets in {:.2f}s on {} processes...".format(time.perf_counter() - start, processes))
+    return existing_data
+
+# ------------------------------------------------------------------------------
+# Worker side: parse one sheet, drop the empty rows, and write it out
+# ------------------------------------------------------------------------------
+def parse_workbook_sheet(data_fname, sheet, tmp_dir):
+    df = pd.read_excel(data_fname, sheet_name=sheet, usecols = lambda x: 'Unnamed' not in x,)
+    df = df.dropna(how='all').reset_index(drop=True)
+    if pyarrow is None:
+        return df
+
+    fname = os.path.join(tmp_dir, hashlib.sha1(sheet.encode('utf-8')).hexdigest() + ".feather")
+    encode_snapshot_frame(df).to_feather(fname)
+    return fname
+
+# ------------------------------------------------------------------------------
+# Parent side: read back whatever the worker handed over
+# ------------------------------------------------------------------------------
+def get_parsed_sheet(result):
+    if isinstance(result, pd.DataFrame):
+        return result
+    df = decode_snapshot_frame(pd.read_feather(result))
+    os.remove(result)
+    return df
+
+# ------------------------------------------------------------------------------
+# Get one sheet of the marked-up data, for loading the sheets as they are needed
+# - Same result as get_marked_data gives for that sheet, except that in compact
+#   mode the sheet gets a dictionary of its own rather than the shared one
+# - sha256 is the hash of the workbook the caller expects; if the file has
+#   changed since and the snapshot doesn't have the sheet from that version,
+#   it can't be read at all, since it would be a sheet from the new workbook
+#   served with the old ones; the load fails until the watcher has swapped in
+#   the new data
+# ------------------------------------------------------------------------------
+def get_marked_sheet(data_fname, sheet, sha256=None, use_snapshot=True, compact=False):
+    with profile_section("sheet " + sheet, "read"):
+        # ----------------------------------------------------------------------
+        # Try the snapshot first
+        # ----------------------------------------------------------------------
+        df = None
+        if use_snapshot:
+            df = read_snapshot_sheet(data_fname, sheet, sha256)
+
+        # ----------------------------------------------------------------------
+        # Otherwise parse just this sheet out of the workbook
+        # ----------------------------------------------------------------------
+        if df is None:
+            print("...reading sheet " + sheet + " from file " + data_fname + "...")
+            df = pd.read_excel(data_fname, sheet_name=sheet, usecols = lambda x: 'Unnamed' not in x,)
+            df = df.dropna(how='all').reset_index(drop=True)
+
+            current = get_file_hash(data_fname)
+            if sha256 is not None and current != sha256:
+                raise RuntimeError("Workbook changed before sheet " + sheet + " was read; it can't be used until the new data is loaded")
+            if use_snapshot:
+                write_snapshot_sheet(data_fname, sheet, df, current)
+
+        # ----------------------------------------------------------------------
+        # Shrink and index, as above
+        # ----------------------------------------------------------------------
+        if compact:
+            df = compact_data({sheet:df}, sheet_index)[sheet]
+        if sheet in sheet_index:
+            df = df.set_index(sheet_index[sheet], drop=False)
+        return df
+
+# ------------------------------------------------------------------------------
+# Names of the sheets in the workbook, from the snapshot if it knows them,
+# without parsing any of them
+# ------------------------------------------------------------------------------
+def get_sheet_names(data_fname, use_snapshot=True):
+    if use_snapshot:
+        manifest = check_snapshot(data_fname)
+        if manifest is not None and manifest.get('sheet_names'):
+            return list(manifest['sheet_names'])
+    with pd.ExcelFile(data_fname) as f:
+        return list(f.sheet_names)
+
+# ==================================================================================================
+# Snapshot cache for the workbook
+# - Each sheet is stored as its own Feather (Arrow IPC) file in a hidden folder
+#   next to the workbook, along with a manifest that records the mtime, size
+#   and sha256 of the workbook it was built from
+# - Object columns that mix strings with numbers (an album called 1999, say)
+#   can't go into Arrow as-is, so they are stored as strings alongside a small
+#   column of type codes that puts the original values back on the way out
+# - Sheets can also be added one at a time as they are first read (see
+#   get_marked_sheet); the manifest lists every sheet in the workbook under
+#   'sheet_names', so a partly built snapshot is never taken for a whole one
+# - Files for the previous version of the workbook are kept until the one
+#   after, so a process still serving that version can go on reading them
+# ==================================================================================================
+snapshot_format = 1
+
+snapshot_kinds = {str:0, int:1, float:2, bool:3, datetime:4}
+snapshot_kind_prefix = '__kind__'
+
+# ------------------------------------------------------------------------------
+# Where the snapshot for a given workbook lives
+# ------------------------------------------------------------------------------
+def get_snapshot_dir(data_fname):
+    folder, fname = os.path.split(data_fname)
+    return os.path.join(folder, "." + fname + ".snapshot")
+
+# ------------------------------------------------------------------------------
+# Content hash of the workbook
+# ------------------------------------------------------------------------------
+def get_file_hash(data_fname):
+    sha = hashlib.sha256()
+    with open(data_fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# ------------------------------------------------------------------------------
+# Read the manifest, if there is one
+# ------------------------------------------------------------------------------
+def read_snapshot_manifest(data_fname):
+    manifest_fname = os.path.join(get_snapshot_dir(data_fname), "manifest.json")
+    try:
+        with open(manifest_fname) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('format') != snapshot_format:
+        return None
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Write the manifest atomically so that readers never see half of one
+# ------------------------------------------------------------------------------
+def write_snapshot_manifest(data_fname, manifest):
+    snapshot_dir = get_snapshot_dir(data_fname)
+    manifest_fname = os.path.join(snapshot_dir, "manifest.json")
+    tmp_fname = manifest_fname + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_fname, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_fname, manifest_fname)
+
+# ------------------------------------------------------------------------------
+# Decide whether the snapshot still matches the workbook
+# - Same mtime and size is taken as a match; otherwise the content hash
+#   decides, so a touched-but-unchanged workbook doesn't force a rebuild
+# ------------------------------------------------------------------------------
+def check_snapshot(data_fname):
+    # --------------------------------------------------------------------------
+    # Nothing to check without pyarrow or a manifest
+    # --------------------------------------------------------------------------
+    if pyarrow is None:
+        return None
+
+    manifest = read_snapshot_manifest(data_fname)
+    if manifest is None:
+        return None
+
+    # --------------------------------------------------------------------------
+    # Cheap check first
+    # --------------------------------------------------------------------------
+    stat = os.stat(data_fname)
+    if manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+        return manifest
+
+    # --------------------------------------------------------------------------
+    # Then the content; if it matches, remember the new mtime for next time
+    # --------------------------------------------------------------------------
+    if manifest['sha256'] != get_file_hash(data_fname):
+        return None
+
+    manifest['mtime_ns'] = stat.st_mtime_ns
+    manifest['size']     = stat.st_size
+    try:
+        write_snapshot_manifest(data_fname, manifest)
+    except OSError:
+        pass
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Load every sheet from the snapshot, or None if it's missing or stale
+# ------------------------------------------------------------------------------
+def read_snapshot(data_fname):
+    manifest = check_snapshot(data_fname)
+    if manifest is None:
+        return None
+
+    missing = [sheet for sheet in manifest.get('sheet_names', []) if sheet not in manifest['sheets']]
+    if missing:
+        return None
+
+    snapshot_dir = get_snapshot_dir(data_fname)
+    existing_data = {}
+    try:
+        for sheet in manifest['sheets']:
+            fname = os.path.join(snapshot_dir, manifest['sheets'][sheet])
+            existing_data[sheet] = decode_snapshot_frame(pd.read_feather(fname))
+    except Exception as e:
+        print("WARNING! Could not read snapshot, falling back to the workbook: " + str(e))
+        return None
+
+    print("...read data from snapshot " + snapshot_dir + "...")
+    return existing_data
+
+# ------------------------------------------------------------------------------
+# Write every sheet to the snapshot
+# - Sheet files are named after the workbook hash, so a rebuild never touches
+#   files that another process may be reading; the old ones are removed after
+#   the new manifest is in place
+# ------------------------------------------------------------------------------
+def write_snapshot(data_fname, existing_data):
+    # --------------------------------------------------------------------------
+    # Nothing to do without pyarrow
+    # --------------------------------------------------------------------------
+    if pyarrow is None:
+        return None
+
+    snapshot_dir = get_snapshot_dir(data_fname)
+    sha256 = get_file_hash(data_fname)
+    manifest = new_snapshot_manifest(data_fname, sha256)
+    manifest['sheet_names'] = list(existing_data)
+
+    # --------------------------------------------------------------------------
+    # Write the sheets, then the manifest that points at them
+    # --------------------------------------------------------------------------
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        for sheet in existing_data:
+            fname = sha256[:16] + "_" + sheet + ".feather"
+            tmp_fname = os.path.join(snapshot_dir, fname + "." + str(os.getpid()) + ".tmp")
+            encode_snapshot_frame(existing_data[sheet]).to_feather(tmp_fname)
+            os.replace(tmp_fname, os.path.join(snapshot_dir, fname))
+            manifest['sheets'][sheet] = fname
+        write_snapshot_manifest(data_fname, manifest)
+    except Exception as e:
+        print("WARNING! Could not write snapshot: " + str(e))
+        return None
+
+    # --------------------------------------------------------------------------
+    # Clear out whatever belonged to older versions of the workbook
+    # --------------------------------------------------------------------------
+    remove_old_snapshot_files(snapshot_dir, manifest)
+
+    print("...wrote data snapshot " + snapshot_dir + "...")
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Manifest for a new snapshot of the workbook, remembering which version the
+# files already there belong to
+# ------------------------------------------------------------------------------
+def new_snapshot_manifest(data_fname, sha256):
+    stat = os.stat(data_fname)
+    old = read_snapshot_manifest(data_fname) or {}
+
+    manifest = {}
+    manifest['format']   = snapshot_format
+    manifest['source']   = os.path.basename(data_fname)
+    manifest['mtime_ns'] = stat.st_mtime_ns
+    manifest['size']     = stat.st_size
+    manifest['sha256']   = sha256
+    manifest['previous'] = old.get('sha256') if old.get('sha256') != sha256 else old.get('previous')
+    manifest['sheets']   = {}
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Remove sheet files that belong to neither this version nor the previous one
+# ------------------------------------------------------------------------------
+def remove_old_snapshot_files(snapshot_dir, manifest):
+    keep = [sha[:16] for sha in [manifest['sha256'], manifest.get('previous')] if sha]
+    for fname in os.listdir(snapshot_dir):
+        if fname.endswith(".feather") and not any(fname.startswith(prefix) for prefix in keep):
+            try:
+                os.remove(os.path.join(snapshot_dir, fname))
+            except OSError:
+                pass
+
+# ------------------------------------------------------------------------------
+# Load one sheet from the snapshot, or None if it isn't there for this version
+# ------------------------------------------------------------------------------
+def read_snapshot_sheet(data_fname, sheet, sha256=None):
+    # --------------------------------------------------------------------------
+    # A sheet of the version we expect can be read even if the workbook has
+    # moved on since; otherwise the snapshot has to be current
+    # --------------------------------------------------------------------------
+    if pyarrow is None:
+        return None
+    snapshot_dir = get_snapshot_dir(data_fname)
+    if sha256 is not None:
+        fname = os.path.join(snapshot_dir, sha256[:16] + "_" + sheet + ".feather")
+    else:
+        manifest = check_snapshot(data_fname)
+        if manifest is None or sheet not in manifest['sheets']:
+            return None
+        fname = os.path.join(snapshot_dir, manifest['sheets'][sheet])
+
+    if not os.path.exists(fname):
+        return None
+    try:
+        return decode_snapshot_frame(pd.read_feather(fname))
+    except Exception as e:
+        print("WARNING! Could not read snapshot of sheet " + sheet + ", falling back to the workbook: " + str(e))
+        return None
+
+# ------------------------------------------------------------------------------
+# Add one sheet to the snapshot, starting a new one if it was for another
+# version of the workbook
+# ------------------------------------------------------------------------------
+def write_snapshot_sheet(data_fname, sheet, df, sha256):
+    if pyarrow is None:
+        return None
+
+    snapshot_dir = get_snapshot_dir(data_fname)
+    manifest = read_snapshot_manifest(data_fname)
+    if manifest is None or manifest['sha256'] != sha256:
+        manifest = new_snapshot_manifest(data_fname, sha256)
+    if not manifest.get('sheet_names'):
+        manifest['sheet_names'] = get_sheet_names(data_fname, use_snapshot=False)
+
+    # --------------------------------------------------------------------------
+    # The sheet, then the manifest; if two processes add sheets at once one of
+    # them may be left out of the manifest, and just gets read again next time
+    # --------------------------------------------------------------------------
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        fname = sha256[:16] + "_" + sheet + ".feather"
+        tmp_fname = os.path.join(snapshot_dir, fname + "." + str(os.getpid()) + ".tmp")
+        encode_snapshot_frame(df).to_feather(tmp_fname)
+        os.replace(tmp_fname, os.path.join(snapshot_dir, fname))
+        manifest['sheets'][sheet] = fname
+        write_snapshot_manifest(data_fname, manifest)
+    except Exception as e:
+        print("WARNING! Could not write snapshot of sheet " + sheet + ": " + str(e))
+        return None
+
+    remove_old_snapshot_files(snapshot_dir, manifest)
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Turn mixed-type object columns into strings + type codes
+# ------------------------------------------------------------------------------
+def encode_snapshot_frame(df):
+    out = df.reset_index(drop=True)
+    for col in df.columns:
+        if out[col].dtype != object:
+            continue
+        values = out[col].dropna()
+        if values.map(type).eq(str).all():
+            continue
+
+        # ----------------------------------------------------------------------
+        # Work out the kind of each value; anything we don't know how to put
+        # back is an error, and the snapshot just won't get written
+        # ----------------------------------------------------------------------
+        kinds = []
+        for value in out[col]:
+            if isinstance(value, str) or pd.isna(value):
+                kinds.append(0)
+            elif type(value) in snapshot_kinds:
+                kinds.append(snapshot_kinds[type(value)])
+            elif isinstance(value, datetime):
+                kinds.append(snapshot_kinds[datetime])
+            else:
+                raise TypeError("Can't snapshot a " + type(value).__name__ + " in column " + col)
+
+        out[snapshot_kind_prefix + col] = pd.Series(kinds, dtype='int8')
+        out[col] = out[col].map(lambda x: x if isinstance(x, str) or pd.isna(x) else (x.isoformat() if isinstance(x, datetime) else repr(x)))
+    return out
+
+# ------------------------------------------------------------------------------
+# Put mixed-type object columns back the way they were
+# - Arrow hands back missing strings as None where Excel gave NaN
+# ------------------------------------------------------------------------------
+def decode_snapshot_frame(df):
+    for col in df.columns:
+        if df[col].dtype == object and df[col].isna().any():
+            df[col] = df[col].where(df[col].notna(), float('nan'))
+
+    kind_cols = [col for col in df.columns if col.startswith(snapshot_kind_prefix)]
+    for kind_col in kind_cols:
+        col = kind_col[len(snapshot_kind_prefix):]
+        values = df[col].tolist()
+        for i, kind in enumerate(df[kind_col].tolist()):
+            if kind == snapshot_kinds[int]:
+                values[i] = int(values[i])
+            elif kind == snapshot_kinds[float]:
+                values[i] = float(values[i])
+            elif kind == snapshot_kinds[bool]:
+                values[i] = values[i] == 'True'
+            elif kind == snapshot_kinds[datetime]:
+                values[i] = datetime.fromisoformat(values[i])
+        df[col] = pd.Series(values, index=df.index, dtype=object)
+    return df.drop(columns=kind_cols)
+
+
+
+# ------------------------------------------------------------------------------
+# The play counts shared by the tables below; pass them in if they have
+# already been built (see derived.py), otherwise they're built here
+# ------------------------------------------------------------------------------
+def get_play_counts(data, counts=None):
+    if counts is None:
+        counts = build_play_counts(data['Performances'], data['Songs'])
+    return counts
 
 # ------------------------------------------------------------------------------
 # Prepare the performance-based data
 # ------------------------------------------------------------------------------
-def get_data_performances(data):
+def get_data_performances(data, counts=None):
     # --------------------------------------------------------------------------
     # Start with the performances
     # --------------------------------------------------------------------------
@@ -502,13 +1065,10 @@ def get_data_performances(data):
     sdata = sdata.rename(columns={'Band Family':'Family'})
 
     # --------------------------------------------------------------------------
-    # Calculate the number of times played
+    # Add the number of times played
     # --------------------------------------------------------------------------
-    numtimes = data['Performances'][['Song','Artist']].reset_index(drop=True)
-    numtimes['Times Played'] = 1
-    numtimes = numtimes.groupby(['Song','Artist']).sum()
-
-    sdata = sdata.merge(numtimes, how='left', on=['Song','Artist'])
+    numtimes = get_play_counts(data, counts)['song'][['Times Played']]
+    sdata = sdata.merge(numtimes, how='left', left_on=['Song','Artist'], right_index=True)
 
     # --------------------------------------------------------------------------
     # Flag as CH original or not
@@ -522,7 +1082,7 @@ def get_data_performances(data):
 # ------------------------------------------------------------------------------
 # Prepare the Show-based data
 # ------------------------------------------------------------------------------
-def get_data_shows(data):
+def get_data_shows(data, counts=None):
     # --------------------------------------------------------------------------
     # Start with the shows
     # --------------------------------------------------------------------------
@@ -531,9 +1091,7 @@ def get_data_shows(data):
     # --------------------------------------------------------------------------
     # Get the number of songs played
     # --------------------------------------------------------------------------
-    numsongs = data['Performances'][['Series Index']].reset_index(drop=True)
-    numsongs['Count'] = 1
-    numsongs = numsongs.groupby('Series Index').sum()
+    numsongs = get_play_counts(data, counts)['show']
 
     sdata = sdata.merge(numsongs, how='left', left_on=['Series Index'], right_on=['Series Index'])
 
@@ -545,7 +1103,7 @@ def get_data_shows(data):
 # ------------------------------------------------------------------------------
 # Prepare the Song-based data
 # ------------------------------------------------------------------------------
-def get_data_songs(data):
+def get_data_songs(data, counts=None):
     # --------------------------------------------------------------------------
     # Start with the songs
     # --------------------------------------------------------------------------
@@ -555,17 +1113,13 @@ def get_data_songs(data):
     # --------------------------------------------------------------------------
     # Get the number of times played
     # --------------------------------------------------------------------------
-    numtimes = data['Performances'][['Song','Artist']].reset_index(drop=True)
-    numtimes['Times Played'] = 1
-    numtimes = numtimes.groupby(['Song','Artist']).sum()
-
-    sdata = sdata.merge(numtimes, how='left', on=['Song','Artist'])
+    numtimes = get_play_counts(data, counts)['song'][['Times Played']]
+    sdata = sdata.merge(numtimes, how='left', left_on=['Song','Artist'], right_index=True)
 
     # --------------------------------------------------------------------------
     # Flag as a holt original
     # --------------------------------------------------------------------------
-    sdata['CH Original'] = sdata['Artist']
-    sdata['CH Original'] = sdata['CH Original'].apply(band_is_original, args=([data['Bands']]))
+    sdata['CH Original'] = get_original_flags(sdata['Artist'], data['Bands'], context="songs")
 
     sdata = sdata[sdata['CH Original'] == 'No']
 
@@ -717,4 +1271,65 @@ def band_is_original(band, band_data):
         else:
             return "No"
 
+# ------------------------------------------------------------------------------
+# Same thing for a whole column at once
+# - The Band -> is-original lookup is worked out once per Bands table and
+#   applied with a single map, instead of an index lookup per row
+# - Names that aren't in the Bands table are collected into unmatched_bands
+#   (name -> {'count', 'context'}) with one summary warning, rather than a
+#   line for every row
+# ------------------------------------------------------------------------------
+original_lookups = {}
+unmatched_bands  = {}
+
+def get_original_lookup(band_data):
+    key = id(band_data)
+    if key in original_lookups and original_lookups[key][0] is band_data:
+        return original_lookups[key][1]
+
+    relationship = band_data['Chris Relationship']
+    relationship = relationship[~relationship.index.duplicated(keep='first')]
+    lookup = relationship.astype(str).str.lower().eq("original")
 
+    if len(original_lookups) >= 4:
+        original_lookups.clear()
+    original_lookups[key] = (band_data, lookup)
+    return lookup
+
+def get_original_flags(bands, band_data, context=""):
+    # --------------------------------------------------------------------------
+    # Look everything up in one go
+    # --------------------------------------------------------------------------
+    is_original = bands.map(get_original_lookup(band_data))
+
+    # --------------------------------------------------------------------------
+    # Keep track of the mismatches in the data
+    # --------------------------------------------------------------------------
+    # as objects, so a categorical (CHOLT_COMPACT) only counts the names it has
+    missing = bands[is_original.isna()]
+    record_unmatched_bands(missing.astype(object).value_counts(), context)
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return is_original.astype(object).where(is_original.notna(), False).map({True:"Yes", False:"No"})
+
+# ------------------------------------------------------------------------------
+# counts is name -> rows, for the names that weren't found; names with no rows
+# are left out
+# ------------------------------------------------------------------------------
+def record_unmatched_bands(counts, context=""):
+    counts = counts[counts > 0]
+    if len(counts) == 0:
+        return
+    for band in counts.index:
+        entry = unmatched_bands.setdefault(band, {'count':0, 'context':[]})
+        entry['count'] += int(counts[band])
+        if context and context not in entry['context']:
+            entry['context'].append(context)
+    print("WARNING! " + str(len(counts)) + " name(s) not found in data['Bands']" + (" for " + context if context else "") + "; see lib.get_unmatched_band_report()")
+
+def get_unmatched_band_report():
+    report = pd.DataFrame([{'Band':band, 'Count':unmatched_bands[band]['count'], 'Context':", ".join(unmatched_bands[band]['context'])} for band in unmatched_bands],
+                          columns=['Band','Count','Context'])
+    return report.sort_values(by='Count', ascending=False).reset_index(drop=True)
@@ -0,0 +1,243 @@
+# ==================================================================================================
+# LOAD TEST
+# Drives the page router the way browsers do, with a realistic mix of pages,
+# and reports throughput and latency percentiles per route
+# - Each request is the POST to _dash-update-component that a browser sends
+#   when it navigates, which is answered by index.display_page
+# - With no --url the app is started here from wsgi.application on a free
+#   local port; the load then shares this process (and the GIL) with the
+#   server, so use --url against a real server (gunicorn etc.) when sizing
+#   worker counts
+#
+#     python loadtest.py --concurrency 8 --duration 30
+#     python loadtest.py --url http://127.0.0.1:8000 --mix "/=50,/performances=30,/people=1"
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import io
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import contextlib
+import http.client
+from urllib.parse import urlsplit
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# How often each page is visited on a Thursday night, relatively
+# ------------------------------------------------------------------------------
+default_mix = {}
+default_mix['/']             = 30
+default_mix['/performances'] = 20
+default_mix['/songs']        = 15
+default_mix['/shows']        = 10
+default_mix['/albums']       = 8
+default_mix['/artists']      = 8
+default_mix['/originals']    = 6
+default_mix['/people']       = 3
+
+# ==================================================================================================
+# Server
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Start the app on a free local port in a background thread
+# ------------------------------------------------------------------------------
+def start_local_server():
+    os.environ.setdefault("CHOLT_RELOAD_INTERVAL", "0")
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import wsgi
+
+    # --------------------------------------------------------------------------
+    # Without a line in the log for every request
+    # --------------------------------------------------------------------------
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, wsgi.application, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name="cholt-loadtest-server", daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:" + str(server.server_port)
+
+# ==================================================================================================
+# Requests
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The body a browser sends when the URL changes
+# ------------------------------------------------------------------------------
+def get_page_request(route):
+    body = {}
+    body['output']         = "page-content.children"
+    body['outputs']        = {'id':"page-content", 'property':"children"}
+    body['inputs']         = [{'id':"url", 'property':"pathname", 'value':route}]
+    body['changedPropIds'] = ["url.pathname"]
+    body['state']          = []
+    return json.dumps(body).encode('utf-8')
+
+# ------------------------------------------------------------------------------
+# One simulated user: pick a page, ask for it, note how long it took, repeat;
+# each keeps one connection open like a browser would
+# ------------------------------------------------------------------------------
+def run_user(base_url, routes, weights, bodies, deadline, max_requests, results, lock, seed):
+    rng = random.Random(seed)
+    parts = urlsplit(base_url)
+    path = (parts.path.rstrip('/') or "") + "/_dash-update-component"
+    conn = None
+    headers = {'Content-Type':"application/json"}
+
+    while time.perf_counter() < deadline:
+        with lock:
+            if max_requests is not None and results['sent'] >= max_requests:
+                break
+            results['sent'] += 1
+
+        route = rng.choices(routes, weights)[0]
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+            conn.request("POST", path, body=bodies[route], headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn = None
+            payload = b""
+            ok = False
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            stats = results['routes'].setdefault(route, {'latencies':[], 'errors':0, 'bytes':0})
+            if ok:
+                stats['latencies'].append(elapsed)
+                stats['bytes'] += len(payload)
+            else:
+                stats['errors'] += 1
+
+    if conn is not None:
+        conn.close()
+
+# ------------------------------------------------------------------------------
+# Run the users side by side and collect what they saw
+# ------------------------------------------------------------------------------
+def run_load(base_url, mix, concurrency=8, duration=30.0, max_requests=None, warmup=True, seed=0):
+    routes  = list(mix)
+    weights = [mix[route] for route in routes]
+    bodies  = {route:get_page_request(route) for route in routes}
+
+    # --------------------------------------------------------------------------
+    # Visit each page once first, so first renders don't count
+    # --------------------------------------------------------------------------
+    if warmup:
+        lock = threading.Lock()
+        for route in routes:
+            run_user(base_url, [route], [1], bodies, float('inf'), 1, {'sent':0, 'routes':{}}, lock, seed)
+
+    results = {'sent':0, 'routes':{}}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = []
+    start = time.perf_counter()
+    for i in range(concurrency):
+        thread = threading.Thread(target=run_user, args=(base_url, routes, weights, bodies, deadline, max_requests, results, lock, seed + i + 1))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    results['seconds'] = time.perf_counter() - start
+    results['concurrency'] = concurrency
+    return results
+
+# ==================================================================================================
+# Reporting
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Nearest-rank percentile of a sorted list
+# ------------------------------------------------------------------------------
+def get_percentile(values, pct):
+    if not values:
+        return None
+    rank = max(1, int(-(-pct * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]
+
+def get_summary(results):
+    summary = {'seconds':results['seconds'], 'concurrency':results['concurrency'], 'routes':{}}
+    everything = []
+    errors = 0
+    for route in sorted(results['routes']):
+        stats = results['routes'][route]
+        latencies = sorted(stats['latencies'])
+        everything.extend(latencies)
+        errors += stats['errors']
+        summary['routes'][route] = get_route_summary(latencies, stats['errors'], stats['bytes'], results['seconds'])
+    summary['total'] = get_route_summary(sorted(everything), errors, sum(s['bytes'] for s in results['routes'].values()), results['seconds'])
+    return summary
+
+def get_route_summary(latencies, errors, nbytes, seconds):
+    out = {}
+    out['requests']   = len(latencies)
+    out['errors']     = errors
+    out['throughput'] = len(latencies) / seconds if seconds else 0.0
+    out['p50']        = get_percentile(latencies, 50)
+    out['p95']        = get_percentile(latencies, 95)
+    out['p99']        = get_percentile(latencies, 99)
+    out['mean_bytes'] = nbytes / len(latencies) if latencies else 0
+    return out
+
+def print_summary(summary):
+    def ms(value):
+        return "-" if value is None else "{:.1f}".format(value * 1000)
+    print("{:<16} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>10}".format("route", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "avg bytes"))
+    rows = list(summary['routes'].items()) + [("TOTAL", summary['total'])]
+    for route, stats in rows:
+        print("{:<16} {:>8} {:>7} {:>9.1f} {:>9} {:>9} {:>9} {:>10.0f}".format(route, stats['requests'], stats['errors'], stats['throughput'],
+                                                                              ms(stats['p50']), ms(stats['p95']), ms(stats['p99']), stats['mean_bytes']))
+    print("{} users for {:.1f}s".format(summary['concurrency'], summary['seconds']))
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        route, weight = part.rsplit("=", 1)
+        mix[route.strip()] = float(weight)
+    return mix
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the page router")
+    parser.add_argument('--url', help="server to test; by default the app is started here")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run for")
+    parser.add_argument('--requests', type=int, help="stop after this many requests instead")
+    parser.add_argument('--mix', help='route weights, e.g. "/=30,/performances=20,/people=3"')
+    parser.add_argument('--no-warmup', action='store_true')
+    parser.add_argument('--json', help="also write the summary here")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server, base_url = start_local_server()
+        print("...started the app at " + base_url + "...")
+
+    mix = parse_mix(args.mix) if args.mix else default_mix
+    duration = args.duration if args.requests is None else float('inf')
+    results = run_load(base_url, mix, args.concurrency, duration, args.requests, warmup=not args.no_warmup)
+    summary = get_summary(results)
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=1)
+    if server is not None:
+        server.shutdown()
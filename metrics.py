@@ -0,0 +1,343 @@
+# ==================================================================================================
+# METRICS
+# Request and page timings, response sizes, cache counters and data-load
+# times, served at /metrics in the Prometheus text format
+# - Every request through app.server is timed and sized in Flask's
+#   before/after_request hooks; Dash callbacks are labelled by their output
+#   and, for the page router, by the route that was asked for
+# - display_page in index.py reports its own render time per route
+# - The cache and data numbers are read from their modules when /metrics is
+#   scraped, so they cost nothing in between
+# - Requests that fail with an exception are recorded as 500s when Flask
+#   tears them down, since after_request may never see them
+# - Recording a request is a bisect and a few additions under a lock, cheap
+#   enough to leave on in production
+# - Each worker process keeps its own numbers, and Prometheus sees whichever
+#   worker answers the scrape
+#
+# CHOLT_METRICS=0 turns this off; otherwise /metrics only answers requests
+# that send CHOLT_METRICS_TOKEN as a bearer token, and answers 404 if there
+# isn't one, unless CHOLT_METRICS=all, which answers anyone; where a
+# request comes from isn't checked, as behind a reverse proxy everything
+# comes from this machine
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import hmac
+import time
+import bisect
+import threading
+
+import flask
+
+from app import app, server
+from dataset import add_data_listener, get_data_version
+from derived import get_derived_stats
+from layout_cache import get_layout_cache_stats
+from table_query import get_query_cache_stats
+from figure_cache import get_figure_cache_stats
+from search import get_search_stats
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+metrics_config = {}
+metrics_config['mode']  = os.environ.get("CHOLT_METRICS", "1")
+metrics_config['token'] = os.environ.get("CHOLT_METRICS_TOKEN", "")
+
+# ------------------------------------------------------------------------------
+# Bucket bounds: seconds for timings, bytes for response sizes
+# ------------------------------------------------------------------------------
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+size_buckets    = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+# ------------------------------------------------------------------------------
+# Routes that are labelled by name; any other path is just "other", so that
+# stray URLs can't make new series without end
+# - Paths under a route with parts (/songs/<artist>/<song>) are labelled with
+#   the route, which the matchers index.py adds work out
+# - Dash's own endpoints are listed one by one; anything else under /_dash-
+#   is "other" like any stray URL
+# ------------------------------------------------------------------------------
+known_paths    = set()
+route_matchers = []
+known_prefixes = ['/_dash-component-suites/', '/assets/']
+dash_endpoints = set(['/_dash-update-component', '/_dash-layout', '/_dash-dependencies'])
+
+metrics_lock = threading.Lock()
+
+# ==================================================================================================
+# Histograms and counters
+# ==================================================================================================
+class Histogram(object):
+    """
+    Prometheus-style histogram, one set of buckets per combination of labels
+    """
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name        = name
+        self.help_text   = help_text
+        self.label_names = label_names
+        self.buckets     = buckets
+        self.series      = {}
+
+    def observe(self, labels, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with metrics_lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {'counts':[0] * (len(self.buckets) + 1), 'sum':0.0, 'count':0}
+            series['counts'][i] += 1
+            series['sum']   += value
+            series['count'] += 1
+
+    def get_lines(self):
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " histogram"]
+        with metrics_lock:
+            series = {labels:dict(values, counts=list(values['counts'])) for labels, values in self.series.items()}
+        for labels in sorted(series):
+            label_text = format_labels(self.label_names, labels)
+            total = 0
+            for bound, count in zip(self.buckets + ['+Inf'], series[labels]['counts']):
+                total += count
+                lines.append(self.name + "_bucket" + format_labels(self.label_names + ('le',), labels + (format_value(bound),)) + " " + str(total))
+            lines.append(self.name + "_sum" + label_text + " " + format_value(series[labels]['sum']))
+            lines.append(self.name + "_count" + label_text + " " + str(series[labels]['count']))
+        return lines
+
+class Counter(object):
+    """
+    Prometheus-style counter, one value per combination of labels
+    """
+    def __init__(self, name, help_text, label_names=()):
+        self.name        = name
+        self.help_text   = help_text
+        self.label_names = label_names
+        self.values      = {} if label_names else {():0}
+
+    def inc(self, labels=(), amount=1):
+        with metrics_lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get_lines(self):
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " counter"]
+        with metrics_lock:
+            values = dict(self.values)
+        for labels in sorted(values):
+            lines.append(self.name + format_labels(self.label_names, labels) + " " + format_value(values[labels]))
+        return lines
+
+# ------------------------------------------------------------------------------
+# Text format helpers
+# ------------------------------------------------------------------------------
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(name + '="' + value + '"')
+    return "{" + ",".join(pairs) + "}"
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def get_gauge_lines(name, help_text, samples, label_names=()):
+    lines = ["# HELP " + name + " " + help_text, "# TYPE " + name + " gauge"]
+    for labels, value in samples:
+        lines.append(name + format_labels(label_names, labels) + " " + format_value(value))
+    return lines
+
+# ==================================================================================================
+# What we measure
+# ==================================================================================================
+request_seconds = Histogram("cholt_http_request_seconds", "Time to answer an HTTP request", ('path', 'method', 'status'), latency_buckets)
+response_bytes  = Histogram("cholt_http_response_bytes", "Size of HTTP response bodies", ('path', 'callback', 'route'), size_buckets)
+page_seconds    = Histogram("cholt_page_seconds", "Time for display_page to produce a page, cached or not", ('route',), latency_buckets)
+data_reloads    = Counter("cholt_data_reloads_total", "Times new data has been swapped in")
+
+# ------------------------------------------------------------------------------
+# Called from index.display_page; routes that don't exist count as "404"
+# ------------------------------------------------------------------------------
+def observe_page(route, seconds):
+    page_seconds.observe((get_route_label(route),), seconds)
+
+# ------------------------------------------------------------------------------
+# Let the metrics know which paths are real pages
+# ------------------------------------------------------------------------------
+def add_known_paths(paths):
+    known_paths.update(paths)
+
+def add_route_matcher(func):
+    route_matchers.append(func)
+
+def get_route_label(path):
+    if path in known_paths:
+        return path
+    for matcher in route_matchers:
+        route = matcher(path)
+        if route is not None:
+            return route
+    return "404"
+
+def get_path_label(path):
+    if path in known_paths or path in dash_endpoints or path == '/metrics':
+        return path
+    route = get_route_label(path)
+    if route != "404":
+        return route
+    for prefix in known_prefixes:
+        if path.startswith(prefix):
+            return prefix
+    return "other"
+
+# ==================================================================================================
+# Hooks on the Flask server
+# ==================================================================================================
+def start_request_timer():
+    flask.g.cholt_start = time.perf_counter()
+
+def record_request(response):
+    start = getattr(flask.g, 'cholt_start', None)
+    if start is None:
+        return response
+    flask.g.cholt_start = None
+    path = get_path_label(flask.request.path)
+    request_seconds.observe((path, flask.request.method, str(response.status_code)), time.perf_counter() - start)
+
+    # --------------------------------------------------------------------------
+    # Streamed responses (files) don't know their size up front; skip them
+    # --------------------------------------------------------------------------
+    size = response.calculate_content_length() if not response.is_streamed else None
+    if size is not None:
+        callback, route = get_callback_labels(path)
+        response_bytes.observe((path, callback, route), size)
+    return response
+
+# ------------------------------------------------------------------------------
+# Anything still timed at teardown failed before it got a response
+# ------------------------------------------------------------------------------
+def record_failed_request(error):
+    start = getattr(flask.g, 'cholt_start', None)
+    if start is None:
+        return
+    flask.g.cholt_start = None
+    request_seconds.observe((get_path_label(flask.request.path), flask.request.method, "500"), time.perf_counter() - start)
+
+# ------------------------------------------------------------------------------
+# For a Dash callback, which output it was for, and for the page router,
+# which route; Dash has already parsed the body so this is just a lookup
+# ------------------------------------------------------------------------------
+def get_callback_labels(path):
+    if not path.endswith('_dash-update-component'):
+        return "", ""
+    body = flask.request.get_json(silent=True) or {}
+    callback = str(body.get('output', ''))
+    route = ""
+    for item in body.get('inputs', []):
+        if isinstance(item, dict) and item.get('id') == 'url' and item.get('property') == 'pathname':
+            route = get_route_label(item.get('value'))
+    return callback, route
+
+# ==================================================================================================
+# Numbers read at scrape time
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Count reloads as they happen
+# ------------------------------------------------------------------------------
+def count_reload(old_data, new_data):
+    data_reloads.inc()
+
+add_data_listener(count_reload)
+
+def get_cache_lines():
+    lines = []
+
+    layout = get_layout_cache_stats()
+    lines += get_gauge_lines("cholt_layout_cache_bytes", "Size of the cached page layouts", [((), layout['bytes'])])
+    lines += get_gauge_lines("cholt_layout_cache_entries", "Page layouts in the cache", [((), layout['entries'])])
+    lines += ["# HELP cholt_layout_cache_total Layout cache lookups by result", "# TYPE cholt_layout_cache_total counter"]
+    for result in ['hits', 'disk_hits', 'misses', 'evictions']:
+        lines.append('cholt_layout_cache_total{result="' + result + '"} ' + str(layout[result]))
+
+    query = get_query_cache_stats()
+    lines += ["# HELP cholt_table_query_cache_total Server-side table query cache lookups by result", "# TYPE cholt_table_query_cache_total counter"]
+    for result in ['hits', 'misses']:
+        lines.append('cholt_table_query_cache_total{result="' + result + '"} ' + str(query[result]))
+
+    figure = get_figure_cache_stats()
+    lines += ["# HELP cholt_figure_cache_total Chart figure cache lookups by result", "# TYPE cholt_figure_cache_total counter"]
+    for result in ['hits', 'misses']:
+        lines.append('cholt_figure_cache_total{result="' + result + '"} ' + str(figure[result]))
+
+    # --------------------------------------------------------------------------
+    # Imported here: compression has to hook in after this module (see index)
+    # --------------------------------------------------------------------------
+    from compression import get_compression_stats
+    compressed = get_compression_stats()
+    lines += get_gauge_lines("cholt_compressed_cache_bytes", "Size of the cached compressed responses", [((), compressed['bytes'])])
+    lines += ["# HELP cholt_compressed_cache_total Compressed response cache lookups, and responses answered with 304", "# TYPE cholt_compressed_cache_total counter"]
+    for result in ['hits', 'misses', 'not_modified']:
+        lines.append('cholt_compressed_cache_total{result="' + result + '"} ' + str(compressed[result]))
+
+    searched = get_search_stats()
+    lines += get_gauge_lines("cholt_search_documents", "Rows in the search index", [((), searched['documents'])])
+    lines += get_gauge_lines("cholt_search_index_seconds", "Time of the last search index update", [((), searched['seconds'])])
+
+    derived = get_derived_stats()
+    lines += ["# HELP cholt_derived_total Derived table lookups by table and result", "# TYPE cholt_derived_total counter"]
+    for name in sorted(derived):
+        lines.append('cholt_derived_total{table="' + name + '",result="hits"} ' + str(derived[name]['hits']))
+        lines.append('cholt_derived_total{table="' + name + '",result="recomputes"} ' + str(derived[name]['recomputes']))
+    lines += ["# HELP cholt_derived_seconds_total Time spent computing derived tables", "# TYPE cholt_derived_seconds_total counter"]
+    for name in sorted(derived):
+        lines.append('cholt_derived_seconds_total{table="' + name + '"} ' + format_value(derived[name]['seconds']))
+    return lines
+
+def get_data_lines():
+    from initialize import init_dict
+    data = init_dict['data']
+
+    lines = []
+    lines += get_gauge_lines("cholt_data_info", "Version of the data being served", [((get_data_version(data),), 1)], ('version',))
+    lines += get_gauge_lines("cholt_data_loaded_timestamp_seconds", "When the data being served was loaded", [((), getattr(data, 'loaded_at', 0) or 0)])
+    lines += get_gauge_lines("cholt_data_load_seconds", "Time to load the data being served", [((), getattr(data, 'load_seconds', 0) or 0)])
+    load_times = getattr(data, 'load_times', {})
+    lines += get_gauge_lines("cholt_sheet_load_seconds", "Time to load each sheet that has been loaded", [((sheet,), load_times[sheet]) for sheet in load_times], ('sheet',))
+    return lines
+
+# ------------------------------------------------------------------------------
+# The whole page
+# ------------------------------------------------------------------------------
+def get_metrics_text():
+    lines = []
+    for metric in [request_seconds, response_bytes, page_seconds, data_reloads]:
+        lines += metric.get_lines()
+    lines += get_cache_lines()
+    lines += get_data_lines()
+    return "\n".join(lines) + "\n"
+
+# ==================================================================================================
+# Wire it up
+# ==================================================================================================
+def serve_metrics():
+    if metrics_config['mode'] != 'all' and not metrics_config['token']:
+        flask.abort(404)
+    if metrics_config['mode'] != 'all' and not is_metrics_token(flask.request.headers.get('Authorization', '')):
+        flask.abort(403)
+    return flask.Response(get_metrics_text(), mimetype='text/plain; version=0.0.4', headers={'Cache-Control':'no-store'})
+
+def is_metrics_token(header):
+    return hmac.compare_digest(header.encode(), ("Bearer " + metrics_config['token']).encode())
+
+if metrics_config['mode'] != '0':
+    server.before_request(start_request_timer)
+    server.after_request(record_request)
+    server.teardown_request(record_failed_request)
+    server.add_url_rule('/metrics', 'cholt_metrics', serve_metrics)
@@ -10,11 +10,11 @@ import dash_html_components as html
 from dash.dependencies import Input, Output
 
 import pandas as pd
-import plotly.express as px
 
 from app import app
 
 from lib import *
+from derived import get_derived
 
 # ==================================================================================================
 # Init
@@ -34,7 +34,7 @@ def layout_albums(init_dict):
     # ==============================================================================================
     # Sort out the data
     # ==============================================================================================
-    data_albums = get_data_albums(data)
+    data_albums = get_derived('albums', data)
 
     # ==============================================================================================
     # Page Contents Configuration
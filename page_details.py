@@ -0,0 +1,240 @@
+# ==================================================================================================
+# detail pages
+# One song, artist, album or show, reached through the detail routes in
+# index.py; the route's parts come in as init_dict['params']
+# - The performances for each come from the entity index (see entity_index.py),
+#   so a page only ever looks at its own few rows
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import dash_core_components as dcc
+import dash_html_components as html
+
+import pandas as pd
+
+from lib import *
+from derived import get_derived
+from entity_index import get_entity_rows
+
+# ==================================================================================================
+# Init
+# ==================================================================================================
+print("...loading detail pages...")
+
+# ------------------------------------------------------------------------------
+# Links from table cells to the other detail pages
+# ------------------------------------------------------------------------------
+detail_links = {}
+detail_links['Song']   = lambda row: get_detail_href('song', row['Artist'], row['Song'])
+detail_links['Artist'] = lambda row: get_detail_href('artist', row['Artist'])
+detail_links['Album']  = lambda row: get_detail_href('album', row['Artist'], row['Album'])
+detail_links['Show']   = lambda row: get_detail_href('show', row['Series'], row['Series Index'])
+
+# ------------------------------------------------------------------------------
+# Sheet columns shown under another name
+# ------------------------------------------------------------------------------
+fact_labels = {'Date/Time Start':"Date", 'Chris Relationship':"Relationship to Chris"}
+
+# ==================================================================================================
+# Layouts
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# One song: what it is, and every time it was played, most recent first
+# ------------------------------------------------------------------------------
+def layout_song(init_dict):
+    data   = init_dict['data']
+    params = init_dict['params']
+    artist, song = params['artist'], params['song']
+
+    info = get_sheet_row(data['Songs'], (song, artist))
+    rows = get_performance_rows(data, 'song', (song, artist))
+    if info is None and len(rows) == 0:
+        return get_not_found(init_dict, "song", song + " by " + artist)
+
+    facts = []
+    facts.append(("Artist", dcc.Link(artist, href=get_detail_href('artist', artist))))
+    if info is not None and not pd.isna(info['Album']):
+        facts.append(("Album", dcc.Link(str(info['Album']), href=get_detail_href('album', artist, info['Album']))))
+    facts += get_info_facts(info, ['Year', 'Composer', 'Genre'])
+    facts += get_played_facts(rows)
+
+    table = get_show_columns(rows.sort_values('Series Index', ascending=False, kind='stable'), data)[['Show', 'Date', 'Set', 'Set Position', 'Series', 'Series Index']]
+    return get_detail_layout(init_dict, song, artist, facts, info, table, "Performances")
+
+# ------------------------------------------------------------------------------
+# One artist: every song of theirs that was played, most recent first
+# ------------------------------------------------------------------------------
+def layout_artist(init_dict):
+    data   = init_dict['data']
+    artist = init_dict['params']['artist']
+
+    info = get_sheet_row(data['Bands'], artist)
+    rows = get_performance_rows(data, 'artist', artist)
+    if info is None and len(rows) == 0:
+        return get_not_found(init_dict, "artist", artist)
+
+    facts = get_info_facts(info, ['Genres', 'Band Family', 'Band Birthplace', 'Chris Relationship'])
+    facts += get_played_facts(rows)
+    facts.append(("Songs played", str(len(rows[['Song']].drop_duplicates()))))
+
+    table = get_show_columns(rows.sort_values('Series Index', ascending=False, kind='stable'), data)[['Show', 'Date', 'Song', 'Album', 'Artist', 'Series', 'Series Index']]
+    return get_detail_layout(init_dict, artist, "", facts, info, table, "Performances")
+
+# ------------------------------------------------------------------------------
+# One album: which of its songs were played, and when, most recent first
+# ------------------------------------------------------------------------------
+def layout_album(init_dict):
+    data   = init_dict['data']
+    params = init_dict['params']
+    artist, album = params['artist'], params['album']
+
+    info = get_sheet_row(data['Albums'], (album, artist))
+    rows = get_performance_rows(data, 'album', (album, artist))
+    if info is None and len(rows) == 0:
+        return get_not_found(init_dict, "album", album + " by " + artist)
+
+    facts = [("Artist", dcc.Link(artist, href=get_detail_href('artist', artist)))]
+    facts += get_info_facts(info, ['Year', 'Genre', 'Personnel'])
+    facts += get_played_facts(rows)
+
+    table = get_show_columns(rows.sort_values('Series Index', ascending=False, kind='stable'), data)[['Show', 'Date', 'Song', 'Artist', 'Series', 'Series Index']]
+    return get_detail_layout(init_dict, album, artist, facts, info, table, "Performances")
+
+# ------------------------------------------------------------------------------
+# One show: where and when, and the setlist
+# ------------------------------------------------------------------------------
+def layout_show(init_dict):
+    data   = init_dict['data']
+    params = init_dict['params']
+    series = params['series']
+    try:
+        series_index = int(params['index'])
+    except ValueError:
+        return get_not_found(init_dict, "show", series + " " + params['index'])
+
+    info = get_sheet_row(data['Gigs'], (series, series_index))
+    rows = get_performance_rows(data, 'show', (series, series_index))
+    if info is None and len(rows) == 0:
+        return get_not_found(init_dict, "show", series + " " + str(series_index))
+
+    title = str(info['Show Title']) if info is not None else series + " " + str(series_index)
+    facts = [("Series", series)]
+    facts += get_info_facts(info, ['Date/Time Start', 'Location'])
+    facts.append(("Songs", str(len(rows))))
+    facts += get_neighbour_facts(data, series, series_index)
+
+    counts = get_derived('play_counts', data)['song']['Times Played']
+    rows['Times Played'] = counts.reindex(pd.MultiIndex.from_arrays([rows['Song'].to_numpy(), rows['Artist'].to_numpy()])).to_numpy()
+    table = rows[['Set', 'Set Position', 'Song', 'Artist', 'Album', 'Times Played', 'Series', 'Series Index']]
+    return get_detail_layout(init_dict, title, series, facts, info, table, "Setlist")
+
+# ==================================================================================================
+# Helpers
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# The Performances rows for one entity, as a plain frame with the album added
+# ------------------------------------------------------------------------------
+def get_performance_rows(data, kind, key):
+    rows = get_entity_rows(get_derived('entity_index', data), kind, key, data['Performances'])
+    return rows.reset_index(drop=True)
+
+# ------------------------------------------------------------------------------
+# A row from an indexed sheet, or None; where the key is repeated the first
+# one wins, as it does for the play counts
+# ------------------------------------------------------------------------------
+def get_sheet_row(sheet, key):
+    try:
+        row = sheet.loc[[key]] if isinstance(key, tuple) else sheet.loc[key]
+    except (KeyError, TypeError):
+        return None
+    if isinstance(row, pd.DataFrame):
+        if len(row) == 0:
+            return None
+        row = row.iloc[0]
+    return row
+
+# ------------------------------------------------------------------------------
+# Show title and date next to each performance, from the Gigs sheet
+# ------------------------------------------------------------------------------
+def get_show_columns(rows, data):
+    gigs = data['Gigs']
+    keys = pd.MultiIndex.from_arrays([rows['Series'].to_numpy(), rows['Series Index'].to_numpy()])
+    shows = gigs[['Show Title', 'Date/Time Start']].reindex(keys)
+
+    rows = rows.copy()
+    rows['Show'] = shows['Show Title'].to_numpy()
+    rows['Date'] = pd.to_datetime(shows['Date/Time Start'].to_numpy()).strftime('%Y-%m-%d')
+    return rows
+
+# ------------------------------------------------------------------------------
+# (label, value) pairs for the facts list
+# ------------------------------------------------------------------------------
+def get_info_facts(info, columns):
+    facts = []
+    if info is None:
+        return facts
+    for col in columns:
+        if col in info.index and not pd.isna(info[col]):
+            value = info[col]
+            if hasattr(value, 'strftime'):
+                value = value.strftime('%Y-%m-%d %H:%M')
+            elif isinstance(value, float) and value.is_integer():
+                value = int(value)
+            facts.append((fact_labels.get(col, col), str(value)))
+    return facts
+
+def get_played_facts(rows):
+    if len(rows) == 0:
+        return [("Times played", "not played yet")]
+    shows = rows['Series Index']
+    facts = []
+    facts.append(("Times played", str(len(rows))))
+    facts.append(("First played", dcc.Link("show " + str(shows.min()), href=get_detail_href('show', rows['Series'].iloc[shows.argmin()], shows.min()))))
+    facts.append(("Last played", dcc.Link("show " + str(shows.max()), href=get_detail_href('show', rows['Series'].iloc[shows.argmax()], shows.max()))))
+    return facts
+
+# ------------------------------------------------------------------------------
+# Links to the shows either side in the same series
+# ------------------------------------------------------------------------------
+def get_neighbour_facts(data, series, series_index):
+    shows = get_derived('entity_index', data)['show']
+    facts = []
+    for label, other in [("Previous show", series_index - 1), ("Next show", series_index + 1)]:
+        if (series, other) in shows:
+            facts.append((label, dcc.Link("show " + str(other), href=get_detail_href('show', series, other))))
+    return facts
+
+# ------------------------------------------------------------------------------
+# The page itself: heading, facts, notes and a table of performances
+# ------------------------------------------------------------------------------
+def get_detail_layout(init_dict, heading, subheading, facts, info, table, table_title):
+    style_default = init_dict['style_default']
+
+    fact_items = [html.Li([html.Strong(label + ": "), value]) for label, value in facts]
+    notes = [] if info is None or 'Notes' not in info.index or pd.isna(info['Notes']) else [html.P(str(info['Notes']))]
+
+    links   = {col:detail_links[col] for col in detail_links if col in table.columns}
+    columns = [col for col in table.columns if col not in ('Series', 'Series Index')]
+
+    components = []
+    components.append(get_navbar(init_dict['pages'], init_dict['title']))
+    components.append(get_empty_row())
+    components.append(html.H2(heading))
+    if subheading:
+        components.append(html.H4(subheading))
+    components.append(html.Ul(fact_items))
+    components.extend(notes)
+    if len(table) > 0:
+        components.extend(display_simple_table(table, idx="detail_table", title=table_title, max_rows=len(table), links=links, columns=columns))
+    components.append(get_footnote(init_dict['footnote']))
+    return html.Div(components, style=style_default)
+
+def get_not_found(init_dict, kind, name):
+    components = []
+    components.append(get_navbar(init_dict['pages'], init_dict['title']))
+    components.append(get_empty_row())
+    components.append(html.H3("No " + kind + " called " + name))
+    components.append(get_footnote(init_dict['footnote']))
+    return html.Div(components, style=init_dict['style_default'])
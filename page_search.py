@@ -0,0 +1,56 @@
+# ==================================================================================================
+# search page
+# - The results are filled in by the callback in search.py
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import dash_core_components as dcc
+import dash_html_components as html
+
+from lib import *
+
+# ==================================================================================================
+# Init
+# ==================================================================================================
+print("...loading search page...")
+
+def layout_search(init_dict):
+    # ==============================================================================================
+    # Grab the information from the init
+    # ==============================================================================================
+    style_default      = init_dict['style_default']    
+    pages              = init_dict['pages']
+    footnote           = init_dict['footnote']
+    title              = init_dict['title']
+
+    # ==============================================================================================
+    # Page Contents Configuration
+    # ==============================================================================================
+    # ------------------------------------------------------------------------------
+    # The search box and where the results go
+    # ------------------------------------------------------------------------------
+    search_box = dcc.Input(id='search-input', type='search', debounce=False, autoFocus=True,
+                           placeholder="Song, artist, album or person...",
+                           style={'width':'100%', 'fontSize':'1.25em'})
+    results = html.Div(id='search-results')
+
+    # ==============================================================================================
+    # Component layout
+    # ==============================================================================================
+    # ------------------------------------------------------------------------------
+    # Compile components
+    # ------------------------------------------------------------------------------
+    components = []
+    components.append(get_navbar(pages, title))
+    components.append(get_empty_row())
+    components.append(html.H3("Search"))
+    components.append(html.Div([get_empty_col(), html.Div([search_box, get_empty_row(), results], className='col-10'), get_empty_col()], className='row'))
+    components.append(get_footnote(footnote))
+
+    # ------------------------------------------------------------------------------
+    # Top Level
+    # ------------------------------------------------------------------------------
+    layout_search = html.Div(components, style=style_default)
+    return layout_search
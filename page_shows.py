@@ -10,11 +10,11 @@ import dash_html_components as html
 from dash.dependencies import Input, Output
 
 import pandas as pd
-import plotly.express as px
 
 from app import app
 
 from lib import *
+from derived import get_derived
 
 # ==================================================================================================
 # Init
@@ -34,9 +34,9 @@ def layout_shows(init_dict):
     # ==============================================================================================
     # Sort out the data
     # ==============================================================================================
-    data_shows = get_data_shows(data)
+    data_shows = get_derived('shows', data)
 
-    data_songs_by_show = data_shows.sort_values(by='Series Index')
+    data_songs_by_show = get_derived('shows_by_series_index', data)
 
     # ==============================================================================================
     # Page Contents Configuration
@@ -48,9 +48,11 @@ def layout_shows(init_dict):
     charts['songs_by_show'] = {'chart_type':'bar', 
                                        'idx':'chart_songs_by_show', 
                                        'details':{'data':data_songs_by_show,
+                                                'source':'shows_by_series_index',
                                                      'x':'Show Title',
                                                      'y':['Count'], 
-                                                 'style':style_default}}
+                                                 'style':style_default,
+                                                'engine':'fast'}}
 
     # ------------------------------------------------------------------------------
     # Control information
@@ -10,11 +10,11 @@ import dash_html_components as html
 from dash.dependencies import Input, Output
 
 import pandas as pd
-import plotly.express as px
 
 from app import app
 
 from lib import *
+from derived import get_derived
 
 # ==================================================================================================
 # Init
@@ -34,7 +34,7 @@ def layout_songs(init_dict):
     # ==============================================================================================
     # Sort out the data
     # ==============================================================================================
-    data_songs = get_data_songs(data)
+    data_songs = get_derived('songs', data)
 
     # ==============================================================================================
     # Page Contents Configuration
@@ -65,7 +65,7 @@ def layout_songs(init_dict):
     # ------------------------------------------------------------------------------
     components = []
     components.append(get_navbar(pages, title))
-    components.extend(display_data_table(data_songs, idx="songs_data_table", title="Data by Song"))
+    components.extend(display_data_table(data_songs, idx="songs_data_table", title="Data by Song", source='songs'))
     #components.append(charts_with_controls(charts, controls, layout))
     components.append(get_footnote(footnote))
 
@@ -10,11 +10,11 @@ import dash_html_components as html
 from dash.dependencies import Input, Output
 
 import pandas as pd
-import plotly.express as px
 
 from app import app
 
 from lib import *
+from derived import get_derived, register_derived
 
 # ==================================================================================================
 # Init
@@ -79,14 +79,13 @@ def layout_splash(init_dict):
     # ------------------------------------------------------------------------------
     # Stuff for the last-setlist table 
     # ------------------------------------------------------------------------------
-    data_performances = get_data_performances(data)
-    data_last_setlist = data_performances.loc[data_performances['Show']==max(data_performances['Show'])]
+    data_last_setlist = get_derived('latest_setlist', data)
 
     # ------------------------------------------------------------------------------
     # Data for individual charts
     # ------------------------------------------------------------------------------
-    data_num_songs_by_artist = get_data_num_songs_by_artist(data, minsongs=10)
-    data_num_songs_by_year   = get_data_num_songs_by_year(data)
+    data_num_songs_by_artist = get_derived('num_songs_by_artist', data)
+    data_num_songs_by_year   = get_derived('num_songs_by_year', data)
 
     # ==============================================================================================
     # Page Contents Configuration
@@ -98,18 +97,22 @@ def layout_splash(init_dict):
     charts_1['num_songs_by_artist'] = {'chart_type':'bar', 
                                        'idx':'chart_num_songs_by_artist', 
                                        'details':{'data':data_num_songs_by_artist,
+                                                'source':'num_songs_by_artist',
                                                      'x':'Originating Artist',
                                                      'y':['Number of Songs Played'], 
                                                  'color':"CH Original", 
-                                                 'style':style_default}}
+                                                 'style':style_default,
+                                                'engine':'fast'}}
 
     charts_2={}
     charts_2['num_songs_by_year']   = {'chart_type':'bar', 
                                               'idx':'chart_num_songs_by_year', 
                                           'details':{'data': data_num_songs_by_year,
+                                                   'source': 'num_songs_by_year',
                                                         'x': "Year of Song's Origination",
                                                         'y': ['Number of Songs Played'], 
-                                                    'style': style_default}}
+                                                    'style': style_default,
+                                                   'engine': 'fast'}}
 
     # ------------------------------------------------------------------------------
     # Control information
@@ -179,9 +182,10 @@ def layout_splash(init_dict):
 # ------------------------------------------------------------------------------
 def get_data_num_songs_by_artist(data, minsongs=0):
     # --------------------------------------------------------------------------
-    # Get the whole count
+    # Get the whole count; on the plain values, so that ties stay in the order
+    # the bands first appear even when the column is categorical
     # --------------------------------------------------------------------------
-    count = data['Songs']['Band'].value_counts(sort=True, ascending=False)
+    count = data['Songs']['Band'].astype(object).value_counts(sort=True, ascending=False)
 
     # --------------------------------------------------------------------------
     # Reset the minimum if requested
@@ -197,8 +201,7 @@ def get_data_num_songs_by_artist(data, minsongs=0):
     # --------------------------------------------------------------------------
     # Add a column to say whether the band is one of Chris's originals
     # --------------------------------------------------------------------------
-    sdata['CH Original'] = sdata['Originating Artist']
-    sdata['CH Original'] = sdata['CH Original'].apply(band_is_original, args=([data['Bands']]))
+    sdata['CH Original'] = get_original_flags(sdata['Originating Artist'], data['Bands'], context="num_songs_by_artist")
 
     # --------------------------------------------------------------------------
     # Finish
@@ -225,3 +228,8 @@ def get_data_num_songs_by_year(data):
     # --------------------------------------------------------------------------
     return sdata
 
+# ------------------------------------------------------------------------------
+# Keep the chart data with the other derived tables
+# ------------------------------------------------------------------------------
+register_derived('num_songs_by_artist', lambda data: get_data_num_songs_by_artist(data, minsongs=10))
+register_derived('num_songs_by_year',   get_data_num_songs_by_year)
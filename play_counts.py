@@ -0,0 +1,133 @@
+# ==================================================================================================
+# PLAY COUNTS
+# One index of how often things have been played, built in a single pass over
+# the Performances sheet and shared by all of the derived tables
+# - counts['song']   : (Song, Artist)  -> Times Played, First Show, Last Show
+# - counts['artist'] : Artist          -> Times Played
+# - counts['album']  : (Album, Artist) -> Times Played
+# - counts['show']   : Series Index    -> Count (songs in the show)
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import numpy as np
+import pandas as pd
+
+# ==================================================================================================
+# Building the index
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Count everything from a Performances frame (the whole sheet, or just the
+# rows of a new show) and the Songs sheet for the album lookup
+# ------------------------------------------------------------------------------
+def build_play_counts(performances, songs):
+    # --------------------------------------------------------------------------
+    # Integer codes for each column; rows missing a song or artist don't count
+    # --------------------------------------------------------------------------
+    song_codes,   song_names   = pd.factorize(performances['Song'].to_numpy())
+    artist_codes, artist_names = pd.factorize(performances['Artist'].to_numpy())
+    shows = performances['Series Index'].to_numpy()
+
+    valid = (song_codes >= 0) & (artist_codes >= 0)
+    song_codes, artist_codes, valid_shows = song_codes[valid], artist_codes[valid], shows[valid]
+
+    # --------------------------------------------------------------------------
+    # (Song, Artist) pairs as one integer, then size/min/max per pair
+    # --------------------------------------------------------------------------
+    pair_codes, pairs = pd.factorize(song_codes.astype(np.int64) * max(len(artist_names), 1) + artist_codes)
+    per_pair = pd.Series(valid_shows).groupby(pair_codes).agg(['size','min','max'])
+
+    pair_song   = song_names[pairs // max(len(artist_names), 1)]
+    pair_artist = artist_names[pairs % max(len(artist_names), 1)]
+
+    song = pd.DataFrame({'Times Played':per_pair['size'].to_numpy(),
+                         'First Show':per_pair['min'].to_numpy(),
+                         'Last Show':per_pair['max'].to_numpy()},
+                        index=pd.MultiIndex.from_arrays([pair_song, pair_artist], names=['Song','Artist'])).sort_index()
+
+    # --------------------------------------------------------------------------
+    # Plays per artist straight from the artist codes
+    # --------------------------------------------------------------------------
+    artist = pd.DataFrame({'Times Played':np.bincount(artist_codes, minlength=len(artist_names))},
+                          index=pd.Index(artist_names, name='Artist'))
+    artist = artist[artist['Times Played'] > 0]
+
+    # --------------------------------------------------------------------------
+    # Plays per album, via the album each (Song, Artist) comes from
+    # --------------------------------------------------------------------------
+    album = get_album_counts(song, songs)
+
+    # --------------------------------------------------------------------------
+    # Songs per show, counted over every row as the shows table always has
+    # --------------------------------------------------------------------------
+    show_codes, show_ids = pd.factorize(shows)
+    show = pd.DataFrame({'Count':np.bincount(show_codes[show_codes >= 0], minlength=len(show_ids))},
+                        index=pd.Index(show_ids, name='Series Index'))
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    counts = {}
+    counts['song']   = song
+    counts['artist'] = artist.sort_index()
+    counts['album']  = album
+    counts['show']   = show.sort_index()
+    return counts
+
+# ------------------------------------------------------------------------------
+# Roll the song counts up to albums
+# ------------------------------------------------------------------------------
+def get_album_counts(song, songs):
+    albums = songs['Album']
+    albums = albums[~albums.index.duplicated(keep='first')]
+    albums.index = albums.index.set_names(['Song','Artist'])
+
+    # looked up in the song counts' order, so the albums come out in the order
+    # their first song does
+    played = song[['Times Played']].assign(Album=albums.reindex(song.index).to_numpy()).dropna(subset=['Album'])
+    played = played.reset_index()
+    album = played.groupby(['Album','Artist'], sort=False)['Times Played'].sum().to_frame()
+    return album
+
+# ==================================================================================================
+# Incremental update
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Fold the rows of a newly appended show into existing counts; the old counts
+# are left alone, so they can go on being used until the new data is swapped in
+# ------------------------------------------------------------------------------
+def append_play_counts(counts, new_performances, songs):
+    delta = build_play_counts(new_performances, songs)
+    out = {}
+
+    # --------------------------------------------------------------------------
+    # Songs: add the plays and widen the first/last show range for the songs
+    # that were played again, then tack on the ones played for the first time
+    # --------------------------------------------------------------------------
+    song = counts['song'].copy()
+    new  = delta['song']
+    again = new.index.intersection(song.index)
+    if len(again) > 0:
+        song.loc[again, 'Times Played'] += new.loc[again, 'Times Played']
+        song.loc[again, 'First Show'] = np.minimum(song.loc[again, 'First Show'], new.loc[again, 'First Show'])
+        song.loc[again, 'Last Show']  = np.maximum(song.loc[again, 'Last Show'],  new.loc[again, 'Last Show'])
+    first_time = new.loc[new.index.difference(song.index)]
+    out['song'] = pd.concat([song, first_time]).sort_index()
+
+    # --------------------------------------------------------------------------
+    # Artists and shows are a plain sum, over the old names followed by the
+    # new ones (add() would sort the union, which fails on a mix of names and
+    # numbers), then sorted as a full build sorts them
+    # --------------------------------------------------------------------------
+    for key in ['artist', 'show']:
+        index = counts[key].index.append(delta[key].index.difference(counts[key].index, sort=False))
+        total = counts[key].reindex(index, fill_value=0) + delta[key].reindex(index, fill_value=0)
+        out[key] = total.astype(counts[key].dtypes.to_dict()).sort_index()
+
+    # --------------------------------------------------------------------------
+    # Albums are rolled up again from the song counts, so they come out in the
+    # same order as a full build, wherever a newly played album falls
+    # --------------------------------------------------------------------------
+    out['album'] = get_album_counts(out['song'], songs)
+    return out
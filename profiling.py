@@ -0,0 +1,222 @@
+# ==================================================================================================
+# STARTUP PROFILING
+# Where the time goes between starting a worker and serving the first pages
+# - Turned on with CHOLT_PROFILE=1; the report goes to CHOLT_PROFILE_FILE
+#   (default startup_profile.json)
+# - Every module imported after this one is timed, nested under whatever
+#   imported it, along with the sections the rest of the code marks with
+#   profile_section (reading the workbook, indexing, the first render of each
+#   page and so on)
+# - This has to be the first import in wsgi.py/index.py to see everything,
+#   and uses nothing but the standard library for the same reason
+# - When it is off, profile_section costs one check
+#
+#     python profiling.py report.json              prints a report as a tree
+#     python profiling.py old.json new.json        compares two of them
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import sys
+import json
+import time
+import atexit
+import platform
+import threading
+import contextlib
+import importlib.abc
+import importlib.machinery
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+profile_config = {}
+profile_config['enabled'] = os.environ.get("CHOLT_PROFILE", "0") not in ("", "0")
+profile_config['fname']   = os.environ.get("CHOLT_PROFILE_FILE", "startup_profile.json")
+
+# ------------------------------------------------------------------------------
+# The tree of timed sections; each thread keeps its own stack of open ones,
+# and a section opened with nothing above it goes at the top level
+# ------------------------------------------------------------------------------
+profile_state = {'started':time.perf_counter(), 'started_at':time.time(), 'roots':[], 'startup':None, 'finished':None}
+profile_lock  = threading.Lock()
+profile_local = threading.local()
+
+# ==================================================================================================
+# Timed sections
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Open a section; kind is what sort of thing it is (import, read, index,
+# render...), so a report can be summed up by kind
+# ------------------------------------------------------------------------------
+def start_section(name, kind="section"):
+    node = {'name':name, 'kind':kind, 'start':time.perf_counter() - profile_state['started'], 'seconds':None, 'children':[]}
+    stack = getattr(profile_local, 'stack', None)
+    if stack is None:
+        stack = profile_local.stack = []
+    if stack:
+        stack[-1]['children'].append(node)
+    else:
+        with profile_lock:
+            profile_state['roots'].append(node)
+    stack.append(node)
+    return node
+
+def end_section(node):
+    node['seconds'] = time.perf_counter() - profile_state['started'] - node['start']
+    stack = profile_local.stack
+    while stack:
+        if stack.pop() is node:
+            break
+    return node
+
+@contextlib.contextmanager
+def timed_section(name, kind):
+    node = start_section(name, kind)
+    try:
+        yield node
+    finally:
+        end_section(node)
+
+# ------------------------------------------------------------------------------
+# What the rest of the code uses:
+#     with profile_section("read workbook", "read"):
+#         ...
+# ------------------------------------------------------------------------------
+def profile_section(name, kind="section"):
+    if not profile_config['enabled']:
+        return contextlib.nullcontext()
+    return timed_section(name, kind)
+
+def profiling_enabled():
+    return profile_config['enabled']
+
+# ==================================================================================================
+# Import timing
+# - A finder at the front of sys.meta_path lets the usual finders do the work,
+#   then wraps the loader's exec_module for modules that come from files;
+#   built-in and frozen modules are left alone, they cost next to nothing
+# ==================================================================================================
+class ImportTimer(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            if isinstance(loader, (importlib.machinery.SourceFileLoader, importlib.machinery.SourcelessFileLoader, importlib.machinery.ExtensionFileLoader)):
+                loader.exec_module = get_timed_exec(fullname, loader.exec_module)
+            return spec
+        return None
+
+def get_timed_exec(fullname, exec_module):
+    def timed_exec(module):
+        with timed_section(fullname, "import"):
+            return exec_module(module)
+    return timed_exec
+
+# ==================================================================================================
+# The report
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Mark the end of startup (the app is ready to serve); the report is written
+# now, and again as pages are rendered for the first time
+# ------------------------------------------------------------------------------
+def finish_startup():
+    if not profile_config['enabled'] or profile_state['finished'] is not None:
+        return
+    if profile_state['startup'] is not None:
+        end_section(profile_state['startup'])
+    profile_state['finished'] = time.perf_counter() - profile_state['started']
+    write_profile()
+
+# ------------------------------------------------------------------------------
+# Everything recorded so far, plus totals by kind and a flat list of paths
+# that is easy to compare between releases
+# ------------------------------------------------------------------------------
+def get_profile_report():
+    with profile_lock:
+        roots = json.loads(json.dumps(profile_state['roots']))
+
+    flat = {}
+    totals = {}
+    def walk(node, path):
+        path = path + "/" + node['name'] if path else node['name']
+        seconds = node['seconds'] if node['seconds'] is not None else 0.0
+        node['self_seconds'] = seconds - sum((child['seconds'] or 0.0) for child in node['children'])
+        flat[path] = flat.get(path, 0.0) + seconds
+        totals[node['kind']] = totals.get(node['kind'], 0.0) + node['self_seconds']
+        for child in node['children']:
+            walk(child, path)
+    for node in roots:
+        walk(node, "")
+
+    report = {}
+    report['format']          = 1
+    report['started_at']      = profile_state['started_at']
+    report['python']          = platform.python_version()
+    report['argv']            = sys.argv
+    report['startup_seconds'] = profile_state['finished']
+    report['totals_by_kind']  = totals
+    report['sections']        = flat
+    report['tree']            = roots
+    return report
+
+def write_profile(fname=None):
+    if not profile_config['enabled']:
+        return None
+    fname = fname or profile_config['fname']
+    tmp_fname = fname + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(tmp_fname, 'w') as f:
+            json.dump(get_profile_report(), f, indent=1)
+        os.replace(tmp_fname, fname)
+    except OSError as e:
+        print("WARNING! Could not write the startup profile: " + str(e))
+        return None
+    return fname
+
+# ------------------------------------------------------------------------------
+# Turn it on
+# ------------------------------------------------------------------------------
+if profile_config['enabled'] and not any(isinstance(finder, ImportTimer) for finder in sys.meta_path):
+    sys.meta_path.insert(0, ImportTimer())
+    profile_state['startup'] = start_section("startup", "startup")
+    atexit.register(write_profile)
+
+# ==================================================================================================
+# Reading reports
+# ==================================================================================================
+def print_tree(nodes, depth=0, min_seconds=0.005):
+    for node in nodes:
+        seconds = node['seconds'] or 0.0
+        if seconds < min_seconds:
+            continue
+        print("{:>9.3f}  {}{} [{}]".format(seconds, "  " * depth, node['name'], node['kind']))
+        print_tree(node['children'], depth + 1, min_seconds)
+
+def print_comparison(old, new, min_seconds=0.005):
+    print("{:>9} {:>9} {:>9}  {}".format("old (s)", "new (s)", "change", "section"))
+    for path in sorted(set(old['sections']) | set(new['sections']), key=lambda p: -new['sections'].get(p, 0.0)):
+        a, b = old['sections'].get(path, 0.0), new['sections'].get(path, 0.0)
+        if max(a, b) < min_seconds:
+            continue
+        print("{:>9.3f} {:>9.3f} {:>+9.3f}  {}".format(a, b, b - a, path))
+
+if __name__ == '__main__':
+    reports = []
+    for fname in sys.argv[1:3]:
+        with open(fname) as f:
+            reports.append(json.load(f))
+
+    if len(reports) == 1:
+        print("startup: {:.3f}s".format(reports[0]['startup_seconds'] or 0.0))
+        print_tree(reports[0]['tree'])
+    elif len(reports) == 2:
+        print_comparison(reports[0], reports[1])
+    else:
+        print("usage: python profiling.py report.json [new_report.json]")
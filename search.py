@@ -0,0 +1,400 @@
+# ==================================================================================================
+# SEARCH
+# One search box over the Songs, Bands, Albums and People sheets, for checking
+# in a hurry whether a request has been played before
+# - Every row is a document; its words go in an inverted index (word -> rows,
+#   weighted by the column they came from, so a match in a name counts more
+#   than one in the notes)
+# - Every indexed word also goes in a trigram index, so a misspelled word
+#   still finds the words that share some of its three-letter pieces; those
+#   are then ranked by edit distance, with a swapped pair of letters counting
+#   as one edit, since sharing pieces alone puts "rose" above "heroes" for
+#   "herose"; the last word typed also matches as a prefix, so results come
+#   up while typing
+# - Rows are ranked by how well each word matched, rows matching every word
+#   first, with a boost when the name itself matches the whole query
+# - When new data comes in, only rows that changed are taken out of the index
+#   or put in, found by hashing each row
+# - The callback for the search page lives here, since pages can't have any
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import re
+import sys
+import time
+import bisect
+import threading
+import unicodedata
+from collections import Counter
+
+import pandas as pd
+
+import dash_core_components as dcc
+import dash_html_components as html
+import dash_bootstrap_components as dbc
+from dash.dependencies import Input, Output
+
+from app import app
+from profiling import profile_section
+from dataset import get_data_version, add_data_listener
+from derived import get_derived
+from lib import get_detail_href
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Sheet -> the column shown as the name, the one shown under it, and the
+# columns searched with their weights
+# ------------------------------------------------------------------------------
+search_sheets = {}
+search_sheets['Songs']  = {'title':'Name', 'subtitle':'Band',        'fields':{'Name':3, 'Band':2, 'Album':2, 'Composer':1, 'Genre':1, 'Notes':1}}
+search_sheets['Bands']  = {'title':'Name', 'subtitle':'Genres',      'fields':{'Name':3, 'Genres':1, 'Band Family':1, 'Band Birthplace':1, 'Notes':1}}
+search_sheets['Albums'] = {'title':'Name', 'subtitle':'Band',        'fields':{'Name':3, 'Band':2, 'Personnel':1, 'Genre':1, 'Notes':1}}
+search_sheets['People'] = {'title':'Name', 'subtitle':'Instruments', 'fields':{'Name':3, 'Bands':2, 'Instruments':1, 'Notes':1}}
+
+# ------------------------------------------------------------------------------
+# How much each kind of word match is worth, how many words sharing trigrams
+# are looked at for a misspelling, and how many edits it can be off by
+# (one for words up to five letters, two past that)
+# ------------------------------------------------------------------------------
+match_exact   = 1.0
+match_prefix  = 0.8
+match_fuzzy   = 0.6
+prefix_limit  = 50
+fuzzy_limit   = 200
+fuzzy_edits   = [(5, 1), (None, 2)]
+result_limit  = 25
+
+token_re = re.compile(r"[a-z0-9]+")
+
+# ==================================================================================================
+# Words
+# ==================================================================================================
+def normalize_text(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return text.lower().replace("'", "")
+
+def get_tokens(text):
+    return token_re.findall(normalize_text(text))
+
+def get_trigrams(token):
+    padded = "$" + token + "$"
+    return {padded[i:i+3] for i in range(max(1, len(padded) - 2))}
+
+def get_allowed_edits(word):
+    for length, edits in fuzzy_edits:
+        if length is None or len(word) <= length:
+            return edits
+
+# ------------------------------------------------------------------------------
+# Edits to turn one word into the other (insert, delete, change, or swap two
+# letters next to each other), or limit + 1 once it's clearly more than limit
+# ------------------------------------------------------------------------------
+def get_edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i-1] == b[j-1] else 1
+            current[j] = min(previous[j] + 1, current[j-1] + 1, previous[j-1] + cost)
+            if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1]:
+                current[j] = min(current[j], before[j-2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+# ==================================================================================================
+# The index
+# ==================================================================================================
+class SearchIndex:
+    """
+    Inverted and trigram indexes over the search sheets of one Dataset, kept
+    up to date row by row as new versions come in
+    """
+    def __init__(self):
+        self.version   = None
+        self.docs      = {}     # doc id -> sheet, title, subtitle and word weights
+        self.postings  = {}     # word -> {doc id: weight}
+        self.trigrams  = {}     # trigram -> words
+        self.row_docs  = {}     # sheet -> {row hash: doc id}
+        self.next_id   = 0
+        self.words     = []     # sorted, for prefix matching; rebuilt when stale
+        self.words_ok  = False
+        self.lock      = threading.Lock()
+        self.stats     = {'added':0, 'removed':0, 'seconds':0.0}
+
+    # ----------------------------------------------------------------------------------------------
+    # Bring the index up to this data; only changed rows are touched
+    # ----------------------------------------------------------------------------------------------
+    def update(self, data):
+        version = get_data_version(data)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            start = time.perf_counter()
+            added = removed = 0
+            for sheet, spec in search_sheets.items():
+                old = self.row_docs.setdefault(sheet, {})
+                if sheet not in data:
+                    for row_hash in list(old):
+                        self.remove_doc(old.pop(row_hash))
+                        removed += 1
+                    continue
+
+                # ------------------------------------------------------------------------------
+                # Rows that are new or gone, by content
+                # ------------------------------------------------------------------------------
+                df = data[sheet]
+                columns = [col for col in spec['fields'] if col in df.columns]
+                for col in [spec['title'], spec['subtitle']]:
+                    if col in df.columns and col not in columns:
+                        columns.append(col)
+                hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+                current = set(hashes.tolist())
+                for row_hash in [row_hash for row_hash in old if row_hash not in current]:
+                    self.remove_doc(old.pop(row_hash))
+                    removed += 1
+
+                new_positions = {}
+                for pos, row_hash in enumerate(hashes.tolist()):
+                    if row_hash not in old and row_hash not in new_positions:
+                        new_positions[row_hash] = pos
+                if new_positions:
+                    rows = df[columns].iloc[list(new_positions.values())].to_dict('records')
+                    for row_hash, row in zip(new_positions, rows):
+                        old[row_hash] = self.add_doc(sheet, spec, row)
+                        added += 1
+
+            self.version = version
+            self.stats['added']   += added
+            self.stats['removed'] += removed
+            self.stats['seconds'] += time.perf_counter() - start
+            print("...search index at version " + str(version) + ": " + str(added) + " rows added, " + str(removed) + " removed, {:.2f}s...".format(time.perf_counter() - start))
+
+    def add_doc(self, sheet, spec, row):
+        weights = {}
+        for col, weight in spec['fields'].items():
+            value = row.get(col)
+            if value is None or (isinstance(value, float) and value != value):
+                continue
+            # interned, so every row holding a word (and the postings) share
+            # one copy of it rather than one per row
+            for token in get_tokens(value):
+                token = sys.intern(token)
+                weights[token] = max(weights.get(token, 0), weight)
+
+        doc_id = self.next_id
+        self.next_id += 1
+        self.docs[doc_id] = {'sheet':sheet, 'title':get_text(row.get(spec['title'])),
+                             'subtitle':sys.intern(get_text(row.get(spec['subtitle']))), 'weights':weights}
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                self.words_ok = False
+                for gram in get_trigrams(token):
+                    self.trigrams.setdefault(gram, set()).add(token)
+            self.postings[token][doc_id] = weight
+        return doc_id
+
+    def remove_doc(self, doc_id):
+        doc = self.docs.pop(doc_id)
+        for token in doc['weights']:
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[token]
+                self.words_ok = False
+                for gram in get_trigrams(token):
+                    self.trigrams.get(gram, set()).discard(token)
+
+    # ----------------------------------------------------------------------------------------------
+    # Indexed words a query word could stand for, with how good a match each is
+    # ----------------------------------------------------------------------------------------------
+    def get_word_matches(self, word, is_last):
+        matches = {}
+        if word in self.postings:
+            matches[word] = match_exact
+
+        # ------------------------------------------------------------------------------------------
+        # Prefix: only for the word still being typed
+        # ------------------------------------------------------------------------------------------
+        if is_last:
+            if not self.words_ok:
+                self.words = sorted(self.postings)
+                self.words_ok = True
+            start = bisect.bisect_left(self.words, word)
+            for other in self.words[start:start + prefix_limit]:
+                if not other.startswith(word):
+                    break
+                matches.setdefault(other, match_prefix)
+
+        # ------------------------------------------------------------------------------------------
+        # Misspellings: of the words sharing the most trigrams, the ones a
+        # few edits away, closer being better
+        # ------------------------------------------------------------------------------------------
+        if len(word) >= 3:
+            shared = Counter()
+            for gram in get_trigrams(word):
+                shared.update(self.trigrams.get(gram, ()))
+            allowed = get_allowed_edits(word)
+            for other, count in shared.most_common(fuzzy_limit):
+                if other in matches:
+                    continue
+                edits = get_edit_distance(word, other, allowed)
+                if edits <= allowed:
+                    matches[other] = match_fuzzy * (1.0 - float(edits) / max(len(word), len(other)))
+        return matches
+
+    # ----------------------------------------------------------------------------------------------
+    # Ranked hits for a query
+    # ----------------------------------------------------------------------------------------------
+    def search(self, query, limit=result_limit):
+        words = get_tokens(query or "")
+        if not words:
+            return []
+
+        with self.lock:
+            totals = Counter()
+            matched = Counter()
+            for i, word in enumerate(words):
+                best = {}
+                for other, quality in self.get_word_matches(word, i == len(words) - 1).items():
+                    for doc_id, weight in self.postings[other].items():
+                        score = weight * quality
+                        if score > best.get(doc_id, 0):
+                            best[doc_id] = score
+                for doc_id, score in best.items():
+                    totals[doc_id] += score
+                    matched[doc_id] += 1
+
+            # --------------------------------------------------------------------------------------
+            # Rows matching every word come first; a name matching the whole
+            # query, or starting with it, goes to the top
+            # --------------------------------------------------------------------------------------
+            phrase = " ".join(words)
+            hits = []
+            for doc_id, total in totals.items():
+                doc = self.docs[doc_id]
+                score = total * (matched[doc_id] / len(words)) ** 2
+                name = " ".join(get_tokens(doc['title']))
+                if name == phrase:
+                    score += 5
+                elif name.startswith(phrase):
+                    score += 2
+                hits.append((score, doc['title'], doc_id))
+            hits.sort(key=lambda hit: (-hit[0], hit[1]))
+
+            return [dict(sheet=self.docs[doc_id]['sheet'], title=self.docs[doc_id]['title'],
+                         subtitle=self.docs[doc_id]['subtitle'], score=score) for score, title, doc_id in hits[:limit]]
+
+def get_text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return str(value)
+
+# ==================================================================================================
+# The one index for the data being served
+# ==================================================================================================
+search_index = SearchIndex()
+
+def search(data, query, limit=result_limit):
+    search_index.update(data)
+    hits = search_index.search(query, limit)
+    add_play_counts(hits, data)
+    return hits
+
+# ------------------------------------------------------------------------------
+# For songs, how many times they've been played and in which show last
+# ------------------------------------------------------------------------------
+def add_play_counts(hits, data):
+    songs = [hit for hit in hits if hit['sheet'] == 'Songs']
+    if not songs:
+        return
+    counts = get_derived('play_counts', data)['song']
+    for hit in songs:
+        key = (hit['title'], hit['subtitle'])
+        if key in counts.index:
+            row = counts.loc[key]
+            hit['times_played'] = int(row['Times Played'])
+            hit['last_show'] = row['Last Show']
+        else:
+            hit['times_played'] = 0
+
+def get_search_stats():
+    stats = dict(search_index.stats)
+    stats['documents'] = len(search_index.docs)
+    stats['words'] = len(search_index.postings)
+    return stats
+
+add_data_listener(lambda old_data, new_data: search_index.update(new_data))
+
+# ==================================================================================================
+# Showing the results
+# ==================================================================================================
+search_labels = {'Songs':"Song", 'Bands':"Artist", 'Albums':"Album", 'People':"Person"}
+
+# ------------------------------------------------------------------------------
+# Where a hit links to (the detail pages in index.py); people have no page
+# ------------------------------------------------------------------------------
+search_hrefs = {}
+search_hrefs['Songs']  = lambda hit: get_detail_href('song', hit['subtitle'], hit['title'])
+search_hrefs['Bands']  = lambda hit: get_detail_href('artist', hit['title'])
+search_hrefs['Albums'] = lambda hit: get_detail_href('album', hit['subtitle'], hit['title'])
+
+def get_search_results(hits, query, seconds):
+    if not (query or "").strip():
+        return []
+    if not hits:
+        return [html.P("Nothing found for \"" + query + "\"")]
+
+    items = []
+    for hit in hits:
+        name = html.Strong(hit['title'])
+        if hit['sheet'] in search_hrefs:
+            name = dcc.Link(name, href=search_hrefs[hit['sheet']](hit))
+        parts = [dbc.Badge(search_labels[hit['sheet']], color="secondary", className="me-2"), name]
+        if hit['subtitle']:
+            parts.append(html.Span(" - " + hit['subtitle']))
+        if 'times_played' in hit:
+            if hit['times_played']:
+                parts.append(html.Span("  (played " + str(hit['times_played']) + " times, last in show " + str(hit['last_show']) + ")"))
+            else:
+                parts.append(html.Span("  (not played yet)"))
+        items.append(dbc.ListGroupItem(parts, style={'backgroundColor':'black', 'color':'white'}))
+
+    summary = html.Small(str(len(hits)) + " results in {:.0f} ms".format(seconds * 1000))
+    return [summary, dbc.ListGroup(items)]
+
+# ==================================================================================================
+# Callback for the search page
+# ==================================================================================================
+@app.callback(Output('search-results', 'children'),
+              Input('search-input', 'value'),
+              prevent_initial_call=True)
+def update_search_results(query):
+    from initialize import init_dict
+    start = time.perf_counter()
+    hits = search(init_dict['data'], query)
+    return get_search_results(hits, query, time.perf_counter() - start)
+
+# ==================================================================================================
+# Built at startup, so the first search doesn't wait for it
+# ==================================================================================================
+def warm_search_index():
+    from initialize import init_dict
+    with profile_section("search index", "index"):
+        search_index.update(init_dict['data'])
+
+warm_search_index()
@@ -0,0 +1,330 @@
+# ==================================================================================================
+# SHARED DATA
+# The loaded sheets, the play counts and the main derived tables written once
+# to Arrow IPC files and memory-mapped read-only by every worker, turned on
+# with CHOLT_SHARED=1 (needs pyarrow)
+# - One folder per data version next to the workbook
+#   (data/.cholt_data.xlsx.<version>.shared/, or .compact.shared/ for
+#   CHOLT_COMPACT), one .arrow file per sheet, play count or table and a
+#   manifest; whichever process gets there first writes it, under a temporary
+#   name that is renamed into place once complete
+# - A load source, so that once the folder for the workbook's version is
+#   there, loading maps it straight away and never reads the workbook; only
+#   the first process to load a version parses it (every sheet of it, lazy or
+#   not) and writes the folder
+# - Shows from the incoming folder (see ingest.py) are added on top of the
+#   mapped data, and that version is shared in its turn; a show added while
+#   running only replaces the Gigs and Performances sheets in that worker
+# - Reading maps the files and builds the frames on top of the mapped
+#   buffers without copying them: numbers and dates as read-only numpy views,
+#   text as Arrow-backed string columns, and categoricals (CHOLT_COMPACT) as
+#   codes over their dictionary
+# - The pages of a mapped file belong to the OS page cache, not to a worker,
+#   so every worker using the same version shares one copy and adding workers
+#   adds almost no data memory; the search and detail-page indexes and the
+#   rendered pages are still each worker's own, which is most of what a
+#   worker holds (see the readme); python bench_memory.py measures that
+# - The levels and codes of a MultiIndex are stored as they are, as
+#   dictionary columns, so mapping doesn't factorize the keys all over again
+#   in every worker
+# - Columns that mix kinds of value (an album called 1999 among the names)
+#   can't be viewed like that and are put back as ordinary object columns
+# - The frames must not be modified in place, which the Dataset rules already
+#   say; the numeric views are read-only and will refuse
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import json
+import time
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from lib import encode_snapshot_frame, decode_snapshot_frame
+from profiling import profile_section
+from dataset import Dataset, get_data_version, add_load_hook, add_load_source
+from derived import get_derived, seed_derived
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+shared_config = {}
+shared_config['enabled'] = os.environ.get("CHOLT_SHARED", "0") == "1"
+shared_config['dir']     = os.environ.get("CHOLT_SHARED_DIR", "")
+shared_config['compact'] = os.environ.get("CHOLT_COMPACT", "0") == "1"
+shared_config['keep']    = 2
+
+# ------------------------------------------------------------------------------
+# The derived tables that go in alongside the sheets
+# ------------------------------------------------------------------------------
+shared_tables = ['performances', 'shows', 'songs', 'albums', 'artists', 'people', 'originals']
+
+if shared_config['enabled'] and pa is None:
+    print("WARNING! CHOLT_SHARED needs pyarrow, which isn't installed; each worker will load its own copy")
+    shared_config['enabled'] = False
+
+# ==================================================================================================
+# Writing
+# ==================================================================================================
+shared_manifest_name = "manifest.json"
+
+def get_shared_prefix(source):
+    source = source or os.path.join("data", "cholt_data.xlsx")
+    folder = shared_config['dir'] or os.path.dirname(source)
+    return os.path.join(folder, "." + os.path.basename(source) + ".")
+
+def get_shared_dir(source, version, compact):
+    suffix = ".compact.shared" if compact else ".shared"
+    return get_shared_prefix(source) + version + suffix
+
+def is_shared_dir(folder):
+    return os.path.exists(os.path.join(folder, shared_manifest_name))
+
+# ------------------------------------------------------------------------------
+# Every sheet and every shared table, into a temporary folder that is renamed
+# into place at the end; if another process got there first, theirs is kept
+# ------------------------------------------------------------------------------
+def write_shared(data, folder):
+    start = time.perf_counter()
+    tmp_folder = folder + "." + str(os.getpid()) + ".tmp"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.makedirs(tmp_folder)
+
+    try:
+        sheets = list(data)
+        for i, sheet in enumerate(sheets):
+            write_frame(data[sheet], os.path.join(tmp_folder, "sheet_" + str(i) + ".arrow"))
+        counts = get_derived('play_counts', data)
+        for key in counts:
+            write_frame(counts[key], os.path.join(tmp_folder, "counts_" + key + ".arrow"))
+        for name in shared_tables:
+            write_frame(get_derived(name, data), os.path.join(tmp_folder, "table_" + name + ".arrow"))
+        with open(os.path.join(tmp_folder, shared_manifest_name), 'w') as f:
+            json.dump({'version':get_data_version(data), 'sheets':sheets, 'counts':list(counts), 'tables':shared_tables}, f)
+        os.rename(tmp_folder, folder)
+    except OSError:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        if os.path.isdir(folder):
+            return
+        raise
+    except Exception:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        raise
+    print("...wrote " + folder + " in {:.2f}s...".format(time.perf_counter() - start))
+
+# ------------------------------------------------------------------------------
+# One frame as one Arrow file; how to rebuild the index, and the kind of
+# each column, go in the schema's metadata
+# ------------------------------------------------------------------------------
+def write_frame(df, fname):
+    names = [str(name) for name in df.index.names]
+    index = {'names':names, 'from_columns':False}
+    levels = get_level_arrays(df.index)
+    if levels is not None:
+        index['levels'] = ['__index__' + str(i) for i in range(len(levels))]
+        index['codes'] = True
+    elif all(name in df.columns for name in names) and all((df.index.get_level_values(i) == df[name]).all() for i, name in enumerate(names)):
+        index['from_columns'] = True
+    elif isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        index = None
+    else:
+        df = df.copy()
+        for i in range(df.index.nlevels):
+            df['__index__' + str(i)] = df.index.get_level_values(i)
+        index['levels'] = ['__index__' + str(i) for i in range(df.index.nlevels)]
+
+    arrays = []
+    kinds  = {}
+    for col in df.columns:
+        array, kinds[col] = get_arrow_array(df[col])
+        arrays.append(array)
+    columns = [str(col) for col in df.columns]
+    if levels is not None:
+        for name, (array, kind) in zip(index['levels'], levels):
+            arrays.append(array)
+            kinds[name] = kind
+            columns.append(name)
+    meta = {'cholt':json.dumps({'index':index, 'kinds':kinds, 'columns':columns})}
+    table = pa.Table.from_arrays(arrays, names=columns).replace_schema_metadata(meta)
+
+    with pa.OSFile(fname, 'wb') as f:
+        with pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+
+# ------------------------------------------------------------------------------
+# One column, and the kind it is, so that reading can undo it
+# - numpy: numbers, bools and dates, stored as they are (NaN included) so
+#   they come back as views
+# - string: text with blanks
+# - category: codes and dictionary
+# - mixed: anything else, through the same encoding the snapshot uses
+# ------------------------------------------------------------------------------
+def get_arrow_array(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = pa.array(series.cat.categories.to_numpy(dtype=object), from_pandas=True)
+        codes = series.cat.codes.to_numpy()
+        return pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), categories), 'category'
+    if isinstance(series.dtype, pd.ArrowDtype):
+        return pa.array(series.array), 'arrow'
+    if series.dtype != object:
+        return pa.array(series.to_numpy()), 'numpy'
+
+    values = series.dropna()
+    if values.map(type).eq(str).all():
+        return pa.array(series.to_numpy(), type=pa.large_string(), from_pandas=True), 'string'
+
+    encoded = encode_snapshot_frame(series.to_frame('value'))
+    kinds = encoded['__kind__value'].to_numpy() if '__kind__value' in encoded else np.zeros(len(series), dtype='int8')
+    return pa.StructArray.from_arrays([pa.array(encoded['value'].to_numpy(dtype=object), type=pa.large_string(), from_pandas=True), pa.array(kinds)], names=['value', 'kind']), 'mixed'
+
+# ------------------------------------------------------------------------------
+# Each level of a MultiIndex as its codes over a dictionary of the level's
+# values, with the kind of those values; None if it isn't a MultiIndex or a
+# level can't be stored like that (categoricals, mixed kinds), in which case
+# the index is stored as columns and rebuilt on reading
+# ------------------------------------------------------------------------------
+def get_level_arrays(df_index):
+    if not isinstance(df_index, pd.MultiIndex):
+        return None
+    levels = []
+    for level, codes in zip(df_index.levels, df_index.codes):
+        dictionary, kind = get_arrow_array(pd.Series(level, copy=False))
+        if kind not in ('numpy', 'string', 'arrow'):
+            return None
+        codes = np.asarray(codes)
+        levels.append((pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), dictionary), kind))
+    return levels
+
+# ==================================================================================================
+# Reading
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Map one file and build its frame over the mapped buffers
+# ------------------------------------------------------------------------------
+def read_frame(fname):
+    table = pa.ipc.open_file(pa.memory_map(fname, 'r')).read_all()
+    meta  = json.loads(table.schema.metadata[b'cholt'])
+
+    index = meta['index']
+    stored = index['levels'] if index is not None and index.get('codes') else []
+
+    columns = {}
+    for i, col in enumerate(meta['columns']):
+        if col not in stored:
+            columns[col] = get_column(table.column(i), meta['kinds'][col])
+
+    # the index is built here rather than with set_index, which would copy
+    # every column out of the mapping
+    if index is None:
+        return pd.DataFrame(columns, copy=False)
+    names = [None if name == 'None' else name for name in index['names']]
+    if stored:
+        levels = [table.column(name).combine_chunks() for name in stored]
+        df_index = pd.MultiIndex(levels=[pd.Index(get_column(pa.chunked_array([level.dictionary]), meta['kinds'][name]), copy=False) for level, name in zip(levels, stored)],
+                                 codes=[level.indices.fill_null(-1).to_numpy(zero_copy_only=False) for level in levels],
+                                 names=names, verify_integrity=False)
+        return pd.DataFrame(columns, index=df_index, copy=False)
+    levels = [columns[name] for name in index['names']] if index['from_columns'] else [columns.pop(name) for name in index['levels']]
+    if len(levels) == 1:
+        df_index = pd.Index(levels[0], name=names[0])
+    else:
+        df_index = pd.MultiIndex.from_arrays(levels, names=names)
+    return pd.DataFrame(columns, index=df_index, copy=False)
+
+def get_column(column, kind):
+    column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+    if kind == 'numpy':
+        return column.to_numpy(zero_copy_only=False)
+    if kind == 'category':
+        categories = column.dictionary.to_pandas()
+        return pd.Categorical.from_codes(column.indices.fill_null(-1).to_numpy(zero_copy_only=False), categories=categories)
+    if kind in ('string', 'arrow'):
+        return pd.arrays.ArrowExtensionArray(column)
+
+    values = pd.DataFrame({'value':column.field('value').to_pandas(), '__kind__value':column.field('kind').to_numpy()})
+    return decode_snapshot_frame(values)['value'].to_numpy(dtype=object)
+
+# ------------------------------------------------------------------------------
+# A Dataset of every sheet in a shared folder, mapped; its tables go straight
+# into the derived store for its version
+# ------------------------------------------------------------------------------
+def map_shared(folder, source):
+    with open(os.path.join(folder, shared_manifest_name)) as f:
+        manifest = json.load(f)
+
+    sheets = {}
+    for i, sheet in enumerate(manifest['sheets']):
+        sheets[sheet] = read_frame(os.path.join(folder, "sheet_" + str(i) + ".arrow"))
+    shared = Dataset(sheets, manifest['version'], source=source)
+    shared.shared_dir = folder
+
+    if 'counts' in manifest:
+        seed_derived('play_counts', shared, {key:read_frame(os.path.join(folder, "counts_" + key + ".arrow")) for key in manifest['counts']})
+    for name in manifest['tables']:
+        seed_derived(name, shared, read_frame(os.path.join(folder, "table_" + name + ".arrow")))
+    print("...mapped data version " + shared.version + " from " + folder + "...")
+    return shared
+
+# ------------------------------------------------------------------------------
+# Load source: the workbook's version, if its folder is there already
+# ------------------------------------------------------------------------------
+def map_shared_version(data_fname, version, compact):
+    if not shared_config['enabled']:
+        return None
+    folder = get_shared_dir(data_fname, version, compact)
+    if not is_shared_dir(folder):
+        return None
+    with profile_section("map shared data", "read"):
+        return map_shared(folder, data_fname)
+
+add_load_source(map_shared_version)
+
+# ------------------------------------------------------------------------------
+# Load hook: data that isn't mapped yet is written out (if nobody has yet)
+# and mapped instead
+# - Runs before the other hooks, so the workbook's own version gets a folder
+#   that the next process to load it can map, and again after them, so the
+#   shows added from the incoming folder are shared too; data that was mapped
+#   and had nothing added goes through as it is
+# ------------------------------------------------------------------------------
+def share_data(data):
+    if not shared_config['enabled']:
+        return data
+    folder = get_shared_dir(data.source, get_data_version(data), shared_config['compact'])
+    if getattr(data, 'shared_dir', None) == folder:
+        return data
+    with profile_section("share data", "read"):
+        if not is_shared_dir(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+            write_shared(data, folder)
+            remove_old_shared(data.source, folder)
+        shared = map_shared(folder, data.source)
+    shared.loaded_at = data.loaded_at
+    shared.load_seconds = data.load_seconds
+    shared.load_times = dict(data.load_times)
+    return shared
+
+add_load_hook(share_data, first=True)
+add_load_hook(share_data)
+
+# ------------------------------------------------------------------------------
+# Keep the newest few folders, as workers still on the old data may have them
+# mapped
+# ------------------------------------------------------------------------------
+def remove_old_shared(source, folder):
+    prefix = get_shared_prefix(source)
+    parent = os.path.dirname(prefix) or "."
+    others = [os.path.join(parent, name) for name in os.listdir(parent) if name.endswith(".shared")]
+    others = [other for other in others if other.startswith(prefix)]
+    for other in sorted(others, key=os.path.getmtime)[:-shared_config['keep']]:
+        if other != folder:
+            shutil.rmtree(other, ignore_errors=True)
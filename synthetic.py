@@ -0,0 +1,231 @@
+# ==================================================================================================
+# SYNTHETIC DATA
+# Made-up workbooks with the same sheets and columns as cholt_data.xlsx, at
+# any size, for seeing how the app copes as the real one grows
+# - Sizes are given as numbers of shows, songs, bands, albums and people, or
+#   as a scale of the current workbook (get_synthetic_sizes); setlists grow
+#   with the number of shows, the catalogue grows more slowly
+# - Song popularity follows a long tail, so play counts, top-N charts and
+#   the like behave roughly as they do on the real data
+# - Everything is generated with numpy from a seed, so a given size always
+#   gives the same data
+#
+#     python synthetic.py out.xlsx [scale]          writes a workbook
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from lib import sheet_index
+
+# ==================================================================================================
+# Settings
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Roughly the size of the workbook today
+# ------------------------------------------------------------------------------
+synthetic_base = {'shows':88, 'songs':1786, 'bands':458, 'albums':953, 'people':737, 'songs_per_show':21}
+
+# ------------------------------------------------------------------------------
+# Columns of each sheet, in workbook order
+# ------------------------------------------------------------------------------
+synthetic_columns = {}
+synthetic_columns['People']       = ['Name','Year Born','Year Died','Instruments','Bands','Notes','AllMusic','Wikipedia']
+synthetic_columns['Instruments']  = ['Name','Type','Notes']
+synthetic_columns['Genres']       = ['Name','Bands','Features','Notes']
+synthetic_columns['Bands']        = ['Name','Genres','Chris Relationship','Band Family','Band Birthplace','Notes','AllMusic','Wikipedia']
+synthetic_columns['Songs']        = ['Name','Band','Album','Year','Genre','Composer','Covered','Notes','AllMusic','Wikipedia']
+synthetic_columns['Albums']       = ['Name','Band','Year','Personnel','Genre','Notes','AllMusic','Wikipedia']
+synthetic_columns['Places']       = ['Name','Address','City','State','Latitude','Longitude','Notes']
+synthetic_columns['Series']       = ['Name','Active','Notes']
+synthetic_columns['Gigs']         = ['Series','Series Index','Location','Date/Time Start','Date/Time End','Show Title','Notes']
+synthetic_columns['Performances'] = ['Series','Series Index','Set','Set Position','Song','Artist','Segue In','Segue Out','Looping','Loop Time Start','Song Time Start','Time Finish','Notes']
+synthetic_columns['Image']        = ['File Name','File Path','Format','Title','Size_X','Size_Y','Photographer','Timestamp','Location','Notes']
+synthetic_columns['Audio']        = ['File Name','File Path','Format','Title','Length','Notes']
+synthetic_columns['Video']        = ['File Name','File Path','Format','Title','Size_X','Size_Y','Length','Notes']
+
+synthetic_series     = "Live From CH Studio"
+synthetic_place      = "CH Studio"
+synthetic_instrument = ['Guitar','Bass','Drums','Keys','Vocal','Pedal Steel']
+synthetic_genres     = ['Progressive','Rock','Pop','Soul','Country','Punk','Metal','Folk','Jazz']
+
+# ------------------------------------------------------------------------------
+# Excel stops at this many rows per sheet
+# ------------------------------------------------------------------------------
+excel_max_rows = 1048576
+
+# ==================================================================================================
+# Sizes
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Sizes for a multiple of today's workbook; shows scale as given, the
+# catalogue with its square root
+# ------------------------------------------------------------------------------
+def get_synthetic_sizes(scale):
+    sizes = {}
+    sizes['shows']          = max(1, int(round(synthetic_base['shows'] * scale)))
+    for key in ['songs', 'bands', 'albums', 'people']:
+        sizes[key] = max(1, int(round(synthetic_base[key] * max(scale, 1) ** 0.5)))
+    sizes['songs_per_show'] = synthetic_base['songs_per_show']
+    return sizes
+
+# ==================================================================================================
+# Generating
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# All of the sheets, as read from a workbook (not indexed yet)
+# ------------------------------------------------------------------------------
+def make_synthetic_sheets(shows, songs, bands, albums=None, people=None, songs_per_show=21, seed=0):
+    rng = np.random.default_rng(seed)
+    albums = albums or max(1, songs // 2)
+    people = people or max(1, bands + bands // 2)
+
+    sheets = {}
+
+    # --------------------------------------------------------------------------
+    # Bands; a few are Chris's own
+    # --------------------------------------------------------------------------
+    band_names = get_names("Band ", bands)
+    band_df = empty_sheet('Bands', bands)
+    band_df['Name'] = band_names
+    band_df['Chris Relationship'] = get_sometimes("Original", rng.random(bands) < 0.02)
+    band_df['Band Family'] = get_sometimes(band_names, rng.random(bands) < 0.05)
+    band_df['Genres'] = rng.choice(synthetic_genres, size=bands)
+
+    # --------------------------------------------------------------------------
+    # Albums, each by a band; a few bands put out most of them
+    # --------------------------------------------------------------------------
+    album_bands = rng.choice(bands, size=albums, p=get_long_tail(bands, 0.8))
+    album_years = rng.integers(1958, 2024, size=albums)
+    album_df = empty_sheet('Albums', albums)
+    album_df['Name'] = get_names("Album ", albums)
+    album_df['Band'] = band_names[album_bands]
+    album_df['Year'] = album_years
+
+    # --------------------------------------------------------------------------
+    # Songs, each off an album; the ones by Chris's bands are his
+    # --------------------------------------------------------------------------
+    song_albums = rng.choice(albums, size=songs, p=get_long_tail(albums, 0.5))
+    song_bands  = album_bands[song_albums]
+    song_df = empty_sheet('Songs', songs)
+    song_df['Name']     = get_names("SONG ", songs)
+    song_df['Band']     = band_names[song_bands]
+    song_df['Album']    = album_df['Name'].to_numpy()[song_albums]
+    song_df['Year']     = album_years[song_albums]
+    song_df['Composer'] = np.where(band_df['Chris Relationship'].notna().to_numpy()[song_bands], "Chris Holt", song_df['Band'])
+
+    # --------------------------------------------------------------------------
+    # Shows, once a week, or closer together if there are too many of them to
+    # fit in the dates pandas can hold
+    # --------------------------------------------------------------------------
+    show_index = np.arange(1, shows + 1)
+    step = min(7 * 86400, 200 * 365 * 86400 // shows)
+    gig_df = empty_sheet('Gigs', shows)
+    gig_df['Series'] = synthetic_series
+    gig_df['Series Index'] = show_index
+    gig_df['Location'] = synthetic_place
+    gig_df['Date/Time Start'] = (pd.Timestamp("2020-01-02 19:00:00") + pd.to_timedelta((show_index - 1) * step, unit='s')).strftime("%Y-%m-%d %H:%M:%S")
+    gig_df['Show Title'] = "Episode " + pd.Series(show_index).astype(str)
+
+    # --------------------------------------------------------------------------
+    # Setlists: 10 to 42 songs a show, the favourites played far more often
+    # --------------------------------------------------------------------------
+    per_show = np.clip(rng.normal(songs_per_show, 6, size=shows).round(), 10, 42).astype(np.int64)
+    total = int(per_show.sum())
+    starts = np.repeat(np.cumsum(per_show) - per_show, per_show)
+    played = rng.permutation(songs)[rng.choice(songs, size=total, p=get_long_tail(songs, 1.0))]
+
+    perf_df = empty_sheet('Performances', total)
+    perf_df['Series'] = synthetic_series
+    perf_df['Series Index'] = np.repeat(show_index, per_show)
+    perf_df['Set'] = "I"
+    perf_df['Set Position'] = np.arange(total) - starts + 1
+    perf_df['Song'] = song_df['Name'].to_numpy()[played]
+    perf_df['Artist'] = song_df['Band'].to_numpy()[played]
+    perf_df['Segue In'] = get_sometimes("Yes", rng.random(total) < 0.002)
+
+    # --------------------------------------------------------------------------
+    # People, each in a band or two
+    # --------------------------------------------------------------------------
+    people_df = empty_sheet('People', people)
+    people_df['Name'] = get_names("Person ", people)
+    people_df['Year Born'] = rng.integers(1930, 2000, size=people).astype(float)
+    people_df['Instruments'] = rng.choice(synthetic_instrument, size=people)
+    people_df['Bands'] = band_names[rng.integers(bands, size=people)]
+    people_df['Notes'] = get_sometimes("Played with " + people_df['Bands'].astype(str), rng.random(people) < 0.3)
+
+    # --------------------------------------------------------------------------
+    # The small ones
+    # --------------------------------------------------------------------------
+    sheets['People']       = people_df
+    sheets['Instruments']  = empty_sheet('Instruments', len(synthetic_instrument)).assign(Name=synthetic_instrument)
+    sheets['Genres']       = empty_sheet('Genres', len(synthetic_genres)).assign(Name=synthetic_genres)
+    sheets['Bands']        = band_df
+    sheets['Songs']        = song_df
+    sheets['Albums']       = album_df
+    sheets['Places']       = empty_sheet('Places', 1).assign(Name=synthetic_place, City="Dallas", State="TX")
+    sheets['Series']       = empty_sheet('Series', 1).assign(Name=synthetic_series)
+    sheets['Gigs']         = gig_df
+    sheets['Performances'] = perf_df
+    for sheet in ['Image', 'Audio', 'Video']:
+        sheets[sheet] = pd.DataFrame({col:pd.Series(dtype=object) for col in synthetic_columns[sheet]})
+    return sheets
+
+# ------------------------------------------------------------------------------
+# The same, indexed the way get_marked_data leaves them
+# ------------------------------------------------------------------------------
+def make_synthetic_data(shows, songs, bands, albums=None, people=None, songs_per_show=21, seed=0):
+    sheets = make_synthetic_sheets(shows, songs, bands, albums, people, songs_per_show, seed)
+    for sheet in sheets:
+        if sheet in sheet_index:
+            sheets[sheet] = sheets[sheet].set_index(sheet_index[sheet], drop=False)
+    return sheets
+
+# ------------------------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------------------------
+def get_names(prefix, n):
+    width = len(str(n))
+    return (prefix + pd.Series(np.arange(1, n + 1)).astype(str).str.zfill(width)).to_numpy(dtype=object)
+
+def get_long_tail(n, power):
+    weights = 1.0 / np.arange(1, n + 1) ** power
+    return weights / weights.sum()
+
+def get_sometimes(values, mask):
+    return pd.Series(values, index=range(len(mask)), dtype=object).where(mask).to_numpy()
+
+def empty_sheet(sheet, rows):
+    return pd.DataFrame({col:np.full(rows, np.nan) for col in synthetic_columns[sheet]})
+
+# ==================================================================================================
+# Writing a workbook
+# ==================================================================================================
+def write_synthetic_workbook(sheets, fname):
+    for sheet in sheets:
+        if len(sheets[sheet]) >= excel_max_rows:
+            raise ValueError("Sheet " + sheet + " has " + str(len(sheets[sheet])) + " rows, more than Excel can hold")
+    with pd.ExcelWriter(fname) as writer:
+        for sheet in sheets:
+            sheets[sheet].to_excel(writer, sheet_name=sheet, index=False)
+    return fname
+
+# ==================================================================================================
+# Run
+# ==================================================================================================
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: python synthetic.py out.xlsx [scale]")
+        sys.exit(1)
+
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    sizes = get_synthetic_sizes(scale)
+    sheets = make_synthetic_sheets(**sizes)
+    print("...writing " + sys.argv[1] + ": " + ", ".join(sheet + " " + str(len(sheets[sheet])) for sheet in sheets) + "...")
+    write_synthetic_workbook(sheets, sys.argv[1])
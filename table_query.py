@@ -0,0 +1,295 @@
+# ==================================================================================================
+# SERVER-SIDE TABLES
+# Paging, filtering and sorting for the big data tables, done here instead of
+# in the browser
+# - A table in server-side mode gets the id {'type':'server-table', 'index':<name>}
+#   where <name> is the derived table it shows (see derived.py); one callback
+#   serves all of them
+# - The DataTable filter query is parsed into vectorized pandas operations, and
+#   the resulting row order for each (filter, sort) is cached per data version,
+#   so paging through a result or repeating a query is just a slice
+# ==================================================================================================
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+import re
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import dash
+from dash.dependencies import Input, Output, State, MATCH
+
+from app import app
+from derived import get_derived
+from dataset import get_data_version
+
+# ==================================================================================================
+# Settings and state
+# ==================================================================================================
+server_table_type = 'server-table'
+
+# ------------------------------------------------------------------------------
+# (name, version, filter query, sort) -> row positions, most recently used last
+# ------------------------------------------------------------------------------
+query_cache       = OrderedDict()
+query_cache_size  = 256
+query_cache_lock  = threading.Lock()
+query_cache_stats = {'hits':0, 'misses':0}
+
+# ==================================================================================================
+# Parsing the filter query
+# - The DataTable writes filters like
+#       {Artist} contains Beatles && {Year} >= 1970 && {Song} ieq "Help!"
+#   one clause per column, joined with &&
+# ==================================================================================================
+filter_ops = {}
+filter_ops['=']  = 'eq'
+filter_ops['!='] = 'ne'
+filter_ops['<']  = 'lt'
+filter_ops['<='] = 'le'
+filter_ops['>']  = 'gt'
+filter_ops['>='] = 'ge'
+
+clause_re = re.compile(r"""^\s*\{(?P<col>(?:[^}\\]|\\.)+)\}\s*
+                           (?P<op>[si]?(?:eq|ne|lt|le|gt|ge|contains|datestartswith)\b|>=|<=|!=|=|<|>)\s*
+                           (?P<value>.*?)\s*$""", re.X)
+blank_re  = re.compile(r"^\s*\{(?P<col>(?:[^}\\]|\\.)+)\}\s+is\s+(?P<neg>not\s+)?(?:blank|nil)\s*$")
+
+# ------------------------------------------------------------------------------
+# Split on && that aren't inside quotes
+# ------------------------------------------------------------------------------
+def split_filter_query(filter_query):
+    parts = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(filter_query):
+        ch = filter_query[i]
+        if quote:
+            if ch == '\\' and i + 1 < len(filter_query):
+                current.append(filter_query[i:i+2])
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+        elif ch in "\"'`":
+            quote = ch
+        elif filter_query.startswith('&&', i):
+            parts.append(''.join(current))
+            current = []
+            i += 2
+            continue
+        current.append(ch)
+        i += 1
+    parts.append(''.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+# ------------------------------------------------------------------------------
+# Turn the text after the operator into a value: quoted is always a string,
+# otherwise a number if it looks like one
+# ------------------------------------------------------------------------------
+def parse_filter_value(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "\"'`":
+        quote = text[0]
+        return text[1:-1].replace('\\' + quote, quote)
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+# ------------------------------------------------------------------------------
+# Parse the whole query into (column, operator, case, value) clauses; anything
+# we can't make sense of is skipped, as the browser would have done
+# ------------------------------------------------------------------------------
+def parse_filter_query(filter_query):
+    clauses = []
+    for part in split_filter_query(filter_query or ''):
+        match = blank_re.match(part)
+        if match:
+            col = match.group('col').replace('\\}', '}')
+            clauses.append((col, 'notblank' if match.group('neg') else 'blank', None, None))
+            continue
+
+        match = clause_re.match(part)
+        if not match:
+            continue
+        col = match.group('col').replace('\\}', '}')
+        op  = filter_ops.get(match.group('op'), match.group('op'))
+        case = 'sensitive'
+        if op[0] in 'si' and op[1:] in ('eq','ne','lt','le','gt','ge','contains','datestartswith'):
+            case = 'insensitive' if op[0] == 'i' else 'sensitive'
+            op = op[1:]
+        clauses.append((col, op, case, parse_filter_value(match.group('value'))))
+    return clauses
+
+# ==================================================================================================
+# Applying the query
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# Boolean mask for one clause
+# ------------------------------------------------------------------------------
+def get_clause_mask(df, col, op, case, value):
+    series = df[col]
+
+    # --------------------------------------------------------------------------
+    # Blank checks
+    # --------------------------------------------------------------------------
+    if op in ('blank', 'notblank'):
+        blank = series.isna() | (series.astype(str).str.strip() == '')
+        return ~blank if op == 'notblank' else blank
+
+    # --------------------------------------------------------------------------
+    # Text matches work on the displayed text
+    # --------------------------------------------------------------------------
+    if op in ('contains', 'datestartswith'):
+        text = series.astype(str).where(series.notna(), '')
+        value = format_filter_value(value)
+        if case == 'insensitive':
+            text = text.str.lower()
+            value = value.lower()
+        if op == 'contains':
+            return text.str.contains(value, regex=False)
+        return text.str.startswith(value)
+
+    # --------------------------------------------------------------------------
+    # Comparisons are numeric when the value is a number, text otherwise;
+    # blanks never match, except for "not equal"
+    # --------------------------------------------------------------------------
+    if isinstance(value, float):
+        left = pd.to_numeric(series, errors='coerce')
+    else:
+        left = series.astype(str)
+        if case == 'insensitive':
+            left = left.str.lower()
+            value = value.lower()
+    valid = series.notna() & left.notna()
+
+    if op == 'eq':
+        mask = left == value
+    elif op == 'ne':
+        return (left != value) | ~valid
+    elif op == 'lt':
+        mask = left < value
+    elif op == 'le':
+        mask = left <= value
+    elif op == 'gt':
+        mask = left > value
+    elif op == 'ge':
+        mask = left >= value
+    else:
+        return pd.Series(True, index=df.index)
+    return mask & valid
+
+def format_filter_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+# ------------------------------------------------------------------------------
+# Row positions that pass the filter, in the requested order
+# ------------------------------------------------------------------------------
+def get_query_positions(df, filter_query, sort_by):
+    positions = np.arange(len(df))
+
+    # --------------------------------------------------------------------------
+    # Filter
+    # --------------------------------------------------------------------------
+    clauses = [clause for clause in parse_filter_query(filter_query) if clause[0] in df.columns]
+    if clauses:
+        mask = np.ones(len(df), dtype=bool)
+        for col, op, case, value in clauses:
+            mask &= get_clause_mask(df, col, op, case, value).to_numpy()
+        positions = np.flatnonzero(mask)
+
+    # --------------------------------------------------------------------------
+    # Sort; mergesort keeps ties in their original order like the browser does
+    # --------------------------------------------------------------------------
+    sort_by = [s for s in (sort_by or []) if s.get('column_id') in df.columns]
+    if sort_by:
+        sub = df.iloc[positions].reset_index(drop=True)
+        sub = sub.sort_values(by=[s['column_id'] for s in sort_by],
+                              ascending=[s.get('direction') != 'desc' for s in sort_by],
+                              kind='mergesort', na_position='last', key=get_sort_key)
+        positions = positions[sub.index.to_numpy()]
+
+    return positions
+
+# ------------------------------------------------------------------------------
+# What a column is sorted on: itself, unless it mixes text with other values
+# (an album called 1999 among the names), which can't be compared with each
+# other; those are sorted as text, blanks staying blank
+# ------------------------------------------------------------------------------
+def get_sort_key(column):
+    if column.dtype != object:
+        return column
+    is_text = column.map(lambda value: isinstance(value, str))
+    if not is_text.any() or is_text.sum() == column.notna().sum():
+        return column
+    return column.where(column.isna(), column.astype(str))
+
+# ------------------------------------------------------------------------------
+# Cached version of the above
+# ------------------------------------------------------------------------------
+def query_table(name, data, filter_query='', sort_by=None):
+    df = get_derived(name, data)
+    sort_key = tuple((s.get('column_id'), s.get('direction')) for s in (sort_by or []))
+    key = (name, get_data_version(data), filter_query or '', sort_key)
+
+    with query_cache_lock:
+        if key in query_cache:
+            query_cache.move_to_end(key)
+            query_cache_stats['hits'] += 1
+            return df, query_cache[key]
+
+    positions = get_query_positions(df, filter_query, sort_by)
+
+    with query_cache_lock:
+        query_cache_stats['misses'] += 1
+        query_cache[key] = positions
+        while len(query_cache) > query_cache_size:
+            query_cache.popitem(last=False)
+    return df, positions
+
+# ------------------------------------------------------------------------------
+# One page of the result, as DataTable records, plus the page count and the
+# page actually shown, which is the last one if the result has fewer pages
+# than page_current asks for
+# ------------------------------------------------------------------------------
+def get_table_page(name, data, page_current=0, page_size=50, filter_query='', sort_by=None):
+    df, positions = query_table(name, data, filter_query, sort_by)
+    page_count = max(1, math.ceil(len(positions) / page_size))
+    page_current = min(max(page_current or 0, 0), page_count - 1)
+    start = page_current * page_size
+    page = df.iloc[positions[start:start + page_size]]
+    return page.to_dict('records'), page_count, page_current
+
+def get_query_cache_stats():
+    stats = dict(query_cache_stats)
+    stats['entries'] = len(query_cache)
+    return stats
+
+# ==================================================================================================
+# Callback shared by every server-side table
+# - The first page is already in the layout, so there's no initial call
+# - A new filter or sort starts again from the first page
+# ==================================================================================================
+@app.callback(Output({'type':server_table_type, 'index':MATCH}, 'data'),
+              Output({'type':server_table_type, 'index':MATCH}, 'page_count'),
+              Output({'type':server_table_type, 'index':MATCH}, 'page_current'),
+              Input({'type':server_table_type, 'index':MATCH}, 'page_current'),
+              Input({'type':server_table_type, 'index':MATCH}, 'page_size'),
+              Input({'type':server_table_type, 'index':MATCH}, 'sort_by'),
+              Input({'type':server_table_type, 'index':MATCH}, 'filter_query'),
+              State({'type':server_table_type, 'index':MATCH}, 'id'),
+              prevent_initial_call=True)
+def update_server_table(page_current, page_size, sort_by, filter_query, idx):
+    from initialize import init_dict
+    triggered = [trigger['prop_id'].rsplit('.', 1)[-1] for trigger in dash.callback_context.triggered]
+    if 'filter_query' in triggered or 'sort_by' in triggered:
+        page_current = 0
+    return get_table_page(idx['index'], init_dict['data'], page_current, page_size, filter_query, sort_by)
@@ -0,0 +1,40 @@
+# ==================================================================================================
+# TESTS: search
+#
+#     python -m pytest tests
+# ==================================================================================================
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex, get_edit_distance
+from dataset import Dataset
+
+# ------------------------------------------------------------------------------
+# A few rows where the misspelling shares more trigrams with the wrong word
+# ------------------------------------------------------------------------------
+def get_index():
+    sheets = {}
+    sheets['Songs']  = pd.DataFrame({'Name':["Heroes", "Honeysuckle Rose"], 'Band':["David Bowie", "Fats Waller"]})
+    sheets['People'] = pd.DataFrame({'Name':["Axl Rose"], 'Instruments':["Vocals"]})
+    index = SearchIndex()
+    index.update(Dataset(sheets, "test"))
+    return index
+
+def test_edit_distance():
+    assert get_edit_distance("heroes", "heroes", 2) == 0
+    assert get_edit_distance("herose", "heroes", 2) == 1
+    assert get_edit_distance("herose", "rose", 2) == 2
+    assert get_edit_distance("kitten", "sitting", 5) == 3
+    assert get_edit_distance("ab", "abcdef", 2) == 3
+
+def test_transposition_ranks_first():
+    hits = get_index().search("herose")
+    assert hits[0]['title'] == "Heroes"
+    assert [hit['title'] for hit in hits[1:]] and all(hit['score'] < hits[0]['score'] for hit in hits[1:])
+
+def test_too_many_edits_dont_match():
+    assert get_index().search("hxrqzs") == []
@@ -0,0 +1,134 @@
+# ==================================================================================================
+# TESTS: server-side table queries
+#
+#     python -m pytest tests
+# ==================================================================================================
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from table_query import parse_filter_query, get_query_positions, get_table_page
+from derived import register_derived
+from dataset import Dataset
+
+# ------------------------------------------------------------------------------
+# A column mixing ints and strings, the way Album does when an album is
+# called 1999
+# ------------------------------------------------------------------------------
+def get_mixed_frame():
+    return pd.DataFrame({'Album':["Purple Rain", 1999, np.nan, "Around the World", 1979],
+                         'Year' :[1984, 1982, 1990, 1985, 1979]})
+
+def test_sort_mixed_column_ascending():
+    df = get_mixed_frame()
+    positions = get_query_positions(df, '', [{'column_id':'Album', 'direction':'asc'}])
+    assert list(df['Album'].iloc[positions][:4]) == [1979, 1999, "Around the World", "Purple Rain"]
+    assert pd.isna(df['Album'].iloc[positions[-1]])
+
+def test_sort_mixed_column_descending():
+    df = get_mixed_frame()
+    positions = get_query_positions(df, '', [{'column_id':'Album', 'direction':'desc'}])
+    assert list(df['Album'].iloc[positions][:4]) == ["Purple Rain", "Around the World", 1999, 1979]
+    assert pd.isna(df['Album'].iloc[positions[-1]])
+
+def test_sort_mixed_column_after_filter():
+    df = get_mixed_frame()
+    positions = get_query_positions(df, '{Year} > 1980', [{'column_id':'Album', 'direction':'asc'}, {'column_id':'Year', 'direction':'desc'}])
+    assert list(df['Album'].iloc[positions][:3]) == [1999, "Around the World", "Purple Rain"]
+
+def test_sort_plain_columns_unchanged():
+    df = get_mixed_frame()
+    positions = get_query_positions(df, '', [{'column_id':'Year', 'direction':'asc'}])
+    assert list(df['Year'].iloc[positions]) == [1979, 1982, 1984, 1985, 1990]
+
+# ==================================================================================================
+# Filter queries
+# ==================================================================================================
+# ------------------------------------------------------------------------------
+# A few shows' worth of performances, with a blank album and a year missing
+# ------------------------------------------------------------------------------
+def get_performance_frame():
+    return pd.DataFrame({'Song'  :["Help!", "Purple Rain", "1999", "Heroes", "Rock && Roll"],
+                         'Artist':["The Beatles", "Prince", "Prince", "David Bowie", "Lou Reed"],
+                         'Album' :["Help!", "Purple Rain", "", "Heroes", np.nan],
+                         'Year'  :[1965, 1984, 1982, 1977, np.nan],
+                         'Date'  :["2021-05-27", "2021-06-03", "2021-06-03", "2022-01-13", "2022-01-20"]})
+
+def get_filtered_songs(filter_query):
+    df = get_performance_frame()
+    return list(df['Song'].iloc[get_query_positions(df, filter_query, None)])
+
+def test_parse_clauses():
+    assert parse_filter_query('{Artist} contains Beatles && {Year} >= 1970 && {Song} ieq "Help!"') == \
+        [('Artist', 'contains', 'sensitive', 'Beatles'), ('Year', 'ge', 'sensitive', 1970.0), ('Song', 'eq', 'insensitive', 'Help!')]
+
+def test_parse_symbol_and_word_operators():
+    for op, name in [('=', 'eq'), ('!=', 'ne'), ('<', 'lt'), ('<=', 'le'), ('>', 'gt'), ('>=', 'ge'),
+                     ('eq', 'eq'), ('ne', 'ne'), ('lt', 'lt'), ('le', 'le'), ('gt', 'gt'), ('ge', 'ge'),
+                     ('scontains', 'contains'), ('datestartswith', 'datestartswith')]:
+        assert parse_filter_query('{Year} ' + op + ' 1980') == [('Year', name, 'sensitive', 1980.0)]
+
+def test_parse_quoted_values_stay_text():
+    assert parse_filter_query('{Song} = "1999"') == [('Song', 'eq', 'sensitive', '1999')]
+    assert parse_filter_query("{Song} contains 'Rock && Roll'") == [('Song', 'contains', 'sensitive', 'Rock && Roll')]
+    assert parse_filter_query('{Song} = "Say \\"Hi\\""') == [('Song', 'eq', 'sensitive', 'Say "Hi"')]
+
+def test_parse_escaped_column():
+    assert parse_filter_query('{Odd\\}Name} = x') == [('Odd}Name', 'eq', 'sensitive', 'x')]
+
+def test_parse_blank_checks():
+    assert parse_filter_query('{Album} is blank && {Year} is not nil') == [('Album', 'blank', None, None), ('Year', 'notblank', None, None)]
+
+def test_parse_malformed_clauses_are_skipped():
+    assert parse_filter_query(None) == []
+    assert parse_filter_query('') == []
+    assert parse_filter_query('  &&  ') == []
+    assert parse_filter_query('Beatles') == []
+    assert parse_filter_query('{Artist contains Beatles') == []
+    assert parse_filter_query('{Artist} resembles Beatles') == []
+    assert parse_filter_query('{Artist} contains Beatles && nonsense') == [('Artist', 'contains', 'sensitive', 'Beatles')]
+
+def test_filter_text_operators():
+    assert get_filtered_songs('{Artist} contains Prince') == ["Purple Rain", "1999"]
+    assert get_filtered_songs('{Artist} contains prince') == []
+    assert get_filtered_songs('{Artist} icontains prince') == ["Purple Rain", "1999"]
+    assert get_filtered_songs('{Song} ieq "HEROES"') == ["Heroes"]
+    assert get_filtered_songs('{Song} contains "Rock && Roll"') == ["Rock && Roll"]
+    assert get_filtered_songs('{Date} datestartswith 2022') == ["Heroes", "Rock && Roll"]
+
+def test_filter_comparisons():
+    assert get_filtered_songs('{Year} = 1984') == ["Purple Rain"]
+    assert get_filtered_songs('{Year} > 1980') == ["Purple Rain", "1999"]
+    assert get_filtered_songs('{Year} <= 1977') == ["Help!", "Heroes"]
+    assert get_filtered_songs('{Year} != 1984') == ["Help!", "1999", "Heroes", "Rock && Roll"]
+    assert get_filtered_songs('{Artist} = Prince && {Year} < 1984') == ["1999"]
+
+def test_filter_blanks():
+    assert get_filtered_songs('{Album} is blank') == ["1999", "Rock && Roll"]
+    assert get_filtered_songs('{Album} is not blank') == ["Help!", "Purple Rain", "Heroes"]
+
+def test_filter_unknown_column_or_malformed_is_ignored():
+    everything = list(get_performance_frame()['Song'])
+    assert get_filtered_songs('{Nope} = 1') == everything
+    assert get_filtered_songs('{Artist} resembles Prince') == everything
+
+# ==================================================================================================
+# Paging
+# ==================================================================================================
+register_derived('test_performances', lambda data: get_performance_frame())
+
+def test_page_past_the_end_is_clamped():
+    data = Dataset({}, "test")
+    records, page_count, page_current = get_table_page('test_performances', data, page_current=6, page_size=2, filter_query='{Artist} = "Prince"')
+    assert (page_count, page_current) == (1, 0)
+    assert [record['Song'] for record in records] == ["Purple Rain", "1999"]
+
+def test_page_in_range_is_kept():
+    data = Dataset({}, "test")
+    records, page_count, page_current = get_table_page('test_performances', data, page_current=1, page_size=2)
+    assert (page_count, page_current) == (3, 1)
+    assert [record['Song'] for record in records] == ["1999", "Heroes"]
@@ -1,3 +1,4 @@
+import profiling
 from index import server as application
 
 if __name__ == "__main__":